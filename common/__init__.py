@@ -0,0 +1 @@
+"""Modules shared by the scraper and the emotion analyzer"""
@@ -0,0 +1,160 @@
+"""MongoDB index declarations for the tweets collection and an explain()-based check
+
+Run `python -m common.indexes` from the repository root to print the winning
+plan of every known query shape, `--create` builds the indexes first. The
+command exits non-zero when a shape still needs a collection scan, and
+`--drop-redundant` removes indexes older deployments built that nothing uses.
+Drops only happen from this command, never at service startup.
+
+None of the indexes is partial. The only selective predicate is analyzedAt
+null on the analyzer's page query, and author_unanalyzed already bounds it as
+an equality between the author and _id keys. A partial filter cannot select
+documents where analyzedAt is missing, which is how the scraper stores new
+tweets, and the planner only picks a partial index when the query implies
+its filter, so one would need a migration of every stored tweet first.
+"""
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from loguru import logger
+
+# Every index on the tweets collection, created at startup by both services
+TWEET_INDEXES = [
+    # Upserts from the scraper and updates from the analyzer
+    IndexModel([('tweetId', ASCENDING)], unique=True),
+    IndexModel([('createdAt', ASCENDING)]),
+    # Unanalyzed tweets of one author in _id order. analyzedAt is null until
+    # the analyzer writes a result, so the equality on null and the _id range
+    # are both index bounds and the sort needs no in-memory stage
+    IndexModel(
+        [('authorUsername', ASCENDING), ('analyzedAt', ASCENDING), ('_id', ASCENDING)],
+        name='author_unanalyzed'
+    ),
+    # Author timelines, newest first
+    IndexModel(
+        [('authorUsername', ASCENDING), ('createdAt', DESCENDING)],
+        name='author_timeline'
+    )
+]
+
+# Indexes older deployments built that nothing needs any more, dropped by
+# --drop-redundant. authorUsername_1 is a prefix of both author indexes above
+REDUNDANT_TWEET_INDEXES = ['authorUsername_1']
+
+
+def query_shapes() -> Dict[str, Dict]:
+    """The queries the services run against the tweets collection, with sample values"""
+    return {
+        'unanalyzed_by_author': {
+            'filter': {'authorUsername': 'elonmusk', 'analyzedAt': None, '_id': {'$gt': ObjectId()}},
+            'sort': [('_id', ASCENDING)],
+            'limit': 50
+        },
+        'tweet_by_id': {
+            'filter': {'tweetId': '0'}
+        },
+        'author_timeline': {
+            'filter': {'authorUsername': 'elonmusk'},
+            'sort': [('createdAt', DESCENDING)],
+            'limit': 20
+        },
+        'archive_range': {
+            'filter': {'createdAt': {'$lt': datetime.utcnow() - timedelta(days=30)}, 'analyzedAt': {'$ne': None}},
+            'sort': [('createdAt', ASCENDING)]
+        }
+    }
+
+
+def ensure_indexes(collection, indexes: List[IndexModel] = TWEET_INDEXES) -> List[str]:
+    """Create the declared indexes, returning their names"""
+    names = []
+    for index in indexes:
+        try:
+            names.extend(collection.create_indexes([index]))
+        except OperationFailure as e:
+            # An index with the same keys but other options already exists,
+            # it keeps serving queries until someone drops and rebuilds it
+            logger.warning(f"Could not create index {index.document['name']}: {e}")
+    return names
+
+
+def drop_redundant(collection, names: List[str] = REDUNDANT_TWEET_INDEXES) -> List[str]:
+    """Drop the listed indexes that exist, returning the names dropped"""
+    existing = collection.index_information()
+    dropped = []
+    for name in names:
+        if name not in existing:
+            continue
+        try:
+            collection.drop_index(name)
+            dropped.append(name)
+            logger.info(f"Dropped redundant index {name}")
+        except OperationFailure as e:
+            logger.warning(f"Could not drop index {name}: {e}")
+    return dropped
+
+
+def plan_stages(plan: Dict) -> Iterator[str]:
+    """Every stage name in an explain() plan tree"""
+    if 'stage' in plan:
+        yield plan['stage']
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from plan_stages(child)
+
+
+def explain_shapes(collection) -> Dict[str, Dict]:
+    """Winning plan stages and chosen index for every known query shape"""
+    report = {}
+    for name, shape in query_shapes().items():
+        cursor = collection.find(shape['filter'], shape.get('projection'))
+        if 'sort' in shape:
+            cursor = cursor.sort(shape['sort'])
+        if 'limit' in shape:
+            cursor = cursor.limit(shape['limit'])
+
+        winning = cursor.explain()['queryPlanner']['winningPlan']
+        stages = list(plan_stages(winning))
+        report[name] = {
+            'stages': stages,
+            'collscan': 'COLLSCAN' in stages,
+            'in_memory_sort': 'SORT' in stages
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check tweets collection query plans')
+    parser.add_argument('--create', action='store_true', help='create the declared indexes first')
+    parser.add_argument('--drop-redundant', action='store_true', help='drop indexes nothing queries any more')
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+    mongo_uri = os.getenv('MONGODB_URI', 'mongodb://mongo:27017/emotion_tweets')
+    collection = MongoClient(mongo_uri).emotion_tweets.tweets
+
+    if args.drop_redundant:
+        drop_redundant(collection)
+    if args.create:
+        ensure_indexes(collection)
+
+    report = explain_shapes(collection)
+    for name, result in report.items():
+        status = 'COLLSCAN' if result['collscan'] else 'ok'
+        if result['in_memory_sort']:
+            status += ' (in-memory sort)'
+        print(f"{name:24} {status:28} {' <- '.join(result['stages'])}")
+
+    if any(result['collscan'] for result in report.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""Prometheus-style counters and histograms with a /metrics HTTP endpoint
+
+Metrics live in a process-wide registry and are rendered in the Prometheus
+text exposition format. Updates are a lock and a few additions, cheap
+enough for the hot paths they instrument.
+
+The same server serves /debug/profile?seconds=N, which runs the sampling
+profiler for N seconds and returns collapsed stacks. Nothing samples unless
+that endpoint is called.
+"""
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+from loguru import logger
+
+from common.profiler import SamplingProfiler
+
+# Seconds, from a Redis round-trip to a slow inference batch
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with optional labels, one child per label combination"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def init_default(self):
+        # Unlabeled metrics are exported as zero before their first update
+        if not self.label_names:
+            self.default()
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.label_names)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def default(self):
+        return self.labels()
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for values, child in sorted(self.children.items()):
+            lines.extend(child.render(self.name, self.label_names, values))
+        return lines
+
+
+class CounterChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, label_names, values):
+        return [f'{name}{format_labels(label_names, values)} {format_value(self.value)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.default().inc(amount)
+
+
+class HistogramChild:
+    __slots__ = ('bounds', 'counts', 'total', 'count', 'lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def render(self, name, label_names, values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += count
+            le = f'le="{format_value(float(bound))}"'
+            lines.append(f'{name}_bucket{format_labels(label_names, values, le)} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(label_names, values)} {format_value(self.total)}')
+        lines.append(f'{name}_count{format_labels(label_names, values)} {self.count}')
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.bounds = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self.default().observe(value)
+
+    def time(self):
+        return self.default().time()
+
+
+class Registry:
+    """Every metric of the process, rendered together"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            # Modules imported twice or shared by both services get the same metric
+            metric = self.metrics.setdefault(metric.name, metric)
+        metric.init_default()
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def histogram(name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+# Round-trip times shared by both services
+MONGO_SECONDS = histogram('mongo_operation_seconds', 'MongoDB round-trip time', ('operation',))
+REDIS_SECONDS = histogram('redis_operation_seconds', 'Redis round-trip time', ('operation',))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            self.reply(200, self.registry.render(), 'text/plain; version=0.0.4')
+        elif url.path == '/debug/profile':
+            query = parse_qs(url.query)
+            seconds = min(float(query.get('seconds', ['10'])[0]), 300)
+            interval = float(query.get('interval', ['0.005'])[0])
+            try:
+                stacks = SamplingProfiler(interval).profile(seconds)
+            except RuntimeError as e:
+                self.reply(409, f'{e}\n', 'text/plain')
+                return
+            self.reply(200, stacks, 'text/plain')
+        else:
+            self.reply(404, 'not found\n', 'text/plain')
+
+    def reply(self, status: int, body: str, content_type: str):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the service log
+        pass
+
+
+def start_metrics_server(port: int, host: str = '0.0.0.0') -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics and /debug/profile on a daemon thread, port 0 disables it"""
+    if port <= 0:
+        return None
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Serving metrics on :{port}/metrics")
+    return server
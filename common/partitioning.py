@@ -0,0 +1,162 @@
+"""Consistent-hash partitioning of KOLs and events across service replicas
+
+Each replica heartbeats into a Redis sorted set per service, scored by the
+time of its last heartbeat. Members that miss heartbeats for `ttl` seconds
+are dropped by whichever replica notices first. Every replica builds the
+same hash ring with `vnodes` points per live member from that set, so they
+agree on the owner of each key without coordinating. A joining or leaving
+replica only moves the keys next to its own points, about 1/N of them.
+"""
+import os
+import time
+import socket
+import hashlib
+import threading
+from bisect import bisect_left
+from typing import Callable, Iterable, List, Optional
+from loguru import logger
+
+from common.metrics import counter
+
+REBALANCES = counter('partition_rebalances_total', 'Membership changes that rebuilt the hash ring', ('service',))
+
+
+def stable_hash(key: str) -> int:
+    """64-bit hash that is the same in every process, unlike hash()"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def shard_stream(base: str, key: str, shards: int) -> str:
+    """Stream shard for a key, the base stream itself when there is one shard"""
+    if shards <= 1:
+        return base
+    return f'{base}:{stable_hash(key) % shards}'
+
+
+def shard_streams(base: str, shards: int) -> List[str]:
+    if shards <= 1:
+        return [base]
+    return [f'{base}:{shard}' for shard in range(shards)]
+
+
+class HashRing:
+    """Immutable ring of `vnodes` points per member, rebuilt when membership changes"""
+
+    def __init__(self, members: Iterable[str] = (), vnodes: int = 64):
+        self.vnodes = max(vnodes, 1)
+        self.members = frozenset(members)
+        points = sorted(
+            (stable_hash(f'{member}#{i}'), member)
+            for member in self.members
+            for i in range(self.vnodes)
+        )
+        self.hashes = [point for point, _ in points]
+        self.owners = [member for _, member in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        """Member owning the first point at or after the key's hash"""
+        if not self.hashes:
+            return None
+        index = bisect_left(self.hashes, stable_hash(key))
+        return self.owners[index % len(self.owners)]
+
+
+class Membership:
+    """Heartbeat registration of one replica and its view of the hash ring"""
+
+    def __init__(
+        self,
+        redis_client,
+        service: str,
+        member_id: Optional[str] = None,
+        ttl: float = 15,
+        interval: float = 5,
+        vnodes: int = 64
+    ):
+        self.redis_client = redis_client
+        self.service = service
+        self.key = f'members:{service}'
+        self.member_id = member_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.ttl = ttl
+        self.interval = interval
+        self.vnodes = vnodes
+
+        # Alone until the first heartbeat, so a replica that never joins owns everything
+        self.ring = HashRing([self.member_id], vnodes)
+        self.listeners = []
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def on_change(self, listener: Callable[['Membership'], None]):
+        """Call listener with this membership after every ring rebuild"""
+        self.listeners.append(listener)
+
+    def heartbeat(self) -> bool:
+        """Refresh our entry, expire silent members and rebuild the ring if membership changed"""
+        now = time.time()
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.zadd(self.key, {self.member_id: now})
+            pipe.zremrangebyscore(self.key, '-inf', now - self.ttl)
+            pipe.zrange(self.key, 0, -1)
+            members = pipe.execute()[2]
+        except Exception as e:
+            # Keep the last known ring, other replicas drop us once the ttl passes
+            logger.error(f"{self.service} heartbeat failed: {e}")
+            return False
+        return self.update(members)
+
+    def update(self, members: Iterable[str]) -> bool:
+        members = frozenset(members) | {self.member_id}
+        if members == self.ring.members:
+            return False
+
+        previous = self.ring.members
+        self.ring = HashRing(members, self.vnodes)
+        REBALANCES.labels(self.service).inc()
+        logger.info(
+            f"{self.service} membership changed to {len(members)} replicas "
+            f"(joined {sorted(members - previous)}, left {sorted(previous - members)})"
+        )
+        self.notify()
+        return True
+
+    def notify(self):
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                logger.error(f"{self.service} rebalance listener failed: {e}")
+
+    def owns(self, key: str) -> bool:
+        return self.ring.owner(key) == self.member_id
+
+    def owned(self, keys: Iterable, key: Callable = str) -> List:
+        """The items whose key this replica owns"""
+        ring = self.ring
+        return [item for item in keys if ring.owner(key(item)) == self.member_id]
+
+    def loop(self):
+        while not self.stopping.wait(self.interval):
+            self.heartbeat()
+
+    def start(self):
+        """Join with one synchronous heartbeat, then keep heartbeating in the background
+
+        Listeners registered before start() always see the first ring, also
+        when this replica is alone and the heartbeat changed nothing.
+        """
+        if not self.heartbeat():
+            self.notify()
+        self.thread = threading.Thread(target=self.loop, name=f'{self.service}-membership', daemon=True)
+        self.thread.start()
+
+    def leave(self):
+        """Stop heartbeating and deregister so the others take over at their next heartbeat"""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        try:
+            self.redis_client.zrem(self.key, self.member_id)
+        except Exception as e:
+            logger.error(f"{self.service} could not leave membership: {e}")
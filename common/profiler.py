@@ -0,0 +1,113 @@
+"""Sampling profiler for finding hot paths in a running service
+
+A background thread snapshots every thread's stack with sys._current_frames()
+at a fixed interval and counts identical stacks. The output is in collapsed
+format, one `frame;frame;frame count` line per stack, ready for flamegraph.pl
+or speedscope.
+
+Nothing runs until the profiler is started, either through the metrics
+server (GET /debug/profile?seconds=30) or by sending SIGUSR2, which toggles
+sampling and writes the stacks to PROFILE_DIR when it is turned off.
+"""
+import os
+import sys
+import time
+import signal
+import threading
+from collections import Counter
+from typing import Optional
+from loguru import logger
+
+
+class SamplingProfiler:
+    """Counts thread stacks sampled every `interval` seconds"""
+
+    # Only one profiler samples at a time per process
+    active_lock = threading.Lock()
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = max(interval, 0.001)
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if not SamplingProfiler.active_lock.acquire(blocking=False):
+            raise RuntimeError("Another profile is already running")
+        self.stacks.clear()
+        self.samples = 0
+        self.running.set()
+        self.thread = threading.Thread(target=self.loop, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks"""
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            SamplingProfiler.active_lock.release()
+        return self.collapsed()
+
+    def profile(self, seconds: float) -> str:
+        self.start()
+        try:
+            time.sleep(seconds)
+        finally:
+            stacks = self.stop()
+        return stacks
+
+    def loop(self):
+        own = threading.get_ident()
+        names = {}
+        while self.running.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                self.stacks[self.stack(names.get(thread_id, str(thread_id)), frame)] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def stack(self, thread_name: str, frame) -> str:
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ';'.join(reversed(frames))
+
+    def collapsed(self) -> str:
+        lines = [f'{stack} {count}' for stack, count in self.stacks.most_common()]
+        return '\n'.join(lines) + '\n'
+
+
+def install_signal_toggle(service: str, output_dir: Optional[str] = None, interval: float = 0.005) -> Optional[SamplingProfiler]:
+    """Toggle profiling with SIGUSR2, writing stacks to output_dir on each stop"""
+    if not hasattr(signal, 'SIGUSR2'):
+        return None
+    output_dir = output_dir or os.getenv('PROFILE_DIR', '/tmp')
+    profiler = SamplingProfiler(interval)
+
+    def toggle(signum, frame):
+        if not profiler.running.is_set():
+            try:
+                profiler.start()
+            except RuntimeError as e:
+                logger.warning(f"Profiler not started: {e}")
+                return
+            logger.info("Sampling profiler started, send SIGUSR2 again to stop")
+            return
+
+        stacks = profiler.stop()
+        path = os.path.join(output_dir, f'{service}-profile-{time.strftime("%Y%m%d-%H%M%S")}.txt')
+        with open(path, 'w') as f:
+            f.write(stacks)
+        logger.info(f"Sampling profiler stopped after {profiler.samples} samples, stacks written to {path}")
+
+    signal.signal(signal.SIGUSR2, toggle)
+    return profiler
@@ -0,0 +1,279 @@
+"""Compact tweet record and the message encoding shared by both services
+
+TweetRecord keeps one tweet in __slots__ with the metrics flattened, in
+place of the nested document dicts. from_doc() and to_doc() convert from and
+to the MongoDB document shape, and to_row() gives the positional form used
+for encoding.
+
+Redis payloads are JSON by default so the NestJS backend can read them.
+REDIS_MESSAGE_FORMAT=msgpack switches publishers to a versioned binary
+frame: the byte 0xC1, a format version byte, then a msgpack body.
+msgpack never emits 0xC1 and it cannot start UTF-8 text, so decode() tells
+the two formats apart from the first byte. In the binary frame,
+datetimes are ext type 1 (int64 microseconds since the epoch, naive UTC
+like MongoDB returns), a TweetRecord is ext type 2 (its row) and a message
+that is a list of TweetRecords is ext type 3 (one array per row field).
+Rows and columns hold their datetimes as integer microseconds, so they
+unpack in one C call without an ext hook per field, and a column of
+datetimes converts through numpy. Subscribers of binary messages need a
+Redis connection without decode_responses, the frame is not valid UTF-8.
+"""
+import os
+import sys
+import json
+import struct
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple, Union
+from loguru import logger
+import numpy as np
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"msgpack not available, Redis messages stay JSON: {e}")
+    MSGPACK_AVAILABLE = False
+
+# Version 2 flattened records, version 1 nested a datetime ext per field
+FORMAT_VERSION = 2
+BINARY_MARKER = 0xC1
+DATETIME_EXT = 1
+RECORD_EXT = 2
+RECORDS_EXT = 3
+
+EPOCH = datetime(1970, 1, 1)
+packers = threading.local()
+METRIC_FIELDS = ('likes', 'retweets', 'replies', 'views')
+# Positions of created_at and scraped_at in a record row
+DATETIME_COLUMNS = (2, 15)
+
+
+class TweetRecord:
+    """One tweet with flat fields, about half the memory of its document dict"""
+
+    # Everything except the MongoDB _id, in encoding order
+    ROW_FIELDS = (
+        'tweet_id', 'content', 'created_at', 'author', 'followers',
+        'likes', 'retweets', 'replies', 'views',
+        'hashtags', 'mentions', 'keywords', 'event_ids',
+        'is_reply', 'is_retweet', 'scraped_at'
+    )
+    __slots__ = ('id',) + ROW_FIELDS
+
+    def __init__(
+        self,
+        tweet_id: str,
+        content: str = '',
+        created_at: Optional[datetime] = None,
+        author: Optional[str] = None,
+        followers: Optional[int] = None,
+        likes: Optional[int] = 0,
+        retweets: Optional[int] = 0,
+        replies: Optional[int] = 0,
+        views: Optional[int] = 0,
+        hashtags: Tuple[str, ...] = (),
+        mentions: Tuple[str, ...] = (),
+        keywords: Optional[Tuple[str, ...]] = None,
+        event_ids: Tuple[str, ...] = (),
+        is_reply: Optional[bool] = None,
+        is_retweet: Optional[bool] = None,
+        scraped_at: Optional[datetime] = None,
+        id=None
+    ):
+        self.id = id
+        self.tweet_id = tweet_id
+        self.content = content
+        self.created_at = created_at
+        # Pages are fetched per author, one string serves them all
+        self.author = sys.intern(author) if isinstance(author, str) else author
+        self.followers = followers
+        self.likes = likes
+        self.retweets = retweets
+        self.replies = replies
+        self.views = views
+        self.hashtags = tuple(hashtags)
+        self.mentions = tuple(mentions)
+        self.keywords = tuple(keywords) if keywords is not None else None
+        self.event_ids = tuple(event_ids)
+        self.is_reply = is_reply
+        self.is_retweet = is_retweet
+        self.scraped_at = scraped_at
+
+    @classmethod
+    def from_doc(cls, doc: Dict) -> 'TweetRecord':
+        """Record from a tweets collection document"""
+        metrics = doc.get('metrics') or {}
+        if isinstance(metrics, dict):
+            counts = [metrics.get(field, 0) for field in METRIC_FIELDS]
+        else:
+            # Left unreadable so scoring reports the tweet instead of scoring it as zero
+            counts = [None] * len(METRIC_FIELDS)
+        keywords = doc.get('keywords')
+
+        return cls(
+            doc['tweetId'],
+            content=doc.get('content') or '',
+            created_at=doc.get('createdAt'),
+            author=doc.get('authorUsername'),
+            followers=doc.get('authorFollowers'),
+            likes=counts[0],
+            retweets=counts[1],
+            replies=counts[2],
+            views=counts[3],
+            hashtags=doc.get('hashtags') or (),
+            mentions=doc.get('mentions') or (),
+            keywords=keywords,
+            event_ids=[str(event_id) for event_id in doc.get('eventIds') or ()],
+            is_reply=doc.get('isReply'),
+            is_retweet=doc.get('isRetweet'),
+            scraped_at=doc.get('scrapedAt'),
+            id=doc.get('_id')
+        )
+
+    def to_doc(self) -> Dict:
+        """Document fields for an upsert, leaving out the ones that were never set"""
+        doc = {
+            'tweetId': self.tweet_id,
+            'content': self.content,
+            'createdAt': self.created_at,
+            'authorUsername': self.author,
+            'authorFollowers': self.followers,
+            'metrics': {
+                field: getattr(self, field)
+                for field in METRIC_FIELDS
+                if getattr(self, field) is not None
+            },
+            'isReply': self.is_reply,
+            'isRetweet': self.is_retweet,
+            'keywords': list(self.keywords) if self.keywords is not None else None,
+            'hashtags': list(self.hashtags),
+            'mentions': list(self.mentions),
+            'eventIds': list(self.event_ids),
+            'scrapedAt': self.scraped_at
+        }
+        return {key: value for key, value in doc.items() if value is not None}
+
+    def to_row(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.ROW_FIELDS)
+
+    @classmethod
+    def from_row(cls, row) -> 'TweetRecord':
+        return cls(*row)
+
+    def to_packed_row(self) -> list:
+        """Row with its datetimes as microseconds, packable without a default hook"""
+        row = list(self.to_row())
+        for i in DATETIME_COLUMNS:
+            row[i] = to_micros(row[i])
+        return row
+
+    @classmethod
+    def from_packed_row(cls, row) -> 'TweetRecord':
+        row = list(row)
+        for i in DATETIME_COLUMNS:
+            row[i] = from_micros(row[i])
+        return cls(*row)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, TweetRecord):
+            return NotImplemented
+        return self.to_row() == other.to_row()
+
+    def __repr__(self) -> str:
+        return f'TweetRecord({self.tweet_id!r}, author={self.author!r}, created_at={self.created_at!r})'
+
+
+def message_format() -> str:
+    """Format for published messages, json unless every subscriber decodes the binary frame"""
+    return os.getenv('REDIS_MESSAGE_FORMAT', 'json')
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, TweetRecord):
+        return value.to_doc()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def to_micros(value: Optional[datetime]) -> Optional[int]:
+    """Microseconds since the epoch in naive UTC, None stays None"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_micros(micros: Optional[int]) -> Optional[datetime]:
+    return None if micros is None else EPOCH + timedelta(microseconds=micros)
+
+
+def pack_records(records: List[TweetRecord]) -> bytes:
+    """A batch of records as one array per row field"""
+    columns = [list(column) for column in zip(*(record.to_row() for record in records))]
+    for i in DATETIME_COLUMNS:
+        columns[i] = [to_micros(value) for value in columns[i]]
+    return row_packer().pack(columns)
+
+
+def unpack_records(data: bytes) -> List[TweetRecord]:
+    columns = list(msgpack.unpackb(data, raw=False, use_list=False))
+    for i in DATETIME_COLUMNS:
+        if None in columns[i]:
+            columns[i] = [from_micros(value) for value in columns[i]]
+        else:
+            # One C loop instead of a timedelta per value
+            columns[i] = np.array(columns[i], dtype=np.int64).astype('datetime64[us]').tolist()
+    return [TweetRecord(*row) for row in zip(*columns)]
+
+
+def pack_default(value):
+    if isinstance(value, datetime):
+        return msgpack.ExtType(DATETIME_EXT, struct.pack('>q', to_micros(value)))
+    if isinstance(value, TweetRecord):
+        return msgpack.ExtType(RECORD_EXT, row_packer().pack(value.to_packed_row()))
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def row_packer() -> 'msgpack.Packer':
+    """Packer for record rows, one per thread instead of one per record"""
+    packer = getattr(packers, 'row', None)
+    if packer is None:
+        packer = packers.row = msgpack.Packer(use_bin_type=True)
+    return packer
+
+
+def ext_hook(code: int, data: bytes):
+    if code == DATETIME_EXT:
+        return from_micros(struct.unpack('>q', data)[0])
+    if code == RECORD_EXT:
+        return TweetRecord.from_packed_row(msgpack.unpackb(data, raw=False, use_list=False))
+    if code == RECORDS_EXT:
+        return unpack_records(data)
+    return msgpack.ExtType(code, data)
+
+
+def encode(message: Any, fmt: str = 'json') -> Union[bytes, str]:
+    """Serialize a message for Redis, as JSON text or a binary frame"""
+    if fmt == 'msgpack' and MSGPACK_AVAILABLE:
+        if isinstance(message, list) and message and all(isinstance(item, TweetRecord) for item in message):
+            # A batch of tweets packs column by column, one ext for the whole list
+            message = msgpack.ExtType(RECORDS_EXT, pack_records(message))
+        body = msgpack.packb(message, default=pack_default, use_bin_type=True)
+        return bytes((BINARY_MARKER, FORMAT_VERSION)) + body
+    return json.dumps(message, default=json_default)
+
+
+def decode(payload: Union[bytes, str]) -> Any:
+    """Parse a payload in either format"""
+    if isinstance(payload, (bytes, bytearray)) and payload[:1] == bytes((BINARY_MARKER,)):
+        if not MSGPACK_AVAILABLE:
+            raise ValueError("Binary message received but msgpack is not installed")
+        version = payload[1]
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported message format version {version}")
+        return msgpack.unpackb(payload[2:], ext_hook=ext_hook, raw=False, strict_map_key=False)
+    return json.loads(payload)
@@ -1,20 +1,128 @@
 import os
-import json
+import sys
+import time
 import asyncio
 from datetime import datetime
 import redis
-from pymongo import MongoClient
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-import torch
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 from loguru import logger
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
+# Shared modules sit next to the service in the image and one level up in the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.indexes import ensure_indexes
+from common.metrics import counter, histogram, start_metrics_server, MONGO_SECONDS, SIZE_BUCKETS
+from common.profiler import install_signal_toggle
+from common.partitioning import Membership
+from common.records import TweetRecord, encode, message_format
+from cache import InferenceCache, normalize_text, copy_result
+from work_queue import TweetWorkQueue
+from kol_updates import KolUpdatePublisher
+from rollups import store_from_env
+from service import AnalyzerService
+from inference import InferenceWorkerPool, WorkerPoolError, run_pipeline
+from batching import DynamicBatcher
+from backends import load_backend
+from startup import StartupTimer, mark_ready, clear_ready
+from trends import TrendAggregator
+from anomaly import AnomalyDetector
+from chunking import TextChunker, AGGREGATIONS, aggregate
+from scoring import propagation_score, to_columns, score_columns
 
 # Configure logger
 logger.add("emotion_analyzer.log", rotation="500 MB", level="INFO")
 
+# Prometheus metrics served on METRICS_PORT
+INFERENCE_SECONDS = histogram('emotion_inference_seconds', 'Time to run a set of micro-batches through the model')
+BATCH_SIZE = histogram('emotion_batch_size', 'Texts per inference micro-batch', buckets=SIZE_BUCKETS)
+TWEETS_ANALYZED = counter('emotion_tweets_analyzed_total', 'Tweets with an emotion result written')
+TWEETS_FAILED = counter('emotion_tweets_failed_total', 'Tweets whose result could not be written')
+TWEETS_SKIPPED = counter('emotion_tweets_skipped_total', 'Tweets not written because another writer analyzed them first or they were deleted')
+FALLBACKS = counter('emotion_fallback_total', 'Texts scored neutral because inference failed')
+MONGO_BULK_WRITE = MONGO_SECONDS.labels('bulk_write')
+MONGO_FIND = MONGO_SECONDS.labels('find_unanalyzed')
+
+# Fields a TweetRecord is built from when fetching tweets to analyze
+TWEET_PROJECTION = {
+    'tweetId': 1,
+    'content': 1,
+    'createdAt': 1,
+    'authorUsername': 1,
+    'authorFollowers': 1,
+    'metrics': 1,
+    'eventIds': 1
+}
+
 class EmotionAnalyzer:
-    def __init__(self):
+    def __init__(self, service: bool = True):
+        """Load the model and connect to the stores
+
+        service=False builds only the model and persistence parts, for jobs
+        like the backfill that run next to the live service: the readiness
+        file, indexes, trend snapshot, work queue and publisher threads are
+        left alone, and the model is not warmed up.
+        """
+        self.startup = StartupTimer()
+        self.ready_file = os.getenv('EMOTION_READY_FILE', '/tmp/emotion-analyzer.ready')
+        # A restarted container may still hold the previous run's file
+        if service:
+            clear_ready(self.ready_file)
+        
+        # Initialize emotion analysis model
+        model_name = os.getenv('MODEL_NAME', 'uer/chinese_roberta_L-12_H-768')
+        
+        # Inference batching
+        self.batch_size = max(int(os.getenv('EMOTION_BATCH_SIZE', 32)), 1)
+        self.max_length = int(os.getenv('EMOTION_MAX_LENGTH', 512))
+        
+        # Token-aware chunking of long documents, falls back to character truncation
+        self.chunking = os.getenv('EMOTION_CHUNKING', 'true').lower() == 'true'
+        self.chunk_stride = int(os.getenv('EMOTION_CHUNK_STRIDE', 64))
+        self.chunk_aggregation = os.getenv('EMOTION_CHUNK_AGGREGATION', 'weighted')
+        if self.chunk_aggregation not in AGGREGATIONS:
+            raise ValueError(f"EMOTION_CHUNK_AGGREGATION must be one of {AGGREGATIONS}")
+        
+        # Inference backend: fp32 pipeline, int8 quantized or ONNX Runtime
+        self.backend = os.getenv('EMOTION_BACKEND', 'pytorch')
+        
+        logger.info(f"Loading model: {model_name}")
+        backend = {
+            'name': self.backend,
+            'model_name': model_name,
+            'onnx_path': os.getenv('EMOTION_ONNX_PATH', 'models/onnx'),
+            'threads': int(os.getenv('INFERENCE_THREADS_PER_WORKER', 0)),
+            # Pre-serialized copy on local disk, filled on first start or at image build
+            'cache_dir': os.getenv('EMOTION_MODEL_CACHE', 'models/cache')
+        }
+        self.emotion_pipeline = load_backend(**backend)
+        
+        self.chunker = None
+        self.text_limit = self.max_length
+        tokenizer = getattr(self.emotion_pipeline, 'tokenizer', None)
+        if self.chunking and tokenizer is not None:
+            self.chunker = TextChunker(
+                tokenizer,
+                max_tokens=int(os.getenv('EMOTION_MAX_TOKENS', 0)),
+                stride=self.chunk_stride
+            )
+            self.text_limit = int(os.getenv('EMOTION_MAX_DOCUMENT_CHARS', 20000))
+        self.startup.lap('model_load')
+        
+        # Fork inference workers sharing the loaded weights, before any client
+        # or thread exists so no child inherits a lock held by another thread
+        self.worker_pool = None
+        workers = int(os.getenv('INFERENCE_WORKERS', 0))
+        if workers > 0:
+            self.worker_pool = InferenceWorkerPool(
+                self.emotion_pipeline,
+                workers,
+                backend,
+                threads_per_worker=int(os.getenv('INFERENCE_THREADS_PER_WORKER', 0))
+            )
+            self.startup.lap('worker_pool')
+        
         self.redis_client = redis.Redis(
             host=os.getenv('REDIS_HOST', 'redis'),
             port=int(os.getenv('REDIS_PORT', 6379)),
@@ -26,17 +134,58 @@ class EmotionAnalyzer:
         self.db = self.mongo_client.emotion_tweets
         self.tweets_collection = self.db.tweets
         
-        # Initialize emotion analysis model
-        model_name = os.getenv('MODEL_NAME', 'uer/chinese_roberta_L-12_H-768')
-        self.device = 0 if torch.cuda.is_available() else -1
+        # Minute/hour/day buckets per KOL and event, updated as results are written
+        self.rollups = store_from_env(self.db)
         
-        logger.info(f"Loading model: {model_name}")
-        self.emotion_pipeline = pipeline(
-            "sentiment-analysis",
-            model=model_name,
-            device=self.device
+        # Indexes for the unanalyzed-per-author and trend query shapes, the
+        # schema belongs to the live service and offline jobs leave it alone
+        if service:
+            ensure_indexes(self.tweets_collection)
+            self.rollups.ensure_indexes()
+        self.startup.lap('connect')
+        
+        # Bulk write metrics
+        self.write_stats = {'operations': 0, 'round_trips': 0, 'failed': 0}
+        
+        # Content-hash inference cache shared across replicas through Redis, keyed
+        # per backend, truncation and chunking since each changes the scores
+        self.inference_cache = InferenceCache(
+            model_name,
+            max_size=int(os.getenv('EMOTION_CACHE_SIZE', 10000)),
+            redis_client=self.redis_client,
+            ttl=int(os.getenv('EMOTION_CACHE_TTL', 86400)),
+            settings={
+                'backend': self.backend,
+                'text_limit': self.text_limit,
+                'chunk_tokens': self.chunker.max_tokens if self.chunker is not None else None,
+                'chunk_stride': self.chunker.stride if self.chunker is not None else None,
+                'aggregation': self.chunk_aggregation
+            }
         )
         
+        # Length-bucketed batches shared by every caller, flushed on a token budget or deadline
+        self.batcher = None
+        if service and os.getenv('EMOTION_DYNAMIC_BATCHING', 'true').lower() == 'true':
+            longest = self.chunker.max_tokens if self.chunker is not None else self.text_limit
+            bounds = [bound for bound in (16, 32, 64, 128, 256) if bound < longest] + [longest]
+            self.batcher = DynamicBatcher(
+                self.infer_batches,
+                max_tokens=int(os.getenv('EMOTION_BATCH_MAX_TOKENS', 4096)),
+                max_batch_size=self.batch_size,
+                max_wait=int(os.getenv('EMOTION_BATCH_MAX_WAIT_MS', 10)) / 1000,
+                bounds=bounds,
+                parallel=workers if self.worker_pool is not None else 1,
+                # Threads that call analyze_emotions concurrently in the service
+                callers=int(os.getenv('ANALYZER_INFERENCE_THREADS', 1))
+            )
+        
+        # Run each configured batch size once before taking traffic
+        sizes = os.getenv('EMOTION_WARMUP_BATCH_SIZES', f'1,{self.batch_size}')
+        self.warmup_batch_sizes = [int(size) for size in sizes.split(',') if size.strip()]
+        if service:
+            self.warm_up()
+            self.startup.lap('warm_up')
+        
         # Define emotion categories
         self.emotion_map = {
             'POSITIVE': 'joy',
@@ -46,45 +195,166 @@ class EmotionAnalyzer:
             'neutral': 'neutral'
         }
         
-        # Subscribe to Redis channel
-        self.pubsub = self.redis_client.pubsub()
-        self.pubsub.subscribe('new_tweets')
+        # Incremental sliding-window trends, restored from the last snapshot
+        self.trend_window = int(os.getenv('TREND_WINDOW', 3600))
+        self.trend_snapshot_key = os.getenv('TREND_SNAPSHOT_KEY', 'trends:snapshot')
+        windows = [int(w) for w in os.getenv('TREND_WINDOWS', '60,300,3600').split(',')]
+        self.trend_aggregator = TrendAggregator(
+            sorted(set(windows + [self.trend_window])),
+            buckets=int(os.getenv('TREND_BUCKETS', 60))
+        )
+        if service:
+            self.trend_aggregator.restore(self.redis_client, self.trend_snapshot_key)
+            self.startup.lap('restore_trends')
+        
+        # Per-KOL and per-event spike detection
+        self.anomaly_detector = AnomalyDetector(
+            alpha=float(os.getenv('ANOMALY_ALPHA', 0.05)),
+            threshold=float(os.getenv('ANOMALY_Z_THRESHOLD', 4.0)),
+            min_samples=int(os.getenv('ANOMALY_MIN_SAMPLES', 20)),
+            cusum_k=float(os.getenv('ANOMALY_CUSUM_K', 0.5)),
+            cusum_h=float(os.getenv('ANOMALY_CUSUM_H', 10.0)),
+            cooldown=float(os.getenv('ANOMALY_COOLDOWN', 600))
+        )
+        
+        # JSON for the NestJS backend unless REDIS_MESSAGE_FORMAT=msgpack
+        self.message_format = message_format()
+        
+        self.queue_read_count = int(os.getenv('NEW_TWEETS_READ_COUNT', 100))
+        self.queue_block_ms = int(os.getenv('NEW_TWEETS_BLOCK_MS', 5000))
+        self.fetch_limit = int(os.getenv('NEW_TWEETS_FETCH_LIMIT', 50))
+        
+        self.work_queue = None
+        self.membership = None
+        self.kol_updates = None
+        if service:
+            # Consume new tweet notifications from the Redis Stream consumer group
+            self.work_queue = TweetWorkQueue(self.redis_client)
+            
+            # Live replicas split the notification shards by consistent hashing. One
+            # shard has nothing to split, every replica reads it through the group
+            if self.work_queue.shards > 1:
+                self.membership = Membership(
+                    self.redis_client,
+                    'emotion-analyzer',
+                    member_id=self.work_queue.consumer,
+                    ttl=float(os.getenv('PARTITION_TTL_SECONDS', 15)),
+                    interval=float(os.getenv('PARTITION_HEARTBEAT_SECONDS', 5)),
+                    vnodes=int(os.getenv('PARTITION_VNODES', 64))
+                )
+                self.membership.on_change(self.work_queue.assign)
+            
+            # KOL scores coalesced per flush window and published as batched events
+            self.kol_updates = KolUpdatePublisher(
+                self.redis_client,
+                flush_interval=int(os.getenv('KOL_UPDATE_FLUSH_MS', 250)) / 1000,
+                max_batch=int(os.getenv('KOL_UPDATE_MAX_BATCH', 200)),
+                message_format=self.message_format
+            )
         
+        self.startup.lap('init')
         logger.info("Emotion Analyzer initialized")
+        self.startup.log()
+    
+    def warm_up(self):
+        """Push one batch per warm-up size through the model, bypassing the cache"""
+        if not self.warmup_batch_sizes:
+            return
+        
+        text = 'Warm-up tweet so kernels and buffers are ready 预热'
+        batches = [[text] * size for size in self.warmup_batch_sizes]
+        if self.worker_pool is not None:
+            # Tasks go to whichever worker is free, send enough for every one
+            batches = batches * self.worker_pool.workers
+        self.infer_batches(batches)
     
     def analyze_emotion(self, text: str) -> Dict:
         """Analyze emotion from text"""
-        try:
-            # Basic cleaning
-            text = text.strip()
-            if not text:
-                return {
-                    'emotion': 'neutral',
-                    'score': 0.5,
-                    'raw_scores': {}
-                }
-            
-            # Run sentiment analysis
-            results = self.emotion_pipeline(text[:512])  # Limit text length
-            
-            if results:
-                result = results[0]
-                emotion = self.emotion_map.get(result['label'], 'neutral')
-                score = result['score']
-                
-                # Calculate emotion propagation score
-                propagation_score = self.calculate_propagation_score(emotion, score)
-                
-                return {
-                    'emotion': emotion,
-                    'score': score,
-                    'propagation_score': propagation_score,
-                    'raw_scores': {result['label']: result['score']}
-                }
-            
-        except Exception as e:
-            logger.error(f"Error analyzing emotion: {e}")
+        return self.analyze_emotions([text])[0]
+    
+    def analyze_emotions(self, texts: List[str]) -> List[Dict]:
+        """Analyze emotion for many texts using the cache and batched forward passes"""
+        results = [None] * len(texts)
+        pending = {}
+        
+        for i, text in enumerate(texts):
+            # Basic cleaning, limit text length
+            text = normalize_text(text, self.text_limit)
+            if text:
+                pending.setdefault(text, []).append(i)
+            else:
+                # Empty texts never reach the model
+                results[i] = self.fallback_result()
+        
+        # Serve repeated texts from the cache
+        cached = self.inference_cache.get_many(list(pending))
+        for text, result in cached.items():
+            for i in pending.pop(text):
+                results[i] = copy_result(result)
+        
+        # Long documents become several token-sized chunks
+        unique = list(pending)
+        if self.chunker is not None:
+            chunks, owners, lengths = self.chunker.split(unique)
+        else:
+            chunks, owners, lengths = unique, list(range(len(unique))), [1] * len(unique)
+        
+        if self.batcher is not None:
+            # Without a tokenizer, character counts stand in for token counts
+            sizes = lengths if self.chunker is not None else [len(chunk) for chunk in chunks]
+            distributions = self.batcher.infer(chunks, sizes)
+        else:
+            # Chunks of all documents share the same size-capped micro-batches
+            batches = [chunks[start:start + self.batch_size] for start in range(0, len(chunks), self.batch_size)]
+            distributions = [output for outputs in self.infer_batches(batches) for output in outputs]
+        
+        per_document = [([], []) for _ in unique]
+        for owner, distribution, length in zip(owners, distributions, lengths):
+            per_document[owner][0].append(distribution)
+            per_document[owner][1].append(length)
+        
+        fresh = {}
+        for text, (document_distributions, document_lengths) in zip(unique, per_document):
+            output = aggregate(document_distributions, document_lengths, self.chunk_aggregation)
+            if output is None:
+                FALLBACKS.inc(len(pending[text]))
+                result = self.fallback_result()
+            else:
+                result = fresh[text] = self.build_result(output)
+            for i in pending[text]:
+                results[i] = copy_result(result)
+        
+        self.inference_cache.put_many(fresh)
+        
+        return results
+    
+    def infer_batches(self, batches: List[List[str]]) -> List[List[Optional[List[Dict]]]]:
+        """Run micro-batches on the worker pool or in process, keeping their order"""
+        for batch in batches:
+            BATCH_SIZE.observe(len(batch))
+        
+        with INFERENCE_SECONDS.time():
+            if self.worker_pool is not None and batches:
+                return self.worker_pool.map(batches)
+            return [run_pipeline(self.emotion_pipeline, batch) for batch in batches]
+    
+    def build_result(self, result: Dict) -> Dict:
+        """Convert a raw pipeline output into an emotion result"""
+        emotion = self.emotion_map.get(result['label'], 'neutral')
+        score = result['score']
+        
+        # Calculate emotion propagation score
+        propagation_score = self.calculate_propagation_score(emotion, score)
         
+        return {
+            'emotion': emotion,
+            'score': score,
+            'propagation_score': propagation_score,
+            'raw_scores': {result['label']: result['score']}
+        }
+    
+    def fallback_result(self) -> Dict:
+        """Unscored neutral result, for texts with no content or when inference fails"""
         return {
             'emotion': 'neutral',
             'score': 0.5,
@@ -94,192 +364,317 @@ class EmotionAnalyzer:
     
     def calculate_propagation_score(self, emotion: str, score: float) -> float:
         """Calculate emotion propagation score based on emotion type and intensity"""
-        # Emotions have different propagation rates
-        emotion_weights = {
-            'joy': 0.8,
-            'anger': 1.2,
-            'fear': 1.1,
-            'sadness': 0.9,
-            'surprise': 1.0,
-            'neutral': 0.5
-        }
-        
-        weight = emotion_weights.get(emotion, 0.7)
-        
-        # Stronger emotions propagate more
-        intensity_factor = score ** 2
-        
-        return weight * intensity_factor * 10
+        return propagation_score(emotion, score)
     
-    def process_tweet_batch(self, tweets: List[Dict]) -> List[Dict]:
+    def process_tweet_batch(self, tweets: List[TweetRecord]) -> List[Dict]:
         """Process a batch of tweets for emotion analysis"""
-        results = []
+        return self.persist_tweet_batch(tweets, self.infer_tweets(tweets))
+    
+    def infer_tweets(self, tweets: List[TweetRecord]) -> List[Dict]:
+        """Run inference for a whole batch of tweets"""
+        try:
+            return self.analyze_emotions([tweet.content or '' for tweet in tweets])
+        except WorkerPoolError:
+            # Nothing is written, the stream entries stay pending and are redelivered
+            raise
+        except Exception as e:
+            logger.error(f"Error running batched inference: {e}")
+            FALLBACKS.inc(len(tweets))
+            return [self.fallback_result() for _ in tweets]
+    
+    def persist_tweet_batch(
+        self,
+        tweets: List[TweetRecord],
+        emotion_results: List[Dict],
+        live: bool = True,
+        rollup: bool = True
+    ) -> List[Dict]:
+        """Score engagement and write emotion results for an inferred batch
+
+        Historical re-analysis passes live=False so old tweets do not reach
+        the live trend windows and anomaly baselines, and rollup=False when
+        the tweets were already counted in the rollups. With rollup=True only
+        tweets that are still unanalyzed are written, so a tweet analyzed by
+        two replicas or by the backfill at once is counted once. Nothing is
+        ever upserted, a tweet deleted since it was fetched stays deleted.
+        """
+        operations = []
+        pending = []
+        sources = []
+        timestamps = []
+        # One stamp per batch, in the millisecond precision MongoDB stores, tells
+        # the tweets this write updated from ones another writer got to first
+        analyzed_at = datetime.utcnow()
+        analyzed_at = analyzed_at.replace(microsecond=analyzed_at.microsecond // 1000 * 1000)
         
-        for tweet in tweets:
+        # Engagement rate and propagation score for the whole batch in one pass
+        columns, valid = to_columns(tweets, emotion_results)
+        engagement_rates, propagation_scores = score_columns(**columns)
+        
+        for i, (tweet, emotion_result) in enumerate(zip(tweets, emotion_results)):
             try:
-                # Analyze emotion
-                emotion_result = self.analyze_emotion(tweet['content'])
+                if not valid[i]:
+                    raise ValueError("malformed metrics or emotion result")
                 
-                # Calculate emotion propagation metrics
-                metrics = tweet.get('metrics', {})
-                engagement_rate = (
-                    metrics.get('likes', 0) + 
-                    metrics.get('retweets', 0) * 2 + 
-                    metrics.get('replies', 0) * 1.5
-                ) / max(tweet.get('authorFollowers', 1), 1)
+                engagement_rate = float(engagement_rates[i])
                 
                 # Update emotion propagation score based on engagement
-                emotion_result['propagation_score'] *= (1 + engagement_rate)
+                emotion_result['propagation_score'] = float(propagation_scores[i])
                 
                 # Update tweet with emotion data
                 update_data = {
                     'emotion': emotion_result,
-                    'analyzedAt': datetime.utcnow(),
+                    'analyzedAt': analyzed_at,
                     'engagementRate': engagement_rate
                 }
                 
-                # Update in MongoDB
-                self.tweets_collection.update_one(
-                    {'tweetId': tweet['tweetId']},
-                    {'$set': update_data}
-                )
-                
-                results.append({
-                    'tweetId': tweet['tweetId'],
+                if rollup:
+                    # A tweet someone else analyzed first no longer matches and is skipped
+                    operations.append(UpdateOne(
+                        {'tweetId': tweet.tweet_id, 'analyzedAt': None},
+                        {'$set': update_data}
+                    ))
+                else:
+                    operations.append(UpdateOne(
+                        {'tweetId': tweet.tweet_id},
+                        {'$set': update_data}
+                    ))
+                pending.append({
+                    'tweetId': tweet.tweet_id,
                     'emotion': emotion_result['emotion'],
                     'score': emotion_result['score'],
                     'propagation_score': emotion_result['propagation_score']
                 })
+                sources.append((tweet.author, tweet.event_ids))
+                created = tweet.created_at
+                timestamps.append(created if isinstance(created, datetime) else analyzed_at)
                 
             except Exception as e:
-                logger.error(f"Error processing tweet {tweet.get('tweetId')}: {e}")
+                logger.error(f"Error processing tweet {tweet.tweet_id}: {e}")
+        
+        # Update in MongoDB with a single round-trip
+        failed, skipped = self.bulk_write(operations, [r['tweetId'] for r in pending], analyzed_at)
+        kept = [i for i in range(len(pending)) if i not in failed and i not in skipped]
+        results = [pending[i] for i in kept]
+        TWEETS_ANALYZED.inc(len(results))
+        TWEETS_SKIPPED.inc(len(skipped))
+        TWEETS_FAILED.inc(len(tweets) - len(results) - len(skipped))
+        
+        # Queued for the rollup flush thread, off the write path
+        if rollup:
+            self.rollups.record(results, [sources[i] for i in kept], [timestamps[i] for i in kept])
+        
+        # Feed the in-memory trend windows and anomaly baselines
+        if live:
+            self.trend_aggregator.add(results)
+            self.detect_anomalies(results, [sources[i] for i in kept])
         
         return results
     
-    async def process_new_tweets(self):
-        """Process new tweets from Redis subscription"""
-        logger.info("Starting to process new tweets")
-        
-        for message in self.pubsub.listen():
-            if message['type'] == 'message':
-                try:
-                    data = json.loads(message['data'])
-                    username = data.get('username')
-                    
-                    logger.info(f"Processing new tweets for @{username}")
-                    
-                    # Get unanalyzed tweets
-                    tweets = list(self.tweets_collection.find({
-                        'authorUsername': username,
-                        'emotion': {'$exists': False}
-                    }).limit(50))
-                    
-                    if tweets:
-                        results = self.process_tweet_batch(tweets)
-                        
-                        # Calculate aggregate emotion metrics
-                        if results:
-                            avg_score = np.mean([r['score'] for r in results])
-                            avg_propagation = np.mean([r['propagation_score'] for r in results])
-                            
-                            # Update KOL emotion score in Redis
-                            kol_data = {
-                                'username': username,
-                                'emotionScore': avg_score,
-                                'propagationScore': avg_propagation,
-                                'lastAnalyzed': datetime.utcnow().isoformat()
-                            }
-                            
-                            self.redis_client.hset(
-                                f'kol:{username}',
-                                mapping=kol_data
-                            )
-                            
-                            # Publish emotion update event
-                            self.redis_client.publish(
-                                'emotion_updates',
-                                json.dumps({
-                                    'type': 'kol_emotion_update',
-                                    'data': kol_data
-                                })
-                            )
-                            
-                            logger.info(f"Analyzed {len(results)} tweets for @{username}")
-                    
-                except Exception as e:
-                    logger.error(f"Error processing message: {e}")
+    def detect_anomalies(self, results: List[Dict], sources: List[Tuple]):
+        """Update per-KOL and per-event baselines and publish spikes"""
+        keys = []
+        values = []
+        
+        for result, (author, event_ids) in zip(results, sources):
+            if author:
+                keys.append(('kol', result['emotion'], author))
+                values.append(result['propagation_score'])
+            for event_id in event_ids:
+                keys.append(('event', result['emotion'], str(event_id)))
+                values.append(result['propagation_score'])
+        
+        try:
+            self.publish_alerts(self.anomaly_detector.observe(keys, values))
+        except Exception as e:
+            logger.error(f"Error detecting anomalies: {e}")
     
-    def analyze_emotion_trends(self):
-        """Analyze emotion trends and detect anomalies"""
+    def publish_alerts(self, alerts: List[Dict]):
+        """Publish detector alerts on the alerts channel"""
+        for alert in alerts:
+            scope, emotion, target = alert['key']
+            severity = 'high' if alert['z_score'] >= 2 * self.anomaly_detector.threshold else 'medium'
+            
+            self.redis_client.publish(
+                'alerts',
+                encode({
+                    'type': 'emotion_spike',
+                    'scope': scope,
+                    'target': target,
+                    'emotion': emotion,
+                    'severity': severity,
+                    'propagation_score': alert['value'],
+                    'baseline': alert['baseline'],
+                    'z_score': alert['z_score'],
+                    'timestamp': datetime.utcnow().isoformat()
+                }, self.message_format)
+            )
+            
+            logger.warning(
+                f"Emotion spike detected: {emotion} for {scope} {target} with propagation score "
+                f"{alert['value']:.2f} (baseline {alert['baseline']:.2f}, z={alert['z_score']:.1f})"
+            )
+    
+    def bulk_write(self, operations: List, tweet_ids: List[str], analyzed_at: datetime) -> Tuple[set, set]:
+        """Send result updates as one unordered bulk write
+
+        Returns the indexes that failed and the indexes whose filter matched
+        no tweet, because another writer analyzed it first or it was deleted.
+        """
+        if not operations:
+            return set(), set()
+        
+        failed = set()
+        skipped = set()
+        started = time.perf_counter()
         try:
-            # Get recent tweets
-            pipeline = [
-                {
-                    '$match': {
-                        'analyzedAt': {
-                            '$gte': datetime.utcnow() - timedelta(hours=1)
-                        }
-                    }
-                },
-                {
-                    '$group': {
-                        '_id': '$emotion.emotion',
-                        'count': {'$sum': 1},
-                        'avgScore': {'$avg': '$emotion.score'},
-                        'avgPropagation': {'$avg': '$emotion.propagation_score'}
-                    }
+            matched = self.tweets_collection.bulk_write(operations, ordered=False).matched_count
+        except BulkWriteError as e:
+            # Unordered writes keep going, only the reported documents failed
+            matched = e.details.get('nMatched', 0)
+            for error in e.details.get('writeErrors', []):
+                failed.add(error['index'])
+                logger.error(f"Error updating tweet {tweet_ids[error['index']]}: {error.get('errmsg')}")
+        except Exception as e:
+            logger.error(f"Error writing batch of {len(operations)} tweets: {e}")
+            matched = 0
+            failed = set(range(len(operations)))
+        
+        # Only a short count needs a look at which tweets now carry this batch's stamp
+        attempted = [i for i in range(len(operations)) if i not in failed]
+        if matched < len(attempted):
+            try:
+                written = {
+                    doc['tweetId'] for doc in self.tweets_collection.find(
+                        {'tweetId': {'$in': [tweet_ids[i] for i in attempted]}, 'analyzedAt': analyzed_at},
+                        {'tweetId': 1}
+                    )
                 }
-            ]
+                skipped = {i for i in attempted if tweet_ids[i] not in written}
+            except Exception as e:
+                # Unknown outcome, dropped from the rollups rather than counted twice
+                logger.error(f"Error checking which of {len(attempted)} tweets were written: {e}")
+                failed.update(attempted)
+        MONGO_BULK_WRITE.observe(time.perf_counter() - started)
+        
+        self.write_stats['operations'] += len(operations)
+        self.write_stats['round_trips'] += 1
+        self.write_stats['failed'] += len(failed)
+        logger.debug(
+            f"Bulk write: {len(operations)} ops, {len(failed)} failed, "
+            f"{self.writes_per_round_trip():.1f} writes per round-trip"
+        )
+        
+        return failed, skipped
+    
+    def writes_per_round_trip(self) -> float:
+        """Average number of write operations sent per MongoDB round-trip"""
+        return self.write_stats['operations'] / max(self.write_stats['round_trips'], 1)
+    
+    def fetch_unanalyzed(self, username: str, after_id=None) -> List[TweetRecord]:
+        """Fetch one page of a user's unanalyzed tweets in _id order"""
+        query = {
+            'authorUsername': username,
+            # Null until a result is written, served by the author_unanalyzed index
+            'analyzedAt': None
+        }
+        if after_id is not None:
+            query['_id'] = {'$gt': after_id}
+        
+        with MONGO_FIND.time():
+            cursor = self.tweets_collection.find(query, TWEET_PROJECTION).sort('_id', 1).limit(self.fetch_limit)
+            return [TweetRecord.from_doc(doc) for doc in cursor]
+    
+    def process_user_tweets(self, username: str) -> List[Dict]:
+        """Analyze every unanalyzed tweet of a user and update the KOL aggregate"""
+        logger.info(f"Processing new tweets for @{username}")
+        results = []
+        
+        # Drain the backlog in pages so a burst costs one notification
+        after_id = None
+        while True:
+            tweets = self.fetch_unanalyzed(username, after_id)
+            if not tweets:
+                break
             
-            trends = list(self.tweets_collection.aggregate(pipeline))
+            results.extend(self.process_tweet_batch(tweets))
             
-            # Check for anomalies
-            for trend in trends:
-                emotion = trend['_id']
-                count = trend['count']
-                avg_propagation = trend['avgPropagation']
-                
-                # Simple anomaly detection
-                if avg_propagation > 8.5:  # High propagation threshold
-                    alert = {
-                        'type': 'emotion_spike',
-                        'emotion': emotion,
-                        'severity': 'high',
-                        'propagation_score': avg_propagation,
-                        'tweet_count': count,
-                        'timestamp': datetime.utcnow().isoformat()
-                    }
-                    
-                    # Publish alert
-                    self.redis_client.publish(
-                        'alerts',
-                        json.dumps(alert)
-                    )
-                    
-                    logger.warning(f"Emotion spike detected: {emotion} with propagation score {avg_propagation}")
+            if len(tweets) < self.fetch_limit:
+                break
+            after_id = tweets[-1].id
+        
+        self.update_kol_aggregate(username, results)
+        
+        return results
+    
+    def update_kol_aggregate(self, username: str, results: List[Dict]):
+        """Queue aggregate emotion metrics of a KOL for the next Redis flush"""
+        # Calculate aggregate emotion metrics
+        if results:
+            avg_score = np.mean([r['score'] for r in results])
+            avg_propagation = np.mean([r['propagation_score'] for r in results])
+            
+            # Update KOL emotion score in Redis
+            kol_data = {
+                'username': username,
+                'emotionScore': avg_score,
+                'propagationScore': avg_propagation,
+                'lastAnalyzed': datetime.utcnow().isoformat()
+            }
+            
+            # Written to kol:{username} and published on emotion_updates within the flush window
+            self.kol_updates.update(username, kol_data)
+            
+            logger.info(f"Analyzed {len(results)} tweets for @{username}")
+    
+    def analyze_emotion_trends(self):
+        """Analyze emotion trends and detect anomalies"""
+        try:
+            # Sliding-window counts over the last hour, O(buckets)
+            trends = self.trend_aggregator.summary(self.trend_window)
+            
+            # Compare the hourly means against their own baselines
+            alerts = self.anomaly_detector.observe(
+                [('global', trend['_id'], 'all') for trend in trends],
+                [trend['avgPropagation'] for trend in trends]
+            )
+            self.publish_alerts(alerts)
             
         except Exception as e:
             logger.error(f"Error analyzing trends: {e}")
     
+    def snapshot_trends(self):
+        """Save the trend windows to Redis so a restart keeps recent history"""
+        try:
+            self.trend_aggregator.snapshot(self.redis_client, self.trend_snapshot_key)
+        except Exception as e:
+            logger.error(f"Error saving trend snapshot: {e}")
+    
     async def run(self):
         """Main run loop"""
         logger.info("Emotion Analyzer started")
         
-        # Start trend analysis in background
-        async def trend_analyzer():
-            while True:
-                self.analyze_emotion_trends()
-                await asyncio.sleep(60)  # Run every minute
-        
-        # Run both tasks concurrently
-        await asyncio.gather(
-            self.process_new_tweets(),
-            trend_analyzer()
-        )
+        # Model loaded and warmed up, report ready before consuming
+        mark_ready(self.ready_file, self.startup.report())
+        if self.membership is not None:
+            self.membership.start()
+        try:
+            # Ingest, inference, persistence and trend analysis run as async stages
+            await AnalyzerService(self).run()
+        finally:
+            if self.membership is not None:
+                self.membership.leave()
+            self.kol_updates.close()
+            self.rollups.close()
+            clear_ready(self.ready_file)
 
 def main():
     analyzer = EmotionAnalyzer()
     
+    # /metrics and on-demand profiling, SIGUSR2 toggles a profile written to PROFILE_DIR
+    start_metrics_server(int(os.getenv('METRICS_PORT', 9101)), os.getenv('METRICS_HOST', '0.0.0.0'))
+    install_signal_toggle('emotion-analyzer')
+    
     try:
         asyncio.run(analyzer.run())
     except KeyboardInterrupt:
@@ -288,5 +683,4 @@ def main():
         logger.error(f"Unexpected error: {e}")
 
 if __name__ == "__main__":
-    from datetime import timedelta
     main()
\ No newline at end of file
@@ -0,0 +1,137 @@
+import time
+import threading
+from typing import Dict, Hashable, List, Optional
+import numpy as np
+
+
+class AnomalyDetector:
+    """Streaming spike detection with one EWMA baseline per key
+
+    Keys are tuples such as ('kol', emotion, username) or ('event', emotion,
+    event_id). Each key owns one slot in flat NumPy arrays holding its EWMA
+    mean and variance, sample count, CUSUM statistic and last alert time, so
+    memory stays O(1) per key and tens of thousands of keys fit easily.
+    Values are compared in log1p space because propagation scores are
+    heavy-tailed.
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.05,
+        threshold: float = 4.0,
+        min_samples: int = 20,
+        cusum_k: float = 0.5,
+        cusum_h: float = 10.0,
+        cooldown: float = 600,
+        min_std: float = 0.05,
+        capacity: int = 1024
+    ):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.cooldown = cooldown
+        self.min_std = min_std
+
+        self.slots = {}
+        self.keys = []
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.mean = np.zeros(capacity, dtype=np.float64)
+        self.var = np.zeros(capacity, dtype=np.float64)
+        self.cusum = np.zeros(capacity, dtype=np.float64)
+        self.last_alert = np.full(capacity, -np.inf, dtype=np.float64)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def slot_ids(self, keys: List[Hashable]) -> np.ndarray:
+        """Slots for keys, allocating new ones as needed"""
+        slots = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self.slots[key] = len(self.keys)
+                self.keys.append(key)
+            slots[i] = slot
+
+        if len(self.keys) > len(self.count):
+            self.grow(max(len(self.keys), 2 * len(self.count)))
+        return slots
+
+    def grow(self, capacity: int):
+        """Resize the state arrays"""
+        extra = capacity - len(self.count)
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.mean = np.concatenate([self.mean, np.zeros(extra)])
+        self.var = np.concatenate([self.var, np.zeros(extra)])
+        self.cusum = np.concatenate([self.cusum, np.zeros(extra)])
+        self.last_alert = np.concatenate([self.last_alert, np.full(extra, -np.inf)])
+
+    def observe(self, keys: List[Hashable], values, timestamp: Optional[float] = None) -> List[Dict]:
+        """Update baselines with a batch of observations and return new alerts"""
+        if not keys:
+            return []
+        timestamp = time.time() if timestamp is None else timestamp
+        raw = np.asarray(values, dtype=np.float64)
+        values = np.log1p(np.maximum(raw, 0))
+
+        with self.lock:
+            slots = self.slot_ids(keys)
+            fired = {}
+
+            # Repeated keys are applied in arrival order, one vectorized round per repeat
+            for idx in self.rounds(slots):
+                s = slots[idx]
+                x = values[idx]
+                n = self.count[s]
+                mean = self.mean[s]
+                var = self.var[s]
+
+                std = np.maximum(np.sqrt(var), self.min_std)
+                z = np.where(n >= self.min_samples, (x - mean) / std, 0.0)
+                cusum = np.maximum(0.0, self.cusum[s] + z - self.cusum_k)
+                alarm = (z > self.threshold) | (cusum > self.cusum_h)
+
+                # EWMA mean/variance, using plain running averages while warming up
+                # so early variance estimates are not biased towards zero
+                alpha = np.maximum(self.alpha, 1.0 / (n + 1))
+                diff = x - mean
+                incr = alpha * diff
+                self.mean[s] = mean + incr
+                self.var[s] = (1 - alpha) * (var + diff * incr)
+                self.count[s] = n + 1
+                self.cusum[s] = np.where(alarm, 0.0, cusum)
+
+                for j in np.flatnonzero(alarm):
+                    slot = int(s[j])
+                    if slot not in fired or z[j] > fired[slot][0]:
+                        fired[slot] = (float(z[j]), float(cusum[j]), float(raw[idx[j]]), float(mean[j]))
+
+            alerts = []
+            for slot, (z, cusum, value, baseline) in fired.items():
+                # Cool-down suppresses duplicate alerts for the same key
+                if timestamp - self.last_alert[slot] < self.cooldown:
+                    continue
+                self.last_alert[slot] = timestamp
+                alerts.append({
+                    'key': self.keys[slot],
+                    'value': value,
+                    'baseline': float(np.expm1(baseline)),
+                    'z_score': z,
+                    'cusum': cusum
+                })
+
+        return alerts
+
+    def rounds(self, slots: np.ndarray) -> List[np.ndarray]:
+        """Split batch positions into rounds in which every slot appears at most once"""
+        order = np.argsort(slots, kind='stable')
+        sorted_slots = slots[order]
+        starts = np.flatnonzero(np.r_[True, sorted_slots[1:] != sorted_slots[:-1]])
+        lengths = np.diff(np.r_[starts, len(slots)])
+        rank = np.empty(len(slots), dtype=np.int64)
+        rank[order] = np.arange(len(slots)) - np.repeat(starts, lengths)
+        by_rank = np.argsort(rank, kind='stable')
+        return np.split(by_rank, np.cumsum(np.bincount(rank))[:-1])
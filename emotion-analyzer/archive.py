@@ -0,0 +1,421 @@
+"""Parquet archive of analyzed tweets and historical trend reads over it
+
+The export job streams analyzed tweets older than the retention window out
+of the tweets collection in createdAt order. It writes them as zstd Parquet
+files partitioned by day (ARCHIVE_DIR/date=YYYY-MM-DD/part-*.parquet), one
+row group per page. A part file is renamed into place before its tweets
+are deleted from MongoDB. Tweets already in a day's partition are skipped,
+so a run interrupted between the rename and the delete is finished by the
+next one without duplicating rows. ARCHIVE_DIR may be a local path or any
+URI pyarrow.fs understands, such as s3://bucket/tweets for a cold tier.
+
+TweetArchive reads the archive back with memory-mapped local files. Date
+filters prune whole partitions, and the createdAt, author and emotion
+filters are pushed down to Parquet row-group statistics.
+
+    python archive.py export --retention-days 30
+    python archive.py export --keep              # copy without deleting
+    python archive.py query --author elonmusk --days 365 --resolution day
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from loguru import logger
+
+# Shared modules sit next to the service in the image and one level up in the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.metrics import counter, MONGO_SECONDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"pyarrow not available, the tweet archive is disabled: {e}")
+    PYARROW_AVAILABLE = False
+
+PROJECTION = {
+    'tweetId': 1,
+    'content': 1,
+    'createdAt': 1,
+    'analyzedAt': 1,
+    'authorUsername': 1,
+    'authorFollowers': 1,
+    'metrics': 1,
+    'hashtags': 1,
+    'eventIds': 1,
+    'emotion': 1,
+    'engagementRate': 1
+}
+
+METRIC_FIELDS = ('likes', 'retweets', 'replies', 'views')
+
+if PYARROW_AVAILABLE:
+    SCHEMA = pa.schema([
+        ('tweetId', pa.string()),
+        ('createdAt', pa.timestamp('ms')),
+        ('analyzedAt', pa.timestamp('ms')),
+        ('authorUsername', pa.string()),
+        ('authorFollowers', pa.int64()),
+        ('content', pa.string()),
+        *((field, pa.int64()) for field in METRIC_FIELDS),
+        ('hashtags', pa.list_(pa.string())),
+        ('eventIds', pa.list_(pa.string())),
+        ('emotion', pa.string()),
+        ('emotionScore', pa.float64()),
+        ('propagationScore', pa.float64()),
+        ('engagementRate', pa.float64())
+    ])
+    # The day lives in the directory name only
+    PARTITIONING = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+
+TWEETS_ARCHIVED = counter('archive_tweets_total', 'Tweets written to the Parquet archive')
+MONGO_ARCHIVE_DELETE = MONGO_SECONDS.labels('archive_delete')
+
+
+def require_pyarrow():
+    if not PYARROW_AVAILABLE:
+        raise RuntimeError("The tweet archive needs pyarrow, install it with `pip install pyarrow`")
+
+
+def filesystem(root: str) -> Tuple['pafs.FileSystem', str]:
+    """Filesystem and base path for a local directory or a URI such as s3://bucket/prefix"""
+    require_pyarrow()
+    if '://' in root:
+        return pafs.FileSystem.from_uri(root)
+    return pafs.LocalFileSystem(use_mmap=True), os.path.abspath(root)
+
+
+def day_of(timestamp: datetime) -> str:
+    return timestamp.strftime('%Y-%m-%d')
+
+
+def to_columns(docs: List[Dict]) -> Dict[str, List]:
+    """Flatten tweet documents into archive columns"""
+    columns = {name: [] for name in SCHEMA.names}
+    for doc in docs:
+        metrics = doc.get('metrics') or {}
+        emotion = doc.get('emotion') or {}
+        columns['tweetId'].append(doc['tweetId'])
+        columns['createdAt'].append(doc['createdAt'])
+        columns['analyzedAt'].append(doc.get('analyzedAt'))
+        columns['authorUsername'].append(doc.get('authorUsername'))
+        columns['authorFollowers'].append(doc.get('authorFollowers') or 0)
+        columns['content'].append(doc.get('content') or '')
+        for field in METRIC_FIELDS:
+            columns[field].append(metrics.get(field) or 0)
+        columns['hashtags'].append(list(doc.get('hashtags') or []))
+        columns['eventIds'].append([str(event_id) for event_id in doc.get('eventIds') or []])
+        columns['emotion'].append(emotion.get('emotion'))
+        columns['emotionScore'].append(emotion.get('score'))
+        columns['propagationScore'].append(emotion.get('propagation_score'))
+        columns['engagementRate'].append(doc.get('engagementRate'))
+    return columns
+
+
+class TweetArchiver:
+    """Moves analyzed tweets past the retention window from MongoDB into the archive"""
+
+    def __init__(
+        self,
+        collection,
+        root: str,
+        batch_size: int = 5000,
+        max_rows_per_file: int = 1000000,
+        compression: str = 'zstd',
+        delete: bool = True
+    ):
+        self.collection = collection
+        self.fs, self.root = filesystem(root)
+        self.batch_size = batch_size
+        self.max_rows_per_file = max_rows_per_file
+        self.compression = compression
+        self.delete = delete
+
+        # The part file being written
+        self.day = None
+        self.writer = None
+        self.path = None
+        self.tmp_path = None
+        self.rows = 0
+        self.ids = []
+        self.archived_ids = set()
+
+        self.stats = {'archived': 0, 'skipped': 0, 'deleted': 0, 'files': 0, 'bytes': 0}
+
+    def query(self, cutoff: datetime) -> Dict:
+        return {'createdAt': {'$lt': cutoff}, 'analyzedAt': {'$ne': None}}
+
+    def partition(self, day: str) -> str:
+        return f'{self.root}/date={day}'
+
+    def existing_ids(self, day: str) -> set:
+        """tweetIds already archived for a day, read from that column only"""
+        directory = self.partition(day)
+        if self.fs.get_file_info(directory).type == pafs.FileType.NotFound:
+            return set()
+        table = ds.dataset(directory, format='parquet', filesystem=self.fs).to_table(columns=['tweetId'])
+        return set(table.column('tweetId').to_pylist())
+
+    def open_file(self, day: str):
+        self.day = day
+        self.archived_ids = self.existing_ids(day)
+        self.fs.create_dir(self.partition(day))
+        name = f'part-{uuid.uuid4().hex}.parquet'
+        self.path = f'{self.partition(day)}/{name}'
+        # Readers skip names starting with an underscore until the rename
+        self.tmp_path = f'{self.partition(day)}/_{name}'
+        self.writer = None
+        self.rows = 0
+        self.ids = []
+
+    def write_page(self, page: List[Dict]):
+        """Write one row group, skipping tweets a previous run already archived"""
+        self.ids.extend(doc['_id'] for doc in page)
+        fresh = [doc for doc in page if doc['tweetId'] not in self.archived_ids]
+        self.stats['skipped'] += len(page) - len(fresh)
+        if not fresh:
+            return
+
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(
+                self.tmp_path,
+                SCHEMA,
+                filesystem=self.fs,
+                compression=self.compression
+            )
+        self.writer.write_table(pa.Table.from_pydict(to_columns(fresh), schema=SCHEMA))
+        self.rows += len(fresh)
+        self.stats['archived'] += len(fresh)
+        TWEETS_ARCHIVED.inc(len(fresh))
+
+    def close_file(self):
+        """Publish the part file, then drop its tweets from the hot collection"""
+        if self.writer is not None:
+            self.writer.close()
+            self.fs.move(self.tmp_path, self.path)
+            self.stats['files'] += 1
+            self.stats['bytes'] += self.fs.get_file_info(self.path).size
+            logger.info(f"Archived {self.rows} tweets to {self.path}")
+            self.writer = None
+
+        if self.delete and self.ids:
+            # Bounded to the file's day so a delete can never reach past what was archived
+            start = datetime.strptime(self.day, '%Y-%m-%d')
+            day_range = {'$gte': start, '$lt': start + timedelta(days=1)}
+            with MONGO_ARCHIVE_DELETE.time():
+                for offset in range(0, len(self.ids), self.batch_size):
+                    chunk = self.ids[offset:offset + self.batch_size]
+                    result = self.collection.delete_many({'createdAt': day_range, '_id': {'$in': chunk}})
+                    self.stats['deleted'] += result.deleted_count
+        self.ids = []
+        self.day = None
+
+    def export(self, cutoff: datetime) -> Dict:
+        """Archive every analyzed tweet created before cutoff"""
+        cursor = (
+            self.collection.find(self.query(cutoff), PROJECTION)
+            .sort('createdAt', 1)
+            .batch_size(self.batch_size)
+        )
+
+        page = []
+        started = time.monotonic()
+        try:
+            for doc in cursor:
+                if not isinstance(doc.get('createdAt'), datetime):
+                    continue
+                day = day_of(doc['createdAt'])
+                if day != self.day or self.rows + len(page) >= self.max_rows_per_file:
+                    if page:
+                        self.write_page(page)
+                        page = []
+                    if self.day is not None:
+                        self.close_file()
+                    self.open_file(day)
+
+                page.append(doc)
+                if len(page) >= self.batch_size:
+                    self.write_page(page)
+                    page = []
+
+            if page:
+                self.write_page(page)
+            if self.day is not None:
+                self.close_file()
+        except Exception:
+            # Nothing is deleted for the unfinished file, the next run redoes it
+            if self.writer is not None:
+                self.writer.close()
+                self.fs.delete_file(self.tmp_path)
+            raise
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Archive export done in {elapsed:.1f}s: {self.stats['archived']} tweets in "
+            f"{self.stats['files']} files ({self.stats['bytes'] / 1e6:.1f} MB), "
+            f"{self.stats['skipped']} already archived, {self.stats['deleted']} deleted"
+        )
+        return self.stats
+
+
+class TweetArchive:
+    """Read side of the archive for historical queries"""
+
+    def __init__(self, root: str):
+        self.fs, self.root = filesystem(root)
+
+    def dataset(self):
+        # Discovered on every call so files from a running export show up
+        return ds.dataset(
+            self.root,
+            format='parquet',
+            filesystem=self.fs,
+            partitioning=PARTITIONING
+        )
+
+    def scan(
+        self,
+        start: datetime,
+        end: datetime,
+        columns: Optional[List[str]] = None,
+        authors: Optional[Iterable[str]] = None,
+        emotions: Optional[Iterable[str]] = None,
+        event_id: Optional[str] = None
+    ) -> 'pa.Table':
+        """Archived tweets created in [start, end), reading only the needed columns"""
+        if self.fs.get_file_info(self.root).type == pafs.FileType.NotFound:
+            return SCHEMA.empty_table().select(columns or SCHEMA.names)
+
+        expression = (
+            (ds.field('date') >= day_of(start)) & (ds.field('date') <= day_of(end))
+            & (ds.field('createdAt') >= pa.scalar(start, pa.timestamp('ms')))
+            & (ds.field('createdAt') < pa.scalar(end, pa.timestamp('ms')))
+        )
+        if authors is not None:
+            expression &= ds.field('authorUsername').isin(list(authors))
+        if emotions is not None:
+            expression &= ds.field('emotion').isin(list(emotions))
+
+        wanted = list(columns or SCHEMA.names)
+        read = wanted + ['eventIds'] if event_id is not None and 'eventIds' not in wanted else wanted
+        table = self.dataset().to_table(columns=read, filter=expression)
+
+        if event_id is not None:
+            # List membership has no row-group statistics, filter after the scan
+            event_ids = table.column('eventIds')
+            matched = pc.equal(pc.list_flatten(event_ids), str(event_id))
+            rows = pc.unique(pc.filter(pc.list_parent_indices(event_ids), matched))
+            table = table.take(rows).select(wanted)
+        return table
+
+    def trend(
+        self,
+        start: datetime,
+        end: Optional[datetime] = None,
+        resolution: str = 'hour',
+        author: Optional[str] = None,
+        event_id: Optional[str] = None
+    ) -> List[Dict]:
+        """Emotion buckets in [start, end), oldest first, shaped like RollupStore.query"""
+        end = end or datetime.utcnow()
+        table = self.scan(
+            start,
+            end,
+            columns=['createdAt', 'emotion', 'emotionScore', 'propagationScore'],
+            authors=[author] if author else None,
+            event_id=event_id
+        )
+        if table.num_rows == 0:
+            return []
+
+        table = table.append_column('bucket', pc.floor_temporal(table.column('createdAt'), unit=resolution))
+        grouped = table.group_by(['bucket', 'emotion']).aggregate([
+            ('emotionScore', 'sum'),
+            ('propagationScore', 'sum'),
+            ('createdAt', 'count')
+        ]).to_pylist()
+
+        buckets = {}
+        for row in grouped:
+            bucket = buckets.setdefault(row['bucket'], {
+                'bucket': row['bucket'],
+                'resolution': resolution,
+                'count': 0,
+                'scoreSum': 0.0,
+                'propagationSum': 0.0,
+                'emotionCounts': {}
+            })
+            bucket['count'] += row['createdAt_count']
+            bucket['scoreSum'] += row['emotionScore_sum'] or 0.0
+            bucket['propagationSum'] += row['propagationScore_sum'] or 0.0
+            if row['emotion'] is not None:
+                bucket['emotionCounts'][row['emotion']] = row['createdAt_count']
+
+        result = []
+        for key in sorted(buckets):
+            bucket = buckets[key]
+            count = max(bucket['count'], 1)
+            bucket['avgScore'] = bucket['scoreSum'] / count
+            bucket['avgPropagation'] = bucket['propagationSum'] / count
+            result.append(bucket)
+        return result
+
+
+def main():
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Archive old analyzed tweets to Parquet and query the archive')
+    parser.add_argument('--root', default=os.getenv('ARCHIVE_DIR', 'archive'), help='local directory or pyarrow.fs URI')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export = subparsers.add_parser('export', help='move tweets past the retention window into the archive')
+    export.add_argument('--retention-days', type=float, default=float(os.getenv('ARCHIVE_RETENTION_DAYS', 30)))
+    export.add_argument('--batch-size', type=int, default=int(os.getenv('ARCHIVE_BATCH_SIZE', 5000)))
+    export.add_argument('--max-rows-per-file', type=int, default=int(os.getenv('ARCHIVE_MAX_ROWS_PER_FILE', 1000000)))
+    export.add_argument('--keep', action='store_true', help='export without deleting from MongoDB')
+
+    query = subparsers.add_parser('query', help='print archived emotion buckets as JSON lines')
+    query.add_argument('--author')
+    query.add_argument('--event')
+    query.add_argument('--days', type=float, default=30)
+    query.add_argument('--resolution', choices=('minute', 'hour', 'day'), default='day')
+    args = parser.parse_args()
+    require_pyarrow()
+
+    if args.command == 'export':
+        client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://mongo:27017/emotion_tweets'))
+        archiver = TweetArchiver(
+            client.emotion_tweets.tweets,
+            args.root,
+            batch_size=args.batch_size,
+            max_rows_per_file=args.max_rows_per_file,
+            compression=os.getenv('ARCHIVE_COMPRESSION', 'zstd'),
+            delete=not args.keep
+        )
+        archiver.export(datetime.utcnow() - timedelta(days=args.retention_days))
+        return
+
+    started = time.perf_counter()
+    buckets = TweetArchive(args.root).trend(
+        datetime.utcnow() - timedelta(days=args.days),
+        resolution=args.resolution,
+        author=args.author,
+        event_id=args.event
+    )
+    for bucket in buckets:
+        print(json.dumps(bucket, default=str, ensure_ascii=False))
+    logger.info(f"{len(buckets)} buckets in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
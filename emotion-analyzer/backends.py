@@ -0,0 +1,364 @@
+"""Pluggable CPU inference backends for the emotion model
+
+Every backend returns an object called like a transformers text
+classification pipeline, so batching, chunking and the worker pool work the
+same whichever one is configured with EMOTION_BACKEND:
+
+- pytorch: the fp32 transformers pipeline
+- quantized: the same model with dynamic int8 quantization of its Linear layers
+- onnx: an ONNX Runtime session over a model exported with `export`
+
+    python backends.py cache --model uer/chinese_roberta_L-12_H-768 --cache-dir models/cache
+    python backends.py export --model uer/chinese_roberta_L-12_H-768 --output models/onnx
+    python backends.py verify --onnx-path models/onnx --backends pytorch,quantized,onnx
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+from typing import Dict, List, Optional
+import numpy as np
+from loguru import logger
+
+BACKENDS = ('pytorch', 'quantized', 'onnx')
+ONNX_FILE = 'model.onnx'
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'verify_texts.txt')
+
+
+def default_device() -> int:
+    """First GPU when one is visible, otherwise CPU"""
+    import torch
+    return 0 if torch.cuda.is_available() else -1
+
+
+def cache_path(model_name: str, cache_dir: Optional[str]) -> Optional[str]:
+    """Directory holding the pre-serialized copy of a model"""
+    if not cache_dir or os.path.isdir(model_name):
+        return None
+    return os.path.join(cache_dir, model_name.replace('/', '--'))
+
+
+def cached_model(model_name: str, cache_dir: Optional[str]) -> str:
+    """Local model directory when it has been cached, otherwise the hub name"""
+    path = cache_path(model_name, cache_dir)
+    if path and os.path.exists(os.path.join(path, 'config.json')):
+        return path
+    return model_name
+
+
+def save_cache(model, tokenizer, model_name: str, cache_dir: Optional[str]):
+    """Serialize a freshly downloaded model so the next start loads it from disk"""
+    path = cache_path(model_name, cache_dir)
+    if not path or cached_model(model_name, cache_dir) == path:
+        return
+    try:
+        model.save_pretrained(path, safe_serialization=True)
+        tokenizer.save_pretrained(path)
+        logger.info(f"Cached {model_name} in {path}")
+    except OSError as e:
+        logger.warning(f"Could not cache {model_name} in {path}: {e}")
+
+
+def load_pytorch(model_name: str, device: Optional[int] = None, cache_dir: Optional[str] = None):
+    """The fp32 transformers pipeline"""
+    from transformers import pipeline
+
+    if device is None:
+        device = default_device()
+    pipe = pipeline("sentiment-analysis", model=cached_model(model_name, cache_dir), device=device)
+    save_cache(pipe.model, pipe.tokenizer, model_name, cache_dir)
+    return pipe
+
+
+def load_quantized(model_name: str, cache_dir: Optional[str] = None):
+    """Pipeline over the model with int8 dynamic quantization of every Linear layer"""
+    import torch
+    from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
+
+    source = cached_model(model_name, cache_dir)
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    model = AutoModelForSequenceClassification.from_pretrained(source)
+    save_cache(model, tokenizer, model_name, cache_dir)
+    model.eval()
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    # Quantized kernels are CPU only
+    return pipeline("sentiment-analysis", model=quantized, tokenizer=tokenizer, device=-1)
+
+
+class OnnxPipeline:
+    """Text classification over an ONNX Runtime session, called like a pipeline
+
+    The session is created on first use, so forked inference workers each
+    build their own instead of inheriting the parent's thread pool.
+    """
+
+    def __init__(self, path: str, file_name: str = ONNX_FILE, threads: int = 0):
+        from transformers import AutoConfig, AutoTokenizer
+
+        self.model_path = os.path.join(path, file_name)
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"No exported model at {self.model_path}, run `python backends.py export` first")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        config = AutoConfig.from_pretrained(path)
+        self.labels = [config.id2label[i] for i in range(len(config.id2label))]
+        self.threads = threads
+        self.session = None
+        self.model = None
+
+    def get_session(self):
+        if self.session is None:
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            if self.threads > 0:
+                options.intra_op_num_threads = self.threads
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = onnxruntime.InferenceSession(
+                self.model_path,
+                options,
+                providers=['CPUExecutionProvider']
+            )
+            self.input_names = {i.name for i in self.session.get_inputs()}
+        return self.session
+
+    def __call__(self, texts, batch_size: Optional[int] = None, top_k: Optional[int] = 1, truncation: bool = True, **kwargs):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+
+        session = self.get_session()
+        batch_size = batch_size or len(texts) or 1
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=truncation,
+                return_tensors='np'
+            )
+            feed = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+            logits = session.run(None, feed)[0]
+            outputs.extend(self.postprocess(logits, top_k))
+
+        return outputs[0] if single else outputs
+
+    def postprocess(self, logits: np.ndarray, top_k: Optional[int]) -> List:
+        """Softmax scores per label, best first, shaped like the pipeline's output"""
+        if logits.shape[1] == 1:
+            probabilities = 1 / (1 + np.exp(-logits))
+        else:
+            shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+            probabilities = shifted / shifted.sum(axis=1, keepdims=True)
+
+        results = []
+        for row in probabilities:
+            order = np.argsort(-row, kind='stable')
+            ranked = [{'label': self.labels[i], 'score': float(row[i])} for i in order]
+            if top_k is None:
+                results.append(ranked)
+            elif top_k == 1:
+                results.append(ranked[0])
+            else:
+                results.append(ranked[:top_k])
+        return results
+
+
+def load_backend(
+    name: str,
+    model_name: str,
+    device: Optional[int] = None,
+    onnx_path: str = 'models/onnx',
+    threads: int = 0,
+    cache_dir: Optional[str] = None
+):
+    """Pipeline-compatible model for the named backend
+
+    torch and transformers are imported here rather than at module level,
+    so tools that never load a model do not pay for them.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"EMOTION_BACKEND must be one of {BACKENDS}")
+
+    logger.info(f"Loading {name} backend for {model_name}")
+    if name == 'quantized':
+        return load_quantized(model_name, cache_dir)
+    if name == 'onnx':
+        return OnnxPipeline(onnx_path, threads=threads)
+    return load_pytorch(model_name, device, cache_dir)
+
+
+def export_onnx(model_name: str, output: str, opset: int = 14) -> str:
+    """Export the model with dynamic batch and sequence axes, plus its tokenizer and config"""
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.config.return_dict = False
+    model.eval()
+
+    os.makedirs(output, exist_ok=True)
+    path = os.path.join(output, ONNX_FILE)
+    sample = tokenizer(['export sample', 'a second, longer export sample'], padding=True, return_tensors='pt')
+
+    options = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # Keep the TorchScript exporter used by older torch releases
+        options['dynamo'] = False
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample['input_ids'], sample['attention_mask']),
+            path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['logits'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'logits': {0: 'batch'}
+            },
+            opset_version=opset,
+            **options
+        )
+
+    tokenizer.save_pretrained(output)
+    model.config.save_pretrained(output)
+    logger.info(f"Exported {model_name} to {path}")
+    return path
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_fixtures(path: str) -> List[str]:
+    """One text per non-empty line"""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def measure(pipe, texts: List[str], batch_size: int, repeat: int) -> Dict:
+    """Top-1 outputs plus per-batch latency over repeated passes"""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    pipe(batches[0], batch_size=len(batches[0]), top_k=None, truncation=True)
+
+    latencies = []
+    outputs = []
+    for _ in range(repeat):
+        outputs = []
+        for batch in batches:
+            started = time.perf_counter()
+            outputs.extend(pipe(batch, batch_size=len(batch), top_k=None, truncation=True))
+            latencies.append(time.perf_counter() - started)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'top': [output[0] for output in outputs],
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'texts_per_sec': len(texts) * repeat / (latencies.sum() / 1000)
+    }
+
+
+def verify(args) -> List[Dict]:
+    """Compare every backend against the fp32 pipeline on the fixture set"""
+    texts = load_fixtures(args.fixtures)
+    backends = [b for b in args.backends.split(',') if b]
+    reference = None
+    report = []
+
+    # The fp32 pipeline is the reference, measure it first
+    for name in ['pytorch'] + [b for b in backends if b != 'pytorch']:
+        before = rss_mb()
+        started = time.perf_counter()
+        pipe = load_backend(name, args.model, onnx_path=args.onnx_path, threads=args.threads)
+        load_seconds = time.perf_counter() - started
+        result = measure(pipe, texts, args.batch_size, args.repeat)
+        rss = rss_mb() - before
+
+        if reference is None:
+            reference = result['top']
+        agreement = np.mean([a['label'] == b['label'] for a, b in zip(result['top'], reference)])
+        score_drift = max(abs(a['score'] - b['score']) for a, b in zip(result['top'], reference))
+
+        if name in backends:
+            report.append({
+                'backend': name,
+                'label_agreement': float(agreement),
+                'max_score_drift': float(score_drift),
+                'load_seconds': load_seconds,
+                'p50_ms': result['p50_ms'],
+                'p95_ms': result['p95_ms'],
+                'texts_per_sec': result['texts_per_sec'],
+                'rss_mb': rss
+            })
+        del pipe
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export and verify emotion model inference backends')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='export the model to ONNX')
+    export.add_argument('--model', default=os.getenv('MODEL_NAME', 'uer/chinese_roberta_L-12_H-768'))
+    export.add_argument('--output', default=os.getenv('EMOTION_ONNX_PATH', 'models/onnx'))
+    export.add_argument('--opset', type=int, default=14)
+
+    cache = commands.add_parser('cache', help='download and pre-serialize the model')
+    cache.add_argument('--model', default=os.getenv('MODEL_NAME', 'uer/chinese_roberta_L-12_H-768'))
+    cache.add_argument('--cache-dir', default=os.getenv('EMOTION_MODEL_CACHE', 'models/cache'))
+
+    check = commands.add_parser('verify', help='compare backends against the fp32 model')
+    check.add_argument('--model', default=os.getenv('MODEL_NAME', 'uer/chinese_roberta_L-12_H-768'))
+    check.add_argument('--onnx-path', default=os.getenv('EMOTION_ONNX_PATH', 'models/onnx'))
+    check.add_argument('--backends', default=','.join(BACKENDS))
+    check.add_argument('--fixtures', default=FIXTURES)
+    check.add_argument('--batch-size', type=int, default=int(os.getenv('EMOTION_BATCH_SIZE', 32)))
+    check.add_argument('--repeat', type=int, default=5)
+    check.add_argument('--threads', type=int, default=0)
+    check.add_argument('--min-agreement', type=float, default=0.95)
+    check.add_argument('--json', help='also write the report to this file')
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_onnx(args.model, args.output, args.opset)
+        return
+    if args.command == 'cache':
+        load_pytorch(args.model, device=-1, cache_dir=args.cache_dir)
+        return
+
+    report = verify(args)
+    print(f"{'backend':10} {'agree':>7} {'drift':>7} {'load s':>7} {'p50 ms':>8} {'p95 ms':>8} {'texts/s':>9} {'rss MB':>8}")
+    for row in report:
+        print(
+            f"{row['backend']:10} {row['label_agreement']:7.1%} {row['max_score_drift']:7.4f} "
+            f"{row['load_seconds']:7.2f} {row['p50_ms']:8.1f} {row['p95_ms']:8.1f} "
+            f"{row['texts_per_sec']:9.1f} {row['rss_mb']:8.1f}"
+        )
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if any(row['label_agreement'] < args.min_agreement for row in report):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
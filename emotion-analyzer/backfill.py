@@ -0,0 +1,340 @@
+"""Offline backfill and re-analysis of the tweets collection
+
+Streams tweets in _id order through batched inference and unordered bulk
+writes, checkpointing the last written _id in Redis so an interrupted run
+resumes where it stopped. Tweets that were never analyzed are written as
+first analyses and counted in the rollups, re-scored ones only overwrite
+their result. Tweets whose write failed are kept in the
+checkpoint and retried first when the run is resumed. Reading, inference and
+writing overlap on bounded queues, and a docs/sec cap keeps the job from
+starving live traffic.
+
+    python backfill.py                  # tweets that were never analyzed
+    python backfill.py --mode all       # re-score everything after a model change
+    python backfill.py --mode all --restart --rate 500
+"""
+import os
+import json
+import time
+import queue
+import signal
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+from bson import ObjectId
+from loguru import logger
+
+from analyzer import EmotionAnalyzer, TWEET_PROJECTION
+from common.records import TweetRecord
+
+# Sentinel closing a pipeline queue
+DONE = None
+
+# Pages also read analyzedAt to tell first analyses from re-scores
+BACKFILL_PROJECTION = dict(TWEET_PROJECTION, analyzedAt=1)
+
+
+class Backfill:
+    """Resumable _id-range backfill over the tweets collection"""
+
+    def __init__(
+        self,
+        analyzer: EmotionAnalyzer,
+        mode: str = 'missing',
+        batch_size: int = 256,
+        rate: float = 0,
+        prefetch: int = 4,
+        checkpoint_key: str = 'backfill:checkpoint',
+        report_interval: float = 10
+    ):
+        self.analyzer = analyzer
+        self.collection = analyzer.tweets_collection
+        self.redis_client = analyzer.redis_client
+        self.mode = mode
+        self.batch_size = batch_size
+        self.rate = rate
+        self.checkpoint_key = f'{checkpoint_key}:{mode}'
+        self.report_interval = report_interval
+
+        # Bounded hand-offs keep at most a few pages in memory
+        self.read_queue = queue.Queue(maxsize=prefetch)
+        self.write_queue = queue.Queue(maxsize=2)
+        self.stopping = threading.Event()
+        self.next_allowed = time.monotonic()
+
+        self.state = {}
+        self.retry_ids = []
+        self.total = 0
+        self.started = 0.0
+        self.last_report = 0.0
+        self.processed_at_start = 0
+
+    def load_checkpoint(self, restart: bool):
+        """Resume from the saved cursor, or start a new range ending at the current last _id"""
+        saved = None if restart else self.redis_client.get(self.checkpoint_key)
+        if saved and 'completedAt' not in json.loads(saved):
+            self.state = json.loads(saved)
+            self.prune_failed()
+            logger.info(
+                f"Resuming backfill after _id {self.state['lastId']} ({self.state['processed']} done, "
+                f"{self.state['failed']} failed to retry)"
+            )
+            return
+
+        # Tweets inserted after this point are handled by the live service
+        newest = self.collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+        self.state = {
+            'lastId': None,
+            'upperId': str(newest['_id']) if newest else None,
+            'processed': 0,
+            'failed': 0,
+            'failedIds': [],
+            'startedAt': datetime.utcnow().isoformat()
+        }
+        self.save_checkpoint()
+
+    def prune_failed(self):
+        """Forget failed tweets that no longer match, like ones the live service analyzed since"""
+        failed = self.state.get('failedIds', [])
+        self.state['failedIds'] = [
+            str(doc['_id'])
+            for doc in self.collection.find(self.query(ids=failed), {'_id': 1}).sort('_id', 1)
+        ] if failed else []
+        self.state['failed'] = len(self.state['failedIds'])
+
+    def save_checkpoint(self):
+        self.state['updatedAt'] = datetime.utcnow().isoformat()
+        self.redis_client.set(self.checkpoint_key, json.dumps(self.state))
+
+    def query(self, after_id: Optional[str] = None, ids: Optional[List[str]] = None) -> Dict:
+        """Filter for the rest of the range after a cursor position, or for the given _ids"""
+        if ids is not None:
+            query = {'_id': {'$in': [ObjectId(i) for i in ids]}}
+        else:
+            id_range = {'$lte': ObjectId(self.state['upperId'])}
+            if after_id is not None:
+                id_range['$gt'] = ObjectId(after_id)
+            query = {'_id': id_range}
+
+        if self.mode == 'missing':
+            query['analyzedAt'] = None
+        return query
+
+    def fetch(self, cursor):
+        """Records of a page, with the ids of the tweets that were never analyzed"""
+        page = []
+        fresh = set()
+        for doc in cursor:
+            page.append(TweetRecord.from_doc(doc))
+            if doc.get('analyzedAt') is None:
+                fresh.add(doc['tweetId'])
+        return page, fresh
+
+    def read(self):
+        """Page through the range in _id order onto the read queue"""
+        last_id = self.state['lastId']
+        try:
+            # Tweets that failed in an earlier run, all before the cursor
+            for start in range(0, len(self.retry_ids), self.batch_size):
+                if self.stopping.is_set():
+                    break
+                ids = self.retry_ids[start:start + self.batch_size]
+                cursor = self.collection.find(self.query(ids=ids), BACKFILL_PROJECTION).sort('_id', 1)
+                page, fresh = self.fetch(cursor)
+                if page:
+                    self.read_queue.put((page, fresh))
+
+            while not self.stopping.is_set():
+                cursor = (
+                    self.collection.find(self.query(last_id), BACKFILL_PROJECTION)
+                    .sort('_id', 1)
+                    .limit(self.batch_size)
+                )
+                page, fresh = self.fetch(cursor)
+                if not page:
+                    break
+                last_id = str(page[-1].id)
+                self.read_queue.put((page, fresh))
+        except Exception as e:
+            logger.error(f"Backfill read failed after _id {last_id}: {e}")
+            self.stopping.set()
+        finally:
+            self.read_queue.put(DONE)
+
+    def write(self):
+        """Persist inferred pages in order and advance the checkpoint
+
+        After a page fails to write, the pages behind it are drained without
+        writing, so the cursor stays at the last page that was written.
+        """
+        broken = False
+        while True:
+            item = self.write_queue.get()
+            if item is DONE:
+                return
+            if broken:
+                continue
+            page, fresh, results = item
+            try:
+                written = self.persist(page, fresh, results)
+            except Exception as e:
+                logger.error(f"Backfill write failed for page ending at {page[-1].id}: {e}")
+                broken = True
+                self.stopping.set()
+                continue
+
+            # Tweets the bulk write rejected are retried by the next run
+            done = {result['tweetId'] for result in written}
+            page_ids = {str(tweet.id) for tweet in page}
+            self.state['failedIds'] = [
+                tweet_id for tweet_id in self.state['failedIds'] if tweet_id not in page_ids
+            ] + [str(tweet.id) for tweet in page if tweet.tweet_id not in done]
+            self.state['failed'] = len(self.state['failedIds'])
+
+            # Retried pages lie before the cursor and leave it where it is
+            if self.state['lastId'] is None or page[-1].id > ObjectId(self.state['lastId']):
+                self.state['lastId'] = str(page[-1].id)
+            self.state['processed'] += len(page)
+            self.save_checkpoint()
+            self.report()
+
+    def persist(self, page: List[TweetRecord], fresh: set, results: List[Dict]) -> List[Dict]:
+        """Write a page, adding only first analyses to the rollups
+
+        Tweets analyzed before are already counted in the rollups, so they go
+        through the re-score path that only overwrites the stored result.
+        """
+        written = []
+        for first in (True, False):
+            part = [i for i, tweet in enumerate(page) if (tweet.tweet_id in fresh) == first]
+            if part:
+                written += self.analyzer.persist_tweet_batch(
+                    [page[i] for i in part], [results[i] for i in part], live=False, rollup=first
+                )
+        return written
+
+    def throttle(self, count: int):
+        """Sleep long enough to stay under the docs/sec cap"""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        if self.next_allowed > now:
+            time.sleep(self.next_allowed - now)
+        self.next_allowed = max(self.next_allowed, now) + count / self.rate
+
+    def report(self, force: bool = False):
+        """Log progress, throughput and ETA every report_interval seconds"""
+        now = time.monotonic()
+        if not force and now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+
+        done = self.state['processed'] - self.processed_at_start
+        rate = done / max(now - self.started, 1e-9)
+        remaining = max(self.total - done, 0)
+        eta = remaining / rate if rate > 0 else float('inf')
+        percent = done / self.total if self.total else 1.0
+        logger.info(
+            f"Backfill {self.mode}: {done}/{self.total} ({percent:.1%}), "
+            f"{rate:.1f} docs/sec, {self.state['failed']} failed, "
+            f"ETA {eta / 60:.1f} min"
+        )
+
+    def run(self, restart: bool = False) -> Dict:
+        """Stream the whole range, returning the final checkpoint state"""
+        self.load_checkpoint(restart)
+        if self.state['upperId'] is None:
+            logger.info("Tweets collection is empty, nothing to backfill")
+            return self.state
+
+        self.retry_ids = list(self.state.get('failedIds', []))
+        self.state.setdefault('failedIds', [])
+        self.total = self.collection.count_documents(self.query(self.state['lastId'])) + len(self.retry_ids)
+        logger.info(f"Backfilling {self.total} tweets in pages of {self.batch_size}")
+
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.processed_at_start = self.state['processed']
+
+        reader = threading.Thread(target=self.read, name='backfill-read', daemon=True)
+        writer = threading.Thread(target=self.write, name='backfill-write', daemon=True)
+        reader.start()
+        writer.start()
+
+        try:
+            while True:
+                item = self.read_queue.get()
+                if item is DONE:
+                    break
+                if self.stopping.is_set():
+                    continue
+                page, fresh = item
+                self.throttle(len(page))
+                try:
+                    results = self.analyzer.infer_tweets(page)
+                except Exception as e:
+                    logger.error(f"Backfill inference failed for page ending at {page[-1].id}: {e}")
+                    self.stopping.set()
+                    continue
+                self.write_queue.put((page, fresh, results))
+        finally:
+            self.stopping.set()
+            # Drain the reader so it can see the stop flag
+            while reader.is_alive():
+                try:
+                    self.read_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.write_queue.put(DONE)
+            writer.join()
+            self.analyzer.rollups.flush()
+
+        self.report(force=True)
+        if self.state['lastId'] is not None and self.collection.count_documents(self.query(self.state['lastId']), limit=1) == 0:
+            self.prune_failed()
+            if self.state['failedIds']:
+                logger.warning(f"Backfill reached the end with {self.state['failed']} failed tweets, run again to retry them")
+            else:
+                logger.info("Backfill complete")
+                self.state['completedAt'] = datetime.utcnow().isoformat()
+                self.save_checkpoint()
+        return self.state
+
+    def stop(self, *args):
+        """Finish the pages in flight, then exit with the checkpoint saved"""
+        logger.info("Stopping backfill after the pages in flight")
+        self.stopping.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill or re-analyze stored tweets')
+    parser.add_argument('--mode', choices=('missing', 'all'), default='missing',
+                        help='missing: never analyzed tweets, all: re-score every tweet')
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('BACKFILL_BATCH_SIZE', 256)))
+    parser.add_argument('--rate', type=float, default=float(os.getenv('BACKFILL_MAX_RATE', 200)),
+                        help='maximum docs/sec, 0 for unlimited')
+    parser.add_argument('--prefetch', type=int, default=4, help='pages read ahead of inference')
+    parser.add_argument('--restart', action='store_true', help='ignore the saved checkpoint')
+    args = parser.parse_args()
+
+    # Model and stores only, the live service keeps its readiness file and publishers
+    analyzer = EmotionAnalyzer(service=False)
+    backfill = Backfill(
+        analyzer,
+        mode=args.mode,
+        batch_size=args.batch_size,
+        rate=args.rate,
+        prefetch=args.prefetch
+    )
+    signal.signal(signal.SIGINT, backfill.stop)
+    signal.signal(signal.SIGTERM, backfill.stop)
+
+    try:
+        backfill.run(restart=args.restart)
+    finally:
+        analyzer.rollups.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from loguru import logger
+
+
+class PendingText:
+    __slots__ = ('text', 'length', 'future', 'enqueued')
+
+    def __init__(self, text: str, length: int):
+        self.text = text
+        self.length = max(length, 1)
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+class DynamicBatcher:
+    """Length-bucketed batching in front of the model
+
+    Texts from every caller are queued by token-length bucket, so a batch only
+    holds sequences of similar length and little of the forward pass goes to
+    padding. A bucket is flushed once its next text would push the padded
+    batch over max_tokens or max_batch_size, or when its oldest text has
+    waited max_wait seconds. Up to `parallel` ready batches are handed to
+    run_batches together, so a worker pool can process them concurrently.
+
+    Waiting only pays off when another caller can still add texts: once
+    `callers` callers are blocked in infer, every bucket flushes at once.
+    """
+
+    def __init__(
+        self,
+        run_batches: Callable[[List[List[str]]], List[List[Optional[List[Dict]]]]],
+        max_tokens: int = 4096,
+        max_batch_size: int = 32,
+        max_wait: float = 0.01,
+        bounds: List[int] = (16, 32, 64, 128, 256, 512),
+        parallel: int = 1,
+        callers: int = 1,
+        log_every: int = 1000
+    ):
+        self.run_batches = run_batches
+        self.max_tokens = max_tokens
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max_wait
+        self.bounds = sorted(bounds)
+        self.parallel = max(parallel, 1)
+        self.callers = max(callers, 1)
+        self.active = 0
+        self.log_every = log_every
+
+        self.buckets = [deque() for _ in self.bounds]
+        self.condition = threading.Condition()
+        self.running = True
+
+        # Written by the batching thread, read by metrics() from any thread
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'batches': 0,
+            'texts': 0,
+            'real_tokens': 0,
+            'padded_tokens': 0,
+            'flush_full': 0,
+            'flush_deadline': 0
+        }
+        self.waits = deque(maxlen=10000)
+
+        self.thread = threading.Thread(target=self.loop, name='dynamic-batcher', daemon=True)
+        self.thread.start()
+
+    def bucket(self, length: int) -> int:
+        for i, bound in enumerate(self.bounds):
+            if length <= bound:
+                return i
+        return len(self.bounds) - 1
+
+    def submit(self, texts: List[str], lengths: List[int]) -> List[Future]:
+        """Queue texts with their token counts, one future per text"""
+        items = [PendingText(text, length) for text, length in zip(texts, lengths)]
+        with self.condition:
+            if not self.running:
+                # Nothing would ever take them off the queue
+                for item in items:
+                    item.future.set_exception(RuntimeError('batcher closed'))
+                return [item.future for item in items]
+            for item in items:
+                self.buckets[self.bucket(item.length)].append(item)
+            self.condition.notify()
+        return [item.future for item in items]
+
+    def infer(self, texts: List[str], lengths: List[int]) -> List[Optional[List[Dict]]]:
+        """Run texts through the batcher and wait for every output, in input order"""
+        with self.condition:
+            self.active += 1
+        try:
+            return [future.result() for future in self.submit(texts, lengths)]
+        finally:
+            with self.condition:
+                self.active -= 1
+
+    def take(self, queue: deque) -> List[PendingText]:
+        """Pop the longest FIFO prefix of a bucket that fits the batch limits"""
+        batch = []
+        longest = 0
+        while queue and len(batch) < self.max_batch_size:
+            length = max(longest, queue[0].length)
+            if batch and (len(batch) + 1) * length > self.max_tokens:
+                break
+            batch.append(queue.popleft())
+            longest = length
+        return batch
+
+    def full(self, queue: deque) -> bool:
+        """Whether the bucket holds more than one batch can take"""
+        if len(queue) >= self.max_batch_size:
+            return True
+        longest = 0
+        for count, item in enumerate(queue, 1):
+            longest = max(longest, item.length)
+            if count > 1 and count * longest > self.max_tokens:
+                return True
+        return False
+
+    def ready(self, now: float) -> List[List[PendingText]]:
+        """Batches that should run now, full buckets first"""
+        batches = []
+        for queue in self.buckets:
+            while queue and len(batches) < self.parallel and self.full(queue):
+                batches.append(self.take(queue))
+        full = len(batches)
+        # No other caller can add texts, so waiting would only add latency
+        idle = self.active >= self.callers
+        for queue in self.buckets:
+            if queue and len(batches) < self.parallel and (idle or now - queue[0].enqueued >= self.max_wait):
+                batches.append(self.take(queue))
+        with self.stats_lock:
+            self.stats['flush_full'] += full
+            self.stats['flush_deadline'] += len(batches) - full
+        return batches
+
+    def next_deadline(self, now: float) -> Optional[float]:
+        oldest = [queue[0].enqueued for queue in self.buckets if queue]
+        if not oldest:
+            return None
+        return max(min(oldest) + self.max_wait - now, 0)
+
+    def loop(self):
+        while True:
+            with self.condition:
+                while True:
+                    if not self.running:
+                        return
+                    now = time.monotonic()
+                    batches = self.ready(now)
+                    if batches:
+                        break
+                    self.condition.wait(self.next_deadline(now))
+
+            self.run(batches)
+
+    def run(self, batches: List[List[PendingText]]):
+        """Run ready batches and resolve their futures"""
+        started = time.monotonic()
+        try:
+            outputs = self.run_batches([[item.text for item in batch] for batch in batches])
+        except Exception as e:
+            # Texts that fail on their own come back as None, this is the model
+            # or worker pool itself failing, so callers see the error
+            logger.error(f"Batched inference failed for {len(batches)} batches: {e}")
+            for batch in batches:
+                for item in batch:
+                    item.future.set_exception(e)
+            return
+
+        with self.stats_lock:
+            logged = self.stats['batches'] // self.log_every if self.log_every else 0
+            for batch in batches:
+                self.stats['batches'] += 1
+                self.stats['texts'] += len(batch)
+                self.stats['real_tokens'] += sum(item.length for item in batch)
+                self.stats['padded_tokens'] += len(batch) * max(item.length for item in batch)
+                self.waits.extend(started - item.enqueued for item in batch)
+            log = self.log_every and self.stats['batches'] // self.log_every > logged
+
+        for batch, batch_outputs in zip(batches, outputs):
+            for item, output in zip(batch, batch_outputs):
+                item.future.set_result(output)
+
+        if log:
+            metrics = self.metrics()
+            logger.info(
+                f"Dynamic batching: {metrics['mean_batch_size']:.1f} texts per batch, "
+                f"{metrics['padding_efficiency']:.1%} padding efficiency, "
+                f"p95 queue wait {metrics['queue_wait_p95'] * 1000:.1f}ms"
+            )
+
+    def padding_efficiency(self) -> float:
+        """Share of the tokens sent to the model that were not padding"""
+        with self.stats_lock:
+            return self.stats['real_tokens'] / max(self.stats['padded_tokens'], 1)
+
+    def metrics(self) -> Dict:
+        """Counters plus padding efficiency and queue-wait percentiles"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+            waits = list(self.waits)
+        waits = np.array(waits) if waits else np.zeros(1)
+        return {
+            **stats,
+            'mean_batch_size': stats['texts'] / max(stats['batches'], 1),
+            'padding_efficiency': stats['real_tokens'] / max(stats['padded_tokens'], 1),
+            'queue_wait_p50': float(np.percentile(waits, 50)),
+            'queue_wait_p95': float(np.percentile(waits, 95)),
+            'queue_wait_max': float(waits.max())
+        }
+
+    def close(self):
+        """Stop the batching thread, failing anything still queued"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        with self.condition:
+            for queue in self.buckets:
+                while queue:
+                    queue.popleft().future.set_exception(RuntimeError('batcher closed'))
@@ -0,0 +1,148 @@
+import json
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List
+from loguru import logger
+
+from common.metrics import counter
+
+CACHE_LOOKUPS = counter('emotion_cache_lookups_total', 'Inference cache lookups by tier that answered', ('result',))
+CACHE_EVICTIONS = counter('emotion_cache_evictions_total', 'Entries evicted from the in-process cache tier')
+CACHE_HITS = CACHE_LOOKUPS.labels('hit')
+CACHE_REDIS_HITS = CACHE_LOOKUPS.labels('redis_hit')
+CACHE_MISSES = CACHE_LOOKUPS.labels('miss')
+
+
+def normalize_text(text: str, max_length: int) -> str:
+    """Normalize and truncate text the same way for cache keys and inference"""
+    text = unicodedata.normalize('NFC', text or '')
+    text = ' '.join(text.split())
+    return text[:max_length]
+
+
+def copy_result(result: Dict) -> Dict:
+    """Copy an emotion result so callers can mutate it freely"""
+    copied = dict(result)
+    copied['raw_scores'] = dict(result.get('raw_scores', {}))
+    return copied
+
+
+class InferenceCache:
+    """Two-tier emotion result cache: in-process LRU backed by optional shared Redis
+
+    Keys are prefixed with a fingerprint of the model name and every setting
+    that changes a result for the same text, like backend, truncation and
+    chunking, so replicas with different settings never share entries.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_size: int = 10000,
+        redis_client=None,
+        ttl: int = 86400,
+        settings: Dict = None
+    ):
+        self.model_name = model_name
+        self.fingerprint = hashlib.blake2b(
+            json.dumps({'model': model_name, **(settings or {})}, sort_keys=True).encode('utf-8'),
+            digest_size=6
+        ).hexdigest()
+        self.max_size = max_size
+        self.redis_client = redis_client if ttl > 0 else None
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'redis_hits': 0,
+            'misses': 0,
+            'evictions': 0
+        }
+
+    def key(self, text: str) -> str:
+        """Settings fingerprint and hash of the normalized text"""
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+        return f'emotion_cache:{self.fingerprint}:{digest}'
+
+    def get_many(self, texts: List[str]) -> Dict[str, Dict]:
+        """Look up normalized texts, returning copies of the cached results"""
+        found = {}
+        remote = []
+
+        for text in texts:
+            key = self.key(text)
+            with self.lock:
+                result = self.entries.get(key)
+                if result is not None:
+                    self.entries.move_to_end(key)
+                    self.stats['hits'] += 1
+            if result is not None:
+                CACHE_HITS.inc()
+                found[text] = copy_result(result)
+            else:
+                remote.append((text, key))
+
+        redis_hits = 0
+        if remote and self.redis_client is not None:
+            try:
+                values = self.redis_client.mget([key for _, key in remote])
+            except Exception as e:
+                logger.error(f"Error reading inference cache from Redis: {e}")
+                values = [None] * len(remote)
+
+            for (text, key), value in zip(remote, values):
+                if value is None:
+                    continue
+                result = json.loads(value)
+                self.store(key, result)
+                redis_hits += 1
+                found[text] = copy_result(result)
+
+        misses = len(texts) - len(found)
+        with self.lock:
+            self.stats['redis_hits'] += redis_hits
+            self.stats['misses'] += misses
+        CACHE_REDIS_HITS.inc(redis_hits)
+        CACHE_MISSES.inc(misses)
+        return found
+
+    def put_many(self, results: Dict[str, Dict]):
+        """Cache fresh inference results keyed by normalized text"""
+        if not results:
+            return
+
+        keyed = {self.key(text): copy_result(result) for text, result in results.items()}
+        for key, result in keyed.items():
+            self.store(key, result)
+
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key, result in keyed.items():
+                    pipe.setex(key, self.ttl, json.dumps(result))
+                pipe.execute()
+            except Exception as e:
+                logger.error(f"Error writing inference cache to Redis: {e}")
+
+    def store(self, key: str, result: Dict):
+        """Insert into the LRU tier, evicting the oldest entries"""
+        evicted = 0
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                evicted += 1
+            self.stats['evictions'] += evicted
+        if evicted:
+            CACHE_EVICTIONS.inc(evicted)
+
+    def hit_rate(self) -> float:
+        """Fraction of lookups served from either tier"""
+        with self.lock:
+            hits = self.stats['hits'] + self.stats['redis_hits']
+            misses = self.stats['misses']
+        return hits / max(hits + misses, 1)
@@ -0,0 +1,98 @@
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+
+AGGREGATIONS = ('mean', 'max', 'weighted')
+
+
+class TextChunker:
+    """Token-aware splitting of long documents into overlapping model-sized chunks"""
+
+    def __init__(self, tokenizer, max_tokens: int = 0, stride: int = 64):
+        self.tokenizer = tokenizer
+
+        # Leave room for the special tokens the pipeline adds around each chunk
+        model_max = getattr(tokenizer, 'model_max_length', 512)
+        if not model_max or model_max > 100000:
+            model_max = 512
+        limit = model_max - tokenizer.num_special_tokens_to_add(pair=False)
+        self.max_tokens = min(max_tokens, limit) if max_tokens > 0 else limit
+        self.stride = min(max(stride, 0), self.max_tokens - 1)
+
+    def windows(self, length: int) -> List[Tuple[int, int]]:
+        """Token index ranges covering a document, overlapping by stride"""
+        if length <= self.max_tokens:
+            return [(0, length)]
+
+        step = self.max_tokens - self.stride
+        windows = []
+        for start in range(0, length, step):
+            end = min(start + self.max_tokens, length)
+            windows.append((start, end))
+            if end == length:
+                break
+        return windows
+
+    def split(self, texts: List[str]) -> Tuple[List[str], List[int], List[int]]:
+        """Split documents into chunks, returning chunk texts, owning document and token count"""
+        chunks = []
+        owners = []
+        lengths = []
+
+        fast = getattr(self.tokenizer, 'is_fast', False)
+        encoded = self.tokenizer(
+            texts,
+            add_special_tokens=False,
+            truncation=False,
+            return_offsets_mapping=fast
+        )
+
+        for doc, input_ids in enumerate(encoded['input_ids']):
+            windows = self.windows(len(input_ids))
+            if len(windows) == 1:
+                chunks.append(texts[doc])
+                owners.append(doc)
+                lengths.append(max(len(input_ids), 1))
+                continue
+
+            offsets = encoded['offset_mapping'][doc] if fast else None
+            for start, end in windows:
+                if offsets is not None:
+                    # Slice the original text so chunks keep their exact characters
+                    chunk = texts[doc][offsets[start][0]:offsets[end - 1][1]]
+                else:
+                    chunk = self.tokenizer.decode(input_ids[start:end])
+                chunks.append(chunk)
+                owners.append(doc)
+                lengths.append(end - start)
+
+        if len(chunks) > len(texts):
+            logger.debug(f"Split {len(texts)} documents into {len(chunks)} chunks")
+
+        return chunks, owners, lengths
+
+
+def aggregate(distributions: List[List[Dict]], lengths: List[int], method: str = 'weighted') -> Optional[Dict]:
+    """Combine per-chunk label distributions into one {'label', 'score'} output
+
+    mean averages every chunk equally, weighted weighs chunks by token count
+    and max keeps the distribution of the most confident chunk.
+    """
+    scored = [(d, n) for d, n in zip(distributions, lengths) if d]
+    if not scored:
+        return None
+    if len(scored) == 1:
+        return scored[0][0][0]
+
+    if method == 'max':
+        return max((d[0] for d, _ in scored), key=lambda output: output['score'])
+
+    totals = {}
+    weight_sum = 0
+    for distribution, length in scored:
+        weight = length if method == 'weighted' else 1
+        weight_sum += weight
+        for output in distribution:
+            totals[output['label']] = totals.get(output['label'], 0.0) + output['score'] * weight
+
+    label = max(totals, key=totals.get)
+    return {'label': label, 'score': totals[label] / weight_sum}
@@ -0,0 +1,163 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+from loguru import logger
+
+# Model shared with forked workers, set in the parent before the fork
+worker_state = {}
+
+
+class WorkerPoolError(RuntimeError):
+    """Inference workers kept dying after the pool was restarted"""
+
+
+def run_pipeline(emotion_pipeline, texts: List[str]) -> List[Optional[List[Dict]]]:
+    """Run one forward pass over texts
+
+    Returns every label's score per text, best first, or None where
+    inference failed.
+    """
+    try:
+        outputs = emotion_pipeline(texts, batch_size=len(texts), top_k=None, truncation=True)
+        if len(outputs) != len(texts):
+            raise ValueError(f"expected {len(texts)} outputs, got {len(outputs)}")
+        return [output if isinstance(output, list) else [output] for output in outputs]
+    except Exception as e:
+        if len(texts) > 1:
+            # Retry one by one so a single bad text cannot poison the batch
+            logger.error(f"Batched inference failed for {len(texts)} texts, retrying individually: {e}")
+            return [run_pipeline(emotion_pipeline, [text])[0] for text in texts]
+        logger.error(f"Error analyzing emotion: {e}")
+        return [None]
+
+
+def physical_cores() -> int:
+    """Number of physical CPU cores, falling back to logical CPUs"""
+    cores = set()
+    try:
+        with open('/proc/cpuinfo') as f:
+            physical_id = None
+            for line in f:
+                if line.startswith('physical id'):
+                    physical_id = line.split(':')[1].strip()
+                elif line.startswith('core id'):
+                    cores.add((physical_id, line.split(':')[1].strip()))
+    except OSError:
+        pass
+
+    available = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    return min(len(cores), available) if cores else (available or 1)
+
+
+def init_worker(threads: int):
+    """Limit torch intra-op threads inside each worker process"""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def init_spawned_worker(threads: int, backend: Dict):
+    """Load the model inside a spawned worker, which inherits nothing from the parent"""
+    init_worker(threads)
+    from backends import load_backend
+    worker_state['pipeline'] = load_backend(**backend)
+
+
+def worker_ready(index: int) -> int:
+    """No-op task used to fork the workers up front"""
+    return os.getpid()
+
+
+def worker_infer(texts: List[str]) -> List[Optional[List[Dict]]]:
+    """Run inference inside a worker process"""
+    return run_pipeline(worker_state['pipeline'], texts)
+
+
+class InferenceWorkerPool:
+    """Forked inference processes sharing one copy of the model weights
+
+    The model is loaded once in the parent and its tensors moved to shared
+    memory, then workers are forked so every process maps the same weights.
+    The pool must be created before the parent starts any thread or client,
+    a fork copies locks held by other threads into the child. Inference must
+    not run in the parent before the fork either, otherwise the workers
+    inherit a half-initialized OpenMP thread pool.
+
+    A worker that dies breaks the whole executor, so map() starts a new one
+    and retries once before giving up. By then the parent is running
+    threads, so the replacement workers are spawned and each loads the
+    model from the backend arguments instead of sharing the parent's copy.
+    """
+
+    def __init__(self, emotion_pipeline, workers: int, backend: Dict, threads_per_worker: int = 0):
+        self.workers = workers
+        # load_backend() arguments for spawned workers
+        self.backend = backend
+        self.threads_per_worker = threads_per_worker or max(physical_cores() // workers, 1)
+
+        model = getattr(emotion_pipeline, 'model', None)
+        if hasattr(model, 'share_memory'):
+            model.share_memory()
+
+        worker_state['pipeline'] = emotion_pipeline
+        self.lock = threading.Lock()
+        self.restarts = 0
+        # Fork every worker now, while the parent is still idle
+        self.executor = self.start()
+
+    def start(self, spawn: bool = False) -> ProcessPoolExecutor:
+        """Fork, or spawn, a new set of workers and wait until all of them are up"""
+        if spawn:
+            context = multiprocessing.get_context('spawn')
+            initializer, initargs = init_spawned_worker, (self.threads_per_worker, self.backend)
+        else:
+            context = multiprocessing.get_context('fork')
+            initializer, initargs = init_worker, (self.threads_per_worker,)
+
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=initializer,
+            initargs=initargs
+        )
+        pids = set(executor.map(worker_ready, range(self.workers)))
+        logger.info(
+            f"Started {len(pids)} inference workers ({context.get_start_method()}) with "
+            f"{self.threads_per_worker} threads each"
+        )
+        return executor
+
+    def restart(self, broken: ProcessPoolExecutor):
+        """Replace a broken executor, once even when several callers saw it break"""
+        with self.lock:
+            if self.executor is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            # Forking the running service could copy a held lock into the workers
+            self.executor = self.start(spawn=True)
+            self.restarts += 1
+
+    def map(self, batches: List[List[str]]) -> List[List[Optional[List[Dict]]]]:
+        """Run batches across the workers, returning outputs in input order"""
+        executor = self.executor
+        try:
+            return list(executor.map(worker_infer, batches))
+        except BrokenProcessPool as e:
+            logger.error(f"Inference worker died, restarting the pool: {e}")
+
+        try:
+            # The broken executor stays in place if the new workers fail to
+            # start, so the next call tries again
+            self.restart(executor)
+            return list(self.executor.map(worker_infer, batches))
+        except BrokenProcessPool as e:
+            raise WorkerPoolError(f"inference workers died again after a restart: {e}") from e
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,132 @@
+import time
+import threading
+from datetime import datetime
+from typing import Dict
+from loguru import logger
+
+from common.metrics import histogram, REDIS_SECONDS, SIZE_BUCKETS
+from common.records import encode
+
+FLUSH_SIZE = histogram('emotion_kol_flush_size', 'KOL updates written per coalesced flush', buckets=SIZE_BUCKETS)
+REDIS_FLUSH = REDIS_SECONDS.labels('kol_flush')
+
+
+class KolUpdatePublisher:
+    """Coalesced KOL aggregate writes and batched emotion_updates events
+
+    Updates are buffered per KOL, a newer one replacing the pending one, and
+    a background thread writes them every flush_interval seconds: one HSET
+    per KOL and one kol_emotion_updates message per max_batch KOLs, all on a
+    single pipeline. A KOL's score is never older than flush_interval when
+    it reaches Redis, unless Redis itself is failing.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        channel: str = 'emotion_updates',
+        flush_interval: float = 0.25,
+        max_batch: int = 200,
+        message_format: str = 'json'
+    ):
+        self.redis_client = redis_client
+        self.channel = channel
+        self.flush_interval = flush_interval
+        self.max_batch = max(max_batch, 1)
+        self.message_format = message_format
+
+        self.pending = {}
+        self.oldest = None
+        self.condition = threading.Condition()
+        self.running = True
+
+        self.stats = {'updates': 0, 'coalesced': 0, 'flushes': 0, 'messages': 0, 'failed_flushes': 0}
+
+        self.thread = threading.Thread(target=self.loop, name='kol-updates', daemon=True)
+        self.thread.start()
+
+    def update(self, username: str, kol_data: Dict):
+        """Queue the latest aggregate of a KOL for the next flush"""
+        with self.condition:
+            self.stats['updates'] += 1
+            if username in self.pending:
+                self.stats['coalesced'] += 1
+            elif not self.pending:
+                self.oldest = time.monotonic()
+                self.condition.notify()
+            self.pending[username] = kol_data
+
+    def loop(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                delay = self.oldest + self.flush_interval - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                batch = self.take()
+
+            self.write(batch)
+
+    def take(self) -> Dict[str, Dict]:
+        batch = self.pending
+        self.pending = {}
+        self.oldest = None
+        return batch
+
+    def write(self, batch: Dict[str, Dict]):
+        """Send one HSET per KOL and the batched events in a single round-trip"""
+        if not batch:
+            return
+
+        items = list(batch.values())
+        pipe = self.redis_client.pipeline(transaction=False)
+        for username, kol_data in batch.items():
+            pipe.hset(f'kol:{username}', mapping=kol_data)
+        messages = 0
+        for start in range(0, len(items), self.max_batch):
+            pipe.publish(self.channel, encode({
+                'type': 'kol_emotion_updates',
+                'data': items[start:start + self.max_batch],
+                'timestamp': datetime.utcnow().isoformat()
+            }, self.message_format))
+            messages += 1
+
+        try:
+            with REDIS_FLUSH.time():
+                pipe.execute()
+        except Exception as e:
+            logger.error(f"Error flushing {len(batch)} KOL updates: {e}")
+            self.stats['failed_flushes'] += 1
+            self.requeue(batch)
+            return
+
+        FLUSH_SIZE.observe(len(batch))
+        self.stats['flushes'] += 1
+        self.stats['messages'] += messages
+
+    def requeue(self, batch: Dict[str, Dict]):
+        """Put a failed flush back, unless newer updates arrived meanwhile"""
+        with self.condition:
+            for username, kol_data in batch.items():
+                self.pending.setdefault(username, kol_data)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            self.condition.notify()
+
+    def flush(self):
+        """Write everything pending now"""
+        with self.condition:
+            batch = self.take()
+        self.write(batch)
+
+    def close(self):
+        """Stop the flush thread and write what is left"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
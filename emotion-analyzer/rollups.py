@@ -0,0 +1,294 @@
+"""Minute/hour/day emotion rollups per KOL and per event
+
+Every persisted batch adds its results to pre-aggregated buckets in the
+emotion_rollups collection with upserted $inc updates. Batches are queued
+and a background thread merges them into one unordered bulk write every
+flush_interval seconds, so the rollups stay off the tweet write path.
+Only first analyses are recorded, the analyzer leaves out tweets that
+another writer analyzed first. A bucket holds counts, score sums and
+propagation sums in total and per emotion, so a chart over any range reads
+one document per bucket however many tweets it covers. Increments still
+queued when a replica dies are lost, they are never written twice.
+
+Minute and hour buckets carry an expiresAt date for a TTL index, which is
+how old data is downsampled: past its retention a range is only served by
+the coarser buckets, which were written alongside.
+
+    python rollups.py query --scope kol --target elonmusk --hours 24
+    python rollups.py query --scope event --target 1 --days 30 --resolution day
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError
+from loguru import logger
+
+# Shared modules sit next to the service in the image and one level up in the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.indexes import ensure_indexes
+from common.metrics import MONGO_SECONDS
+
+EPOCH = datetime(1970, 1, 1)
+
+# Bucket width in seconds, finest first
+RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+ROLLUP_INDEXES = [
+    # Bucket-range reads for one KOL or event at one resolution
+    IndexModel(
+        [('scope', ASCENDING), ('target', ASCENDING), ('resolution', ASCENDING), ('bucket', ASCENDING)],
+        name='rollup_range'
+    ),
+    # Drops minute and hour buckets past their retention, day buckets have no expiresAt
+    IndexModel([('expiresAt', ASCENDING)], name='rollup_expiry', expireAfterSeconds=0)
+]
+
+MONGO_ROLLUP = MONGO_SECONDS.labels('rollup_upsert')
+
+
+def floor_time(timestamp: datetime, resolution: str) -> datetime:
+    """Start of the bucket holding a UTC timestamp, as a naive datetime like MongoDB returns"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    width = RESOLUTIONS[resolution]
+    seconds = (timestamp - EPOCH).total_seconds()
+    return EPOCH + timedelta(seconds=seconds // width * width)
+
+
+class RollupStore:
+    """Upserted time-series buckets for the kol and event scopes"""
+
+    def __init__(
+        self,
+        collection,
+        retention: Optional[Dict[str, Optional[timedelta]]] = None,
+        max_points: int = 1500,
+        flush_interval: float = 1.0
+    ):
+        self.collection = collection
+        # How long each resolution is kept, None keeps it forever
+        self.retention = {'minute': timedelta(days=2), 'hour': timedelta(days=90), 'day': None}
+        self.retention.update(retention or {})
+        self.max_points = max_points
+        self.flush_interval = flush_interval
+        self.stats = {'tweets': 0, 'upserts': 0, 'round_trips': 0, 'failed': 0}
+
+        # (results, sources, timestamps) batches waiting for the flush thread
+        self.pending = []
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = None
+        if flush_interval > 0:
+            self.thread = threading.Thread(target=self.loop, name='rollup-flush', daemon=True)
+            self.thread.start()
+
+    def ensure_indexes(self) -> List[str]:
+        return ensure_indexes(self.collection, ROLLUP_INDEXES)
+
+    def bucket_id(self, scope: str, target: str, resolution: str, bucket: datetime) -> str:
+        return f"{scope}|{target}|{resolution}|{bucket.isoformat()}"
+
+    def increments(self, results: List[Dict], sources: List[Tuple], timestamps: List[datetime]) -> Dict[Tuple, Dict]:
+        """$inc documents per (scope, target, resolution, bucket) for a batch"""
+        updates = {}
+        for result, (author, event_ids), timestamp in zip(results, sources, timestamps):
+            targets = [('event', str(event_id)) for event_id in event_ids]
+            if author:
+                targets.append(('kol', author))
+
+            emotion = result['emotion']
+            score = float(result['score'])
+            propagation = float(result['propagation_score'])
+            for resolution in RESOLUTIONS:
+                bucket = floor_time(timestamp, resolution)
+                for scope, target in targets:
+                    inc = updates.setdefault((scope, target, resolution, bucket), {})
+                    for prefix in ('', f'emotions.{emotion}.'):
+                        inc[f'{prefix}count'] = inc.get(f'{prefix}count', 0) + 1
+                        inc[f'{prefix}scoreSum'] = inc.get(f'{prefix}scoreSum', 0.0) + score
+                        inc[f'{prefix}propagationSum'] = inc.get(f'{prefix}propagationSum', 0.0) + propagation
+        return updates
+
+    def operations(self, updates: Dict[Tuple, Dict]) -> List[UpdateOne]:
+        operations = []
+        for (scope, target, resolution, bucket), inc in updates.items():
+            fields = {'scope': scope, 'target': target, 'resolution': resolution, 'bucket': bucket}
+            if self.retention.get(resolution) is not None:
+                fields['expiresAt'] = bucket + timedelta(seconds=RESOLUTIONS[resolution]) + self.retention[resolution]
+            operations.append(UpdateOne(
+                {'_id': self.bucket_id(scope, target, resolution, bucket)},
+                {'$inc': inc, '$setOnInsert': fields},
+                upsert=True
+            ))
+        return operations
+
+    def record(self, results: List[Dict], sources: List[Tuple], timestamps: List[datetime]):
+        """Add analyzed tweets to their buckets, timestamped by tweet creation time
+
+        Queued for the next flush, or written right away without a flush thread.
+        """
+        if not results:
+            return
+        if self.thread is None:
+            self.write([(results, sources, timestamps)])
+            return
+
+        with self.condition:
+            self.pending.append((results, sources, timestamps))
+
+    def loop(self):
+        while True:
+            with self.condition:
+                if self.running:
+                    self.condition.wait(self.flush_interval)
+                running = self.running
+                batches, self.pending = self.pending, []
+
+            if batches:
+                self.write(batches)
+            if not running:
+                return
+
+    def flush(self):
+        """Write the queued batches now"""
+        with self.condition:
+            batches, self.pending = self.pending, []
+        if batches:
+            self.write(batches)
+
+    def close(self):
+        """Stop the flush thread after writing what is queued"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def write(self, batches: List[Tuple[List[Dict], List[Tuple], List[datetime]]]):
+        """Merge queued batches per bucket and apply them as one unordered bulk write"""
+        results = [result for batch in batches for result in batch[0]]
+        updates = self.increments(
+            results,
+            [source for batch in batches for source in batch[1]],
+            [timestamp for batch in batches for timestamp in batch[2]]
+        )
+        if not updates:
+            return
+        operations = self.operations(updates)
+
+        self.stats['tweets'] += len(results)
+        self.stats['upserts'] += len(operations)
+        for attempt in range(2):
+            self.stats['round_trips'] += 1
+            try:
+                with MONGO_ROLLUP.time():
+                    self.collection.bulk_write(operations, ordered=False)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                # Two writers inserting the same new bucket, the loser retries as an update
+                retry = [operations[error['index']] for error in errors if error.get('code') == 11000]
+                if attempt == 0 and len(retry) == len(errors):
+                    operations = retry
+                    continue
+                self.stats['failed'] += len(errors)
+                logger.error(f"Error updating {len(errors)} of {len(operations)} rollup buckets: {errors[0].get('errmsg')}")
+                return
+            except Exception as e:
+                self.stats['failed'] += len(operations)
+                logger.error(f"Error updating {len(operations)} rollup buckets: {e}")
+                return
+
+    def pick_resolution(self, start: datetime, end: datetime) -> str:
+        """Finest resolution still retained at start that fits in max_points buckets"""
+        now = datetime.utcnow()
+        for resolution, width in RESOLUTIONS.items():
+            retention = self.retention.get(resolution)
+            if retention is not None and start < now - retention:
+                continue
+            if (end - start).total_seconds() / width <= self.max_points:
+                return resolution
+        return 'day'
+
+    def query(
+        self,
+        scope: str,
+        target: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        resolution: Optional[str] = None
+    ) -> List[Dict]:
+        """Buckets of one KOL or event in [start, end), oldest first, with averages"""
+        end = end or datetime.utcnow()
+        resolution = resolution or self.pick_resolution(start, end)
+        cursor = self.collection.find(
+            {
+                'scope': scope,
+                'target': str(target),
+                'resolution': resolution,
+                'bucket': {'$gte': floor_time(start, resolution), '$lt': end}
+            },
+            {'_id': 0, 'expiresAt': 0}
+        ).sort('bucket', ASCENDING)
+
+        buckets = []
+        for doc in cursor:
+            count = max(doc.get('count', 0), 1)
+            doc['avgScore'] = doc.get('scoreSum', 0.0) / count
+            doc['avgPropagation'] = doc.get('propagationSum', 0.0) / count
+            doc['emotionCounts'] = {
+                emotion: values.get('count', 0)
+                for emotion, values in (doc.get('emotions') or {}).items()
+            }
+            buckets.append(doc)
+        return buckets
+
+
+def store_from_env(db, flush_interval: Optional[float] = None) -> RollupStore:
+    """RollupStore on db.emotion_rollups with retention and flush interval from the environment"""
+    if flush_interval is None:
+        flush_interval = int(os.getenv('ROLLUP_FLUSH_MS', 1000)) / 1000
+    return RollupStore(
+        db[os.getenv('ROLLUP_COLLECTION', 'emotion_rollups')],
+        retention={
+            'minute': timedelta(days=float(os.getenv('ROLLUP_MINUTE_RETENTION_DAYS', 2))),
+            'hour': timedelta(days=float(os.getenv('ROLLUP_HOUR_RETENTION_DAYS', 90)))
+        },
+        flush_interval=flush_interval
+    )
+
+
+def main():
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Read emotion rollup buckets')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    query = subparsers.add_parser('query', help='print the buckets of one KOL or event as JSON lines')
+    query.add_argument('--scope', choices=('kol', 'event'), required=True)
+    query.add_argument('--target', required=True, help='KOL username or event id')
+    query.add_argument('--hours', type=float, default=0)
+    query.add_argument('--days', type=float, default=0)
+    query.add_argument('--resolution', choices=list(RESOLUTIONS), help='default: finest that fits the range')
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://mongo:27017/emotion_tweets'))
+    store = store_from_env(client.emotion_tweets, flush_interval=0)
+    span = timedelta(hours=args.hours, days=args.days) or timedelta(hours=24)
+
+    started = time.perf_counter()
+    buckets = store.query(args.scope, args.target, datetime.utcnow() - span, resolution=args.resolution)
+    for bucket in buckets:
+        print(json.dumps(bucket, default=str, ensure_ascii=False))
+    logger.info(f"{len(buckets)} buckets in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from loguru import logger
+
+
+class UserJob:
+    """Unanalyzed tweets of one user moving through the pipeline stages"""
+
+    def __init__(self, username: str, entries: List[Tuple[str, str]]):
+        self.username = username
+        # (stream, entry id) of every notification this job acknowledges
+        self.entries = list(entries)
+        self.followup_entries = []
+        self.results = []
+        self.outstanding = 0
+        self.fetched = False
+        self.failed = False
+
+
+class AnalyzerService:
+    """Async core for the analyzer: ingest -> infer -> persist stages plus trend analysis
+
+    Blocking Redis and MongoDB calls run on an I/O thread pool and model
+    inference on its own pool, so the event loop never stalls. Stages are
+    connected by bounded queues: when persistence falls behind, inference
+    waits, and when inference falls behind, ingest stops reading the stream.
+    """
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+
+        # Backpressure and per-stage concurrency
+        self.ingest_queue_size = int(os.getenv('ANALYZER_INGEST_QUEUE_SIZE', 100))
+        self.persist_queue_size = int(os.getenv('ANALYZER_PERSIST_QUEUE_SIZE', 8))
+        self.infer_concurrency = int(os.getenv('ANALYZER_INFER_CONCURRENCY', 1))
+        self.persist_concurrency = int(os.getenv('ANALYZER_PERSIST_CONCURRENCY', 2))
+        self.trend_interval = int(os.getenv('TREND_INTERVAL', 60))
+
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('ANALYZER_IO_THREADS', 8)),
+            thread_name_prefix='analyzer-io'
+        )
+        self.inference_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('ANALYZER_INFERENCE_THREADS', 1)),
+            thread_name_prefix='analyzer-infer'
+        )
+
+        # Jobs currently in flight, one per user
+        self.jobs = {}
+        self.ingest_queue = None
+        self.persist_queue = None
+
+    async def io(self, fn, *args):
+        """Run a blocking Redis/MongoDB call on the I/O pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_executor, functools.partial(fn, *args))
+
+    async def infer(self, fn, *args):
+        """Run model inference on the inference pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.inference_executor, functools.partial(fn, *args))
+
+    async def ingest_stage(self):
+        """Read coalesced notifications from the work queue"""
+        work_queue = self.analyzer.work_queue
+
+        while True:
+            try:
+                by_user = await self.io(
+                    work_queue.read,
+                    self.analyzer.queue_read_count,
+                    self.analyzer.queue_block_ms
+                )
+            except Exception as e:
+                logger.error(f"Error reading work queue: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            for username, entries in by_user.items():
+                job = self.jobs.get(username)
+                if job is not None:
+                    # Already in flight, run once more after it finishes
+                    job.followup_entries.extend(entries)
+                    continue
+
+                job = self.jobs[username] = UserJob(username, entries)
+                await self.ingest_queue.put(job)
+
+    async def infer_stage(self):
+        """Fetch pages of unanalyzed tweets and score them"""
+        while True:
+            job = await self.ingest_queue.get()
+            logger.info(f"Processing new tweets for @{job.username}")
+
+            try:
+                after_id = None
+                while True:
+                    tweets = await self.io(self.analyzer.fetch_unanalyzed, job.username, after_id)
+                    if not tweets:
+                        break
+
+                    emotion_results = await self.infer(self.analyzer.infer_tweets, tweets)
+                    job.outstanding += 1
+                    await self.persist_queue.put((job, tweets, emotion_results))
+
+                    if len(tweets) < self.analyzer.fetch_limit:
+                        break
+                    after_id = tweets[-1].id
+            except Exception as e:
+                logger.error(f"Error processing tweets for @{job.username}: {e}")
+                job.failed = True
+            finally:
+                job.fetched = True
+                await self.finish(job)
+
+    async def persist_stage(self):
+        """Write inferred batches back to MongoDB"""
+        while True:
+            job, tweets, emotion_results = await self.persist_queue.get()
+
+            try:
+                results = await self.io(self.analyzer.persist_tweet_batch, tweets, emotion_results)
+                job.results.extend(results)
+            except Exception as e:
+                logger.error(f"Error persisting tweets for @{job.username}: {e}")
+                job.failed = True
+            finally:
+                job.outstanding -= 1
+                await self.finish(job)
+
+    async def finish(self, job: UserJob):
+        """Publish the KOL aggregate and acknowledge once every page is persisted"""
+        if not job.fetched or job.outstanding:
+            return
+
+        del self.jobs[job.username]
+
+        try:
+            await self.io(self.analyzer.update_kol_aggregate, job.username, job.results)
+            # Failed jobs stay pending and are redelivered by the work queue
+            if not job.failed:
+                await self.io(self.analyzer.work_queue.ack_entries, job.entries)
+        except Exception as e:
+            logger.error(f"Error finishing tweets for @{job.username}: {e}")
+
+        if job.followup_entries:
+            followup = self.jobs[job.username] = UserJob(job.username, job.followup_entries)
+            # Never block a worker on a full ingest queue
+            asyncio.create_task(self.ingest_queue.put(followup))
+
+    async def trend_stage(self):
+        """Run trend analysis periodically without blocking the other stages"""
+        while True:
+            try:
+                await self.io(self.analyzer.analyze_emotion_trends)
+                await self.io(self.analyzer.snapshot_trends)
+            except Exception as e:
+                logger.error(f"Error analyzing trends: {e}")
+            await asyncio.sleep(self.trend_interval)
+
+    async def run(self):
+        """Start all stages and run until cancelled"""
+        self.ingest_queue = asyncio.Queue(maxsize=self.ingest_queue_size)
+        self.persist_queue = asyncio.Queue(maxsize=self.persist_queue_size)
+
+        tasks = [self.ingest_stage(), self.trend_stage()]
+        tasks += [self.infer_stage() for _ in range(self.infer_concurrency)]
+        tasks += [self.persist_stage() for _ in range(self.persist_concurrency)]
+
+        logger.info(
+            f"Analyzer service started: {self.infer_concurrency} infer, "
+            f"{self.persist_concurrency} persist workers"
+        )
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.io_executor.shutdown(wait=False, cancel_futures=True)
+            self.inference_executor.shutdown(wait=False, cancel_futures=True)
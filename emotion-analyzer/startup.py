@@ -0,0 +1,48 @@
+import os
+import json
+import time
+from datetime import datetime
+from typing import Dict
+from loguru import logger
+
+
+class StartupTimer:
+    """Wall-clock breakdown of the startup phases
+
+    Each lap records the time since the previous one under the given name.
+    """
+
+    def __init__(self, started: float = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.last = self.started
+        self.phases = {}
+
+    def lap(self, name: str):
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self.last
+        self.last = now
+
+    def report(self) -> Dict:
+        return {
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'total': round(time.perf_counter() - self.started, 3)
+        }
+
+    def log(self):
+        report = self.report()
+        phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in report['phases'].items())
+        logger.info(f"Startup finished in {report['total']:.2f}s ({phases})")
+
+
+def mark_ready(path: str, report: Dict):
+    """Write the readiness file checked by the container healthcheck"""
+    if not path:
+        return
+    with open(path, 'w') as f:
+        json.dump({'pid': os.getpid(), 'readyAt': datetime.utcnow().isoformat(), **report}, f)
+
+
+def clear_ready(path: str):
+    """Remove the readiness file so a stopping replica reports unhealthy"""
+    if path and os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,160 @@
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+from loguru import logger
+import numpy as np
+from scoring import EMOTION_WEIGHTS
+
+EMOTIONS = list(EMOTION_WEIGHTS)
+
+
+class SlidingWindow:
+    """Ring buffer of time buckets holding per-emotion counts and sums"""
+
+    def __init__(self, seconds: int, buckets: int, emotions: int):
+        self.seconds = seconds
+        self.buckets = buckets
+        self.width = max(seconds / buckets, 1e-9)
+        # Absolute bucket number stored in each slot, -1 when empty
+        self.epochs = np.full(buckets, -1, dtype=np.int64)
+        self.counts = np.zeros((buckets, emotions), dtype=np.int64)
+        self.score_sums = np.zeros((buckets, emotions), dtype=np.float64)
+        self.propagation_sums = np.zeros((buckets, emotions), dtype=np.float64)
+
+    def slot(self, timestamp: float) -> int:
+        """Slot for a timestamp, clearing it if it still holds an older bucket"""
+        epoch = int(timestamp // self.width)
+        slot = epoch % self.buckets
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            self.counts[slot] = 0
+            self.score_sums[slot] = 0
+            self.propagation_sums[slot] = 0
+        return slot
+
+    def add(self, timestamp: float, emotion: int, score: float, propagation: float):
+        """Count one analyzed tweet"""
+        slot = self.slot(timestamp)
+        self.counts[slot, emotion] += 1
+        self.score_sums[slot, emotion] += score
+        self.propagation_sums[slot, emotion] += propagation
+
+    def totals(self, now: float):
+        """Sum the buckets still inside the window"""
+        current = int(now // self.width)
+        live = (self.epochs > current - self.buckets) & (self.epochs <= current)
+        return (
+            self.counts[live].sum(axis=0),
+            self.score_sums[live].sum(axis=0),
+            self.propagation_sums[live].sum(axis=0)
+        )
+
+    def grow(self, emotions: int):
+        """Add columns for newly seen emotions"""
+        extra = emotions - self.counts.shape[1]
+        self.counts = np.pad(self.counts, ((0, 0), (0, extra)))
+        self.score_sums = np.pad(self.score_sums, ((0, 0), (0, extra)))
+        self.propagation_sums = np.pad(self.propagation_sums, ((0, 0), (0, extra)))
+
+
+class TrendAggregator:
+    """Incremental sliding-window emotion trends fed by persisted batches
+
+    Replaces the hourly MongoDB aggregation: every window is a fixed ring of
+    time buckets, so a trend query costs O(buckets) regardless of how many
+    tweets the collection holds.
+    """
+
+    def __init__(self, windows: List[int] = None, buckets: int = 60):
+        self.windows = {}
+        self.emotions = list(EMOTIONS)
+        self.index = {emotion: i for i, emotion in enumerate(self.emotions)}
+        self.lock = threading.Lock()
+
+        for seconds in windows or [60, 300, 3600]:
+            self.windows[seconds] = SlidingWindow(seconds, buckets, len(self.emotions))
+
+    def emotion_index(self, emotion: str) -> int:
+        """Column for an emotion, growing the buffers for unseen labels"""
+        index = self.index.get(emotion)
+        if index is None:
+            index = self.index[emotion] = len(self.emotions)
+            self.emotions.append(emotion)
+            for window in self.windows.values():
+                window.grow(len(self.emotions))
+        return index
+
+    def add(self, results: List[Dict], timestamp: Optional[float] = None):
+        """Record analyzed tweets with their emotion, score and propagation score"""
+        timestamp = time.time() if timestamp is None else timestamp
+
+        with self.lock:
+            for result in results:
+                emotion = self.emotion_index(result['emotion'])
+                for window in self.windows.values():
+                    window.add(timestamp, emotion, result['score'], result['propagation_score'])
+
+    def summary(self, seconds: int, now: Optional[float] = None) -> List[Dict]:
+        """Per-emotion count and means over a window, shaped like the old $group output"""
+        now = time.time() if now is None else now
+
+        with self.lock:
+            counts, score_sums, propagation_sums = self.windows[seconds].totals(now)
+            emotions = list(self.emotions)
+
+        trends = []
+        for i, emotion in enumerate(emotions):
+            count = int(counts[i])
+            if count:
+                trends.append({
+                    '_id': emotion,
+                    'count': count,
+                    'avgScore': float(score_sums[i] / count),
+                    'avgPropagation': float(propagation_sums[i] / count)
+                })
+        return trends
+
+    def snapshot(self, redis_client, key: str):
+        """Save the ring buffers to Redis so they survive restarts"""
+        with self.lock:
+            state = {
+                'emotions': self.emotions,
+                'windows': {
+                    str(seconds): {
+                        'buckets': window.buckets,
+                        'epochs': window.epochs.tolist(),
+                        'counts': window.counts.tolist(),
+                        'score_sums': window.score_sums.tolist(),
+                        'propagation_sums': window.propagation_sums.tolist()
+                    }
+                    for seconds, window in self.windows.items()
+                }
+            }
+        redis_client.set(key, json.dumps(state))
+
+    def restore(self, redis_client, key: str):
+        """Load a snapshot saved by a previous run, expired buckets drop out by themselves"""
+        try:
+            payload = redis_client.get(key)
+            if not payload:
+                return
+            state = json.loads(payload)
+
+            with self.lock:
+                for emotion in state['emotions']:
+                    self.emotion_index(emotion)
+                columns = [self.index[emotion] for emotion in state['emotions']]
+
+                for seconds, saved in state['windows'].items():
+                    window = self.windows.get(int(seconds))
+                    if window is None or saved['buckets'] != window.buckets:
+                        continue
+                    window.epochs[:] = saved['epochs']
+                    window.counts[:, columns] = saved['counts']
+                    window.score_sums[:, columns] = saved['score_sums']
+                    window.propagation_sums[:, columns] = saved['propagation_sums']
+
+            logger.info(f"Restored trend windows from {key}")
+        except Exception as e:
+            logger.error(f"Error restoring trend snapshot: {e}")
@@ -0,0 +1,188 @@
+import os
+import time
+import socket
+from typing import Dict, List, Tuple
+from loguru import logger
+import redis
+
+from common.metrics import histogram, REDIS_SECONDS
+from common.partitioning import shard_streams
+
+QUEUE_LAG = histogram('emotion_queue_lag_seconds', 'Age of new-tweet notifications when the analyzer reads them')
+REDIS_XACK = REDIS_SECONDS.labels('xack')
+
+
+class TweetWorkQueue:
+    """Durable new-tweet notifications on Redis Stream consumer groups
+
+    With NEW_TWEETS_SHARDS > 1 the scraper spreads notifications over that
+    many streams by KOL, and each replica only reads the shards it owns, so
+    one KOL is never analyzed by two replicas at once. With a single shard
+    no replica owns a KOL: every replica reads the one stream, the consumer
+    group balances entries, and two replicas may page through the same
+    KOL's tweets at once. Only the first write of each result is kept, so
+    nothing is counted twice, but the inference is wasted. Set the shard
+    count to at least the number of analyzer replicas to avoid it.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        stream: str = None,
+        group: str = None,
+        consumer: str = None,
+        shards: int = None
+    ):
+        self.redis_client = redis_client
+        self.stream = stream or os.getenv('NEW_TWEETS_STREAM', 'new_tweets_stream')
+        self.group = group or os.getenv('NEW_TWEETS_GROUP', 'emotion-analyzer')
+        self.consumer = consumer or os.getenv(
+            'NEW_TWEETS_CONSUMER',
+            f'{socket.gethostname()}-{os.getpid()}'
+        )
+        self.shards = shards if shards is not None else int(os.getenv('NEW_TWEETS_SHARDS', 1))
+
+        # Entries left pending this long by a dead consumer are redelivered
+        self.claim_idle_ms = int(os.getenv('NEW_TWEETS_CLAIM_IDLE_MS', 60000))
+        # Entries delivered this many times are acknowledged and dropped
+        self.max_deliveries = int(os.getenv('NEW_TWEETS_MAX_DELIVERIES', 5))
+
+        self.all_streams = shard_streams(self.stream, self.shards)
+        # Streams this replica reads, narrowed by assign() when partitioned
+        self.streams = list(self.all_streams)
+        for stream in self.all_streams:
+            self.ensure_group(stream)
+
+    def ensure_group(self, stream: str):
+        """Create the stream and consumer group if they do not exist yet"""
+        try:
+            self.redis_client.xgroup_create(stream, self.group, id='0', mkstream=True)
+            logger.info(f"Created consumer group {self.group} on {stream}")
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def assign(self, membership):
+        """Read only the shards the hash ring gives this replica"""
+        if self.shards <= 1:
+            return
+        streams = membership.owned(self.all_streams)
+        if streams != self.streams:
+            logger.info(f"Reading {len(streams)} of {self.shards} notification shards")
+        self.streams = streams
+
+    def read(self, count: int = 100, block_ms: int = 5000) -> Dict[str, List[Tuple[str, str]]]:
+        """Read notifications, coalesced into {username: [(stream, entry id)]}"""
+        streams = self.streams
+        if not streams:
+            # More replicas than shards, nothing to do until a rebalance
+            time.sleep(block_ms / 1000)
+            return {}
+
+        entries = self.claim_stale(streams, count)
+
+        if len(entries) < count:
+            response = self.redis_client.xreadgroup(
+                self.group,
+                self.consumer,
+                {stream: '>' for stream in streams},
+                count=count - len(entries),
+                block=None if entries else block_ms
+            )
+            for stream, stream_entries in response or []:
+                entries.extend((stream, entry_id, fields) for entry_id, fields in stream_entries)
+
+        self.observe_lag(entries)
+        return self.coalesce(entries)
+
+    def observe_lag(self, entries: List[Tuple[str, str, Dict]]):
+        """Record how long each entry waited, from the millisecond time in its id"""
+        now = time.time()
+        for _, entry_id, _ in entries:
+            QUEUE_LAG.observe(max(now - int(entry_id.split('-', 1)[0]) / 1000, 0))
+
+    def claim_stale(self, streams: List[str], count: int) -> List[Tuple[str, str, Dict]]:
+        """Take over entries another consumer read but never acknowledged"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for stream in streams:
+            pipe.xautoclaim(
+                stream,
+                self.group,
+                self.consumer,
+                self.claim_idle_ms,
+                start_id='0-0',
+                count=count
+            )
+
+        claimed = []
+        for stream, response in zip(streams, pipe.execute(raise_on_error=False)):
+            if isinstance(response, Exception):
+                logger.error(f"Error claiming pending entries on {stream}: {response}")
+                continue
+
+            entries = [entry for entry in response[1] if entry[1] is not None]
+            if not entries:
+                continue
+
+            logger.info(f"Reclaimed {len(entries)} pending entries from {stream}")
+            claimed.extend((stream, entry_id, fields) for entry_id, fields in self.drop_poisoned(stream, entries))
+        return claimed[:count]
+
+    def drop_poisoned(self, stream: str, entries: List[Tuple[str, Dict]]) -> List[Tuple[str, Dict]]:
+        """Acknowledge entries that keep failing instead of redelivering them forever"""
+        # Our own pending entries only, paged since entries still in flight
+        # here can share the id range with the ones just claimed
+        wanted = {entry_id for entry_id, _ in entries}
+        deliveries = {}
+        start = entries[0][0]
+        while True:
+            pending = self.redis_client.xpending_range(
+                stream,
+                self.group,
+                min=start,
+                max=entries[-1][0],
+                count=len(entries),
+                consumername=self.consumer
+            )
+            deliveries.update(
+                (p['message_id'], p['times_delivered']) for p in pending if p['message_id'] in wanted
+            )
+            if len(pending) < len(entries) or len(deliveries) == len(wanted):
+                break
+            start = f"({pending[-1]['message_id']}"
+
+        poisoned = [
+            entry_id for entry_id, _ in entries
+            if deliveries.get(entry_id, 0) > self.max_deliveries
+        ]
+        if poisoned:
+            logger.error(f"Dropping {len(poisoned)} entries after {self.max_deliveries} deliveries")
+            self.ack(poisoned, stream)
+
+        return [entry for entry in entries if entry[0] not in poisoned]
+
+    def coalesce(self, entries: List[Tuple[str, str, Dict]]) -> Dict[str, List[Tuple[str, str]]]:
+        """Group duplicate notifications for the same user, keeping the stream each came from"""
+        by_user = {}
+        for stream, entry_id, fields in entries:
+            username = fields.get('username')
+            if username:
+                by_user.setdefault(username, []).append((stream, entry_id))
+            else:
+                # Nothing to process, acknowledge right away
+                self.ack([entry_id], stream)
+        return by_user
+
+    def ack(self, entry_ids: List[str], stream: str = None):
+        """Acknowledge processed entries, the producer trims the stream length"""
+        if entry_ids:
+            with REDIS_XACK.time():
+                self.redis_client.xack(stream or self.stream, self.group, *entry_ids)
+
+    def ack_entries(self, entries: List[Tuple[str, str]]):
+        """Acknowledge (stream, entry id) pairs on the stream each was read from"""
+        by_stream = {}
+        for stream, entry_id in entries:
+            by_stream.setdefault(stream, []).append(entry_id)
+        for stream, entry_ids in by_stream.items():
+            self.ack(entry_ids, stream)
@@ -0,0 +1,190 @@
+import time
+import threading
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from loguru import logger
+
+CJK_RANGES = (
+    (0x3040, 0x30ff),   # Hiragana, Katakana
+    (0x3400, 0x4dbf),   # CJK Extension A
+    (0x4e00, 0x9fff),   # CJK Unified Ideographs
+    (0xac00, 0xd7af),   # Hangul syllables
+    (0xf900, 0xfaff)    # CJK Compatibility Ideographs
+)
+
+
+def is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return any(start <= code <= end for start, end in CJK_RANGES)
+
+
+def is_word(ch: str) -> bool:
+    """Letters and digits of space-separated scripts, where matches need word boundaries"""
+    return (ch.isalnum() or ch == '_') and not is_cjk(ch)
+
+
+def normalize(text: str) -> str:
+    """Width-fold, case-fold and collapse whitespace, for keywords and tweets alike"""
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+
+class EventMatcher:
+    """Aho-Corasick automaton over the keywords of every active event
+
+    A tweet is matched in one pass over its normalized text and hashtags, no
+    matter how many events are active. Keywords that start or end with a
+    letter or digit only match on word boundaries, so "AI" does not match
+    "said"; CJK keywords match anywhere. Multi-word keywords also match
+    their hashtag form, "artificial intelligence" matches
+    #ArtificialIntelligence.
+
+    update() diffs the new event list against the current one: event
+    changes only touch the keyword-to-event map, new keywords are added to
+    the trie followed by one failure-link pass, and removed keywords are
+    disabled until they make up half of the trie, which triggers a rebuild.
+    """
+
+    def __init__(self, events: Optional[List[Dict]] = None):
+        self.keyword_events = {}
+        self.pattern_ids = {}
+        self.terminals = []
+        self.patterns = []
+        self.goto = [{}]
+        # Tables used by match(), swapped in as one tuple so readers never see a partial update
+        self.automaton = ([{}], [0], [[]], [], [])
+        self.lock = threading.Lock()
+        if events:
+            self.update(events)
+
+    def keywords(self, events: Iterable[Dict]) -> Dict[str, Set[str]]:
+        """Normalized pattern -> ids of the events using it"""
+        index = {}
+        for event in events:
+            event_id = str(event['id'])
+            for keyword in event.get('keywords') or []:
+                keyword = normalize(keyword.lstrip('#＃'))
+                if not keyword:
+                    continue
+                index.setdefault(keyword, set()).add(event_id)
+                if ' ' in keyword:
+                    index.setdefault(keyword.replace(' ', ''), set()).add(event_id)
+        return index
+
+    def update(self, events: List[Dict]) -> bool:
+        """Apply a new active event list, returning whether matching changed"""
+        with self.lock:
+            return self.apply(events)
+
+    def apply(self, events: List[Dict]) -> bool:
+        started = time.perf_counter()
+        index = self.keywords(events)
+        if index == self.keyword_events:
+            return False
+
+        removed = [keyword for keyword in self.keyword_events if keyword not in index]
+        added = [keyword for keyword in index if keyword not in self.pattern_ids]
+        dead = len(self.pattern_ids) - len(self.keyword_events) + len(removed)
+
+        if removed and dead >= len(index):
+            # Mostly disabled patterns, start over with only the live ones
+            self.pattern_ids, self.terminals, self.patterns, self.goto = {}, [], [], [{}]
+            added = list(index)
+        if added:
+            # Copy on write, match() keeps using the old trie meanwhile
+            self.goto = [dict(edges) for edges in self.goto]
+            self.terminals = list(self.terminals)
+            self.patterns = list(self.patterns)
+            self.pattern_ids = dict(self.pattern_ids)
+            for keyword in added:
+                self.insert(keyword)
+            fail, output = self.link()
+        else:
+            fail, output = self.automaton[1], self.automaton[2]
+
+        pattern_events = [frozenset()] * len(self.patterns)
+        for keyword, pid in self.pattern_ids.items():
+            pattern_events[pid] = frozenset(index.get(keyword, ()))
+        self.automaton = (self.goto, fail, output, self.patterns, pattern_events)
+        self.keyword_events = index
+
+        logger.info(
+            f"Event matcher updated: {len(events)} events, {len(index)} keywords "
+            f"(+{len(added)} -{len(removed)}), {len(self.goto)} states "
+            f"in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+        return True
+
+    def insert(self, keyword: str):
+        node = 0
+        for ch in keyword:
+            child = self.goto[node].get(ch)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][ch] = child
+                self.goto.append({})
+            node = child
+
+        self.pattern_ids[keyword] = len(self.patterns)
+        self.patterns.append((len(keyword), is_word(keyword[0]), is_word(keyword[-1])))
+        self.terminals.append(node)
+
+    def link(self) -> Tuple[List[int], List[List[int]]]:
+        """Failure links and merged outputs for the whole trie, breadth-first"""
+        goto = self.goto
+        fail = [0] * len(goto)
+        # Each node outputs its own pattern plus everything along its failure chain
+        output = [[] for _ in goto]
+        for pid, node in enumerate(self.terminals):
+            output[node] = [pid]
+
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                fallback = fail[node]
+                while fallback and ch not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[child] = goto[fallback].get(ch, 0)
+                output[child] = output[child] + output[fail[child]]
+                queue.append(child)
+        return fail, output
+
+    def match(self, text: str, hashtags: Optional[List[str]] = None) -> Set[str]:
+        """Ids of every event with a keyword in the text or hashtags"""
+        goto, fail, output, patterns, pattern_events = self.automaton
+        if not patterns:
+            return set()
+        if hashtags:
+            text = f"{text} {' '.join('#' + tag for tag in hashtags)}"
+        text = normalize(text)
+
+        matched = set()
+        node = 0
+        last = len(text) - 1
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pid in output[node]:
+                events = pattern_events[pid]
+                if not events:
+                    continue
+                length, left, right = patterns[pid]
+                start = i - length + 1
+                if left and start > 0 and is_word(text[start - 1]):
+                    continue
+                if right and i < last and is_word(text[i + 1]):
+                    continue
+                matched.update(events)
+        return matched
+
+    def tag(self, tweets: List, event_id: Optional[str] = None):
+        """Set event_ids on each TweetRecord to the events it mentions"""
+        for tweet in tweets:
+            ids = self.match(tweet.content or '', tweet.hashtags)
+            ids.update(tweet.event_ids)
+            if event_id is not None:
+                # Found by this event's search, even if the match was on a field we do not see
+                ids.add(event_id)
+            tweet.event_ids = tuple(sorted(ids))
@@ -1,17 +1,34 @@
 import os
+import sys
 import asyncio
 import json
 from datetime import datetime, timedelta
 import redis
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 from loguru import logger
 import schedule
 import time
+import threading
 from typing import List, Dict, Optional
 import random
 import requests
 import ssl
 import certifi
+from uuid import uuid4
+
+# Shared modules sit next to the service in the image and one level up in the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.indexes import ensure_indexes
+from common.metrics import counter, histogram, start_metrics_server, MONGO_SECONDS, REDIS_SECONDS
+from common.profiler import install_signal_toggle
+from common.partitioning import Membership, shard_stream
+from common.records import TweetRecord, decode
+from rate_limit import TokenBucket
+from scheduler import RETRYABLE, ScrapeScheduler
+from watermarks import Watermarks, SeenTweets
+from event_matcher import EventMatcher
 
 # Configure SSL for Twitter access
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -31,6 +48,15 @@ except ImportError as e:
 # Configure logger
 logger.add("scraper.log", rotation="500 MB", level="INFO")
 
+# Prometheus metrics served on METRICS_PORT
+SCRAPE_SECONDS = histogram('scraper_scrape_seconds', 'Time to scrape and ingest one target', ('source',))
+TWEETS_SCRAPED = counter('scraper_tweets_scraped_total', 'Tweets fetched from a source', ('scope',))
+TWEETS_SKIPPED = counter('scraper_tweets_skipped_total', 'Fetched tweets dropped before storing', ('reason',))
+TWEETS_STORED = counter('scraper_tweets_stored_total', 'New tweets stored and queued for analysis', ('scope',))
+TWEETS_FAILED = counter('scraper_tweets_failed_total', 'Tweets that could not be stored')
+MONGO_BULK_UPSERT = MONGO_SECONDS.labels('bulk_upsert')
+REDIS_INGEST_WRITES = REDIS_SECONDS.labels('ingest_writes')
+
 class TwitterScraper:
     def __init__(self):
         self.redis_client = redis.Redis(
@@ -45,16 +71,62 @@ class TwitterScraper:
         self.tweets_collection = self.db.tweets
         
         # Create indexes
-        self.tweets_collection.create_index("tweetId", unique=True)
-        self.tweets_collection.create_index("createdAt")
-        self.tweets_collection.create_index("authorUsername")
+        ensure_indexes(self.tweets_collection)
+        
+        # Stream consumed by the emotion analyzer
+        self.new_tweets_stream = os.getenv('NEW_TWEETS_STREAM', 'new_tweets_stream')
+        self.new_tweets_stream_maxlen = int(os.getenv('NEW_TWEETS_STREAM_MAXLEN', 100000))
+        # Notifications spread over shards by KOL, read by the analyzer replica owning each shard
+        self.new_tweets_shards = int(os.getenv('NEW_TWEETS_SHARDS', 1))
+        
+        # Live scraper replicas split KOLs and events by consistent hashing
+        self.membership = Membership(
+            self.redis_client,
+            'scraper',
+            ttl=float(os.getenv('PARTITION_TTL_SECONDS', 15)),
+            interval=float(os.getenv('PARTITION_HEARTBEAT_SECONDS', 5)),
+            vnodes=int(os.getenv('PARTITION_VNODES', 64))
+        )
+        
+        # Concurrent scraping under per-source rate limits
+        self.scheduler = ScrapeScheduler(
+            {
+                'timeline': TokenBucket(
+                    float(os.getenv('SCRAPE_TIMELINE_RATE', 1.0)),
+                    int(os.getenv('SCRAPE_TIMELINE_BURST', 5))
+                ),
+                'search': TokenBucket(
+                    float(os.getenv('SCRAPE_SEARCH_RATE', 0.5)),
+                    int(os.getenv('SCRAPE_SEARCH_BURST', 2))
+                )
+            },
+            workers=int(os.getenv('SCRAPE_WORKERS', 8)),
+            max_retries=int(os.getenv('SCRAPE_RETRY_ATTEMPTS', 3)),
+            base_delay=int(os.getenv('SCRAPE_RETRY_DELAY', 5000)) / 1000
+        )
+        
+        # Bulk write metrics, updated from the scheduler's worker threads under stats_lock
+        self.stats_lock = threading.Lock()
+        self.write_stats = {'operations': 0, 'round_trips': 0, 'failed': 0}
+        
+        # Incremental scraping: per-target high-water marks and recently stored ids
+        self.watermarks = Watermarks(self.redis_client)
+        self.seen_tweets = SeenTweets(
+            self.redis_client,
+            days=int(os.getenv('SCRAPE_SEEN_DAYS', 7))
+        )
+        self.ingest_stats = {'fetched': 0, 'stale': 0, 'duplicates': 0, 'stored': 0}
+        
+        # Tags every ingested tweet with the active events it mentions, refreshed each event pass
+        self.event_matcher = EventMatcher(self.get_active_events())
         
         logger.info("Twitter Scraper initialized")
     
-    def scrape_user_timeline(self, username: str, limit: int = 20) -> List[Dict]:
+    def scrape_user_timeline(self, username: str, limit: int = 20) -> List[TweetRecord]:
         """Scrape user timeline tweets with fallback to mock data"""
         logger.info(f"Scraping timeline for @{username}")
         tweets = []
+        started = time.perf_counter()
         
         try:
             # Try using snscrape first
@@ -63,41 +135,161 @@ class TwitterScraper:
             logger.info(f"Using mock data for @{username} due to Twitter/X access restrictions")
             tweets = self.generate_mock_tweets(username, limit)
             
-            # Store tweets in MongoDB
-            for tweet_data in tweets:
-                try:
-                    self.tweets_collection.update_one(
-                        {'tweetId': tweet_data['tweetId']},
-                        {'$set': tweet_data},
-                        upsert=True
-                    )
-                except Exception as e:
-                    logger.error(f"Error storing tweet {tweet_data['tweetId']}: {e}")
-            
-            logger.info(f"Scraped {len(tweets)} tweets for @{username}")
+            # Only tweets newer than the watermark and not stored before reach MongoDB
+            tweets = self.ingest_tweets('kol', username, tweets)
             
-            # Publish to Redis for real-time processing
-            if tweets:
-                self.redis_client.publish(
-                    'new_tweets',
-                    json.dumps({
-                        'username': username,
-                        'count': len(tweets),
-                        'latest_tweet_id': tweets[0]['tweetId']
-                    })
-                )
+            logger.info(f"Scraped {len(tweets)} new tweets for @{username}")
             
+        except RETRYABLE:
+            # Rate limits and network errors, let the scheduler back off and retry
+            raise
         except Exception as e:
             logger.error(f"Error scraping @{username}: {e}")
+        finally:
+            SCRAPE_SECONDS.labels('timeline').observe(time.perf_counter() - started)
         
         return tweets
     
-    def scrape_event_tweets(self, keywords: List[str], since: Optional[datetime] = None) -> List[Dict]:
+    def store_tweets(self, tweets: List[TweetRecord]) -> set:
+        """Upsert tweets with one unordered bulk write, returning failed indexes"""
+        if not tweets:
+            return set()
+        
+        operations = [
+            UpdateOne(
+                {'tweetId': tweet.tweet_id},
+                {'$set': tweet.to_doc()},
+                upsert=True
+            )
+            for tweet in tweets
+        ]
+        
+        failed = set()
+        started = time.perf_counter()
+        try:
+            self.tweets_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Unordered writes keep going, only the reported documents failed
+            for error in e.details.get('writeErrors', []):
+                index = error['index']
+                failed.add(index)
+                logger.error(f"Error storing tweet {tweets[index].tweet_id}: {error.get('errmsg')}")
+        except Exception as e:
+            logger.error(f"Error storing batch of {len(tweets)} tweets: {e}")
+            failed = set(range(len(tweets)))
+        MONGO_BULK_UPSERT.observe(time.perf_counter() - started)
+        TWEETS_FAILED.inc(len(failed))
+        
+        with self.stats_lock:
+            self.write_stats['operations'] += len(operations)
+            self.write_stats['round_trips'] += 1
+            self.write_stats['failed'] += len(failed)
+        logger.debug(
+            f"Bulk upsert: {len(operations)} ops, {len(failed)} failed, "
+            f"{self.writes_per_round_trip():.1f} writes per round-trip"
+        )
+        
+        return failed
+    
+    def ingest_tweets(self, scope: str, target: str, tweets: List[TweetRecord]) -> List[TweetRecord]:
+        """Store and queue only unseen tweets newer than the target's watermark"""
+        mark = self.watermarks.get(scope, target)
+        fetched = len(tweets)
+        
+        tweets = self.watermarks.newer(mark, tweets)
+        stale = fetched - len(tweets)
+        candidates = len(tweets)
+        tweets = self.seen_tweets.unseen(tweets)
+        
+        with self.stats_lock:
+            self.ingest_stats['fetched'] += fetched
+            self.ingest_stats['stale'] += stale
+            self.ingest_stats['duplicates'] += candidates - len(tweets)
+        TWEETS_SCRAPED.labels(scope).inc(fetched)
+        TWEETS_SKIPPED.labels('stale').inc(stale)
+        TWEETS_SKIPPED.labels('duplicate').inc(candidates - len(tweets))
+        if not tweets:
+            logger.debug(f"No new tweets for {scope} {target}")
+            return []
+        
+        # eventIds feed the analyzer's per-event trends and anomaly baselines
+        self.event_matcher.tag(tweets, target if scope == 'event' else None)
+        
+        failed = self.store_tweets(tweets)
+        stored = [tweet for i, tweet in enumerate(tweets) if i not in failed]
+        with self.stats_lock:
+            self.ingest_stats['stored'] += len(stored)
+        TWEETS_STORED.labels(scope).inc(len(stored))
+        
+        # Seen ids, stream notifications and the watermark go out in one round-trip
+        pipe = self.redis_client.pipeline(transaction=False)
+        self.seen_tweets.add(stored, pipe)
+        self.notify_new_tweets(stored, pipe)
+        
+        # Never move past a failed tweet, the next scrape has to pick it up again
+        if failed:
+            oldest_failed = min(tweets[i].created_at for i in failed)
+            self.watermarks.advance(
+                scope, target, mark,
+                [tweet for tweet in stored if tweet.created_at < oldest_failed],
+                pipe
+            )
+        else:
+            self.watermarks.advance(scope, target, mark, stored, pipe)
+        
+        with REDIS_INGEST_WRITES.time():
+            pipe.execute()
+        
+        return stored
+    
+    def notify_new_tweets(self, tweets: List[TweetRecord], pipe=None):
+        """Queue one analysis entry per author on the durable Redis Stream"""
+        by_author = {}
+        for tweet in tweets:
+            by_author.setdefault(tweet.author, []).append(tweet)
+        if not by_author:
+            return
+        
+        own = pipe is None
+        if own:
+            pipe = self.redis_client.pipeline(transaction=False)
+        for username, authored in by_author.items():
+            latest = max(authored, key=lambda tweet: tweet.created_at)
+            pipe.xadd(
+                shard_stream(self.new_tweets_stream, username, self.new_tweets_shards),
+                {
+                    'username': username,
+                    'count': len(authored),
+                    'latest_tweet_id': latest.tweet_id
+                },
+                maxlen=self.new_tweets_stream_maxlen,
+                approximate=True
+            )
+        if own:
+            pipe.execute()
+    
+    def writes_per_round_trip(self) -> float:
+        """Average number of write operations sent per MongoDB round-trip"""
+        return self.write_stats['operations'] / max(self.write_stats['round_trips'], 1)
+    
+    def scrape_event_tweets(
+        self,
+        keywords: List[str],
+        since: Optional[datetime] = None,
+        event_id: Optional[str] = None
+    ) -> List[TweetRecord]:
         """Scrape tweets related to specific keywords/events"""
         logger.info(f"Scraping tweets for keywords: {keywords}")
         tweets = []
+        started = time.perf_counter()
         
         try:
+            # Resume from the event's watermark instead of a fixed window
+            if event_id is not None:
+                mark = self.watermarks.get('event', event_id)
+                if mark is not None:
+                    since = mark['createdAt']
+            
             # Build search query
             query = ' OR '.join(f'"{k}"' if ' ' in k else k for k in keywords)
             
@@ -111,47 +303,48 @@ class TwitterScraper:
             logger.info(f"Using mock data for event keywords: {keywords}")
             tweets = self.generate_event_tweets_with_keywords(keywords, 50)
             
+            if event_id is not None:
+                tweets = self.ingest_tweets('event', event_id, tweets)
+                logger.info(f"Scraped {len(tweets)} new tweets for event {event_id}")
+            
             return tweets
             
             # 原始代码保留以供将来使用
             # for i, tweet in enumerate(sntwitter.TwitterSearchScraper(query).get_items()):
-                if i >= 100:  # Limit per search
-                    break
-                
-                tweet_data = {
-                    'tweetId': str(tweet.id),
-                    'content': tweet.rawContent,
-                    'createdAt': tweet.date,
-                    'authorUsername': tweet.user.username,
-                    'authorFollowers': tweet.user.followersCount or 0,
-                    'metrics': {
-                        'likes': tweet.likeCount or 0,
-                        'retweets': tweet.retweetCount or 0,
-                        'replies': tweet.replyCount or 0,
-                        'views': tweet.viewCount or 0
-                    },
-                    'keywords': keywords,
-                    'hashtags': tweet.hashtags or [],
-                    'mentions': [user.username for user in (tweet.mentionedUsers or [])],
-                    'scrapedAt': datetime.utcnow()
-                }
-                
-                tweets.append(tweet_data)
-                
-                # Store in MongoDB
-                try:
-                    self.tweets_collection.update_one(
-                        {'tweetId': tweet_data['tweetId']},
-                        {'$set': tweet_data},
-                        upsert=True
-                    )
-                except Exception as e:
-                    logger.error(f"Error storing tweet {tweet_data['tweetId']}: {e}")
-            
+            #     if i >= 100:  # Limit per search
+            #         break
+
+            #     tweet_data = {
+            #         'tweetId': str(tweet.id),
+            #         'content': tweet.rawContent,
+            #         'createdAt': tweet.date,
+            #         'authorUsername': tweet.user.username,
+            #         'authorFollowers': tweet.user.followersCount or 0,
+            #         'metrics': {
+            #             'likes': tweet.likeCount or 0,
+            #             'retweets': tweet.retweetCount or 0,
+            #             'replies': tweet.replyCount or 0,
+            #             'views': tweet.viewCount or 0
+            #         },
+            #         'keywords': keywords,
+            #         'hashtags': tweet.hashtags or [],
+            #         'mentions': [user.username for user in (tweet.mentionedUsers or [])],
+            #         'scrapedAt': datetime.utcnow()
+            #     }
+
+            #     tweets.append(tweet_data)
+            #
+            # # Store in MongoDB
+            # self.store_tweets(tweets)
+
             logger.info(f"Scraped {len(tweets)} tweets for keywords: {keywords}")
             
+        except RETRYABLE:
+            raise
         except Exception as e:
             logger.error(f"Error scraping keywords {keywords}: {e}")
+        finally:
+            SCRAPE_SECONDS.labels('search').observe(time.perf_counter() - started)
         
         return tweets
     
@@ -185,23 +378,39 @@ class TwitterScraper:
     def scrape_kols(self):
         """Scheduled task to scrape KOL timelines"""
         logger.info("Starting KOL scraping task")
-        kols = self.get_active_kols()
+        # Other replicas scrape the KOLs they own
+        kols = self.membership.owned(self.get_active_kols(), key=lambda kol: f'kol:{kol}')
         
-        for kol in kols:
-            self.scrape_user_timeline(kol, limit=20)
-            time.sleep(2)  # Rate limiting
+        # Runs in the background, KOLs still running from the last pass are skipped
+        return self.scheduler.run_pass(
+            'timeline',
+            kols,
+            lambda kol: self.scrape_user_timeline(kol, limit=20)
+        )
+    
+    def rebalance(self, membership: Membership):
+        """Start on KOLs and events that just moved here instead of waiting for the next pass"""
+        self.scrape_kols()
+        self.scrape_events()
     
     def scrape_events(self):
         """Scheduled task to scrape event-related tweets"""
         logger.info("Starting event scraping task")
         events = self.get_active_events()
+        # Only keyword changes touch the automaton, an unchanged list is a no-op
+        self.event_matcher.update(events)
+        events = self.membership.owned(events, key=lambda event: f"event:{event['id']}")
+        # Fallback window for events that have no watermark yet
+        since = datetime.utcnow() - timedelta(hours=1)
         
-        for event in events:
-            since = datetime.now() - timedelta(hours=1)
-            self.scrape_event_tweets(event['keywords'], since)
-            time.sleep(2)  # Rate limiting
+        return self.scheduler.run_pass(
+            'search',
+            events,
+            lambda event: self.scrape_event_tweets(event['keywords'], since, str(event['id'])),
+            key=lambda event: event['id']
+        )
     
-    def generate_event_tweets_with_keywords(self, keywords: List[str], count: int) -> List[Dict]:
+    def generate_event_tweets_with_keywords(self, keywords: List[str], count: int) -> List[TweetRecord]:
         """Generate mock tweets for events with specific keywords"""
         templates = [
             'Really excited about {term}! This is going to be huge.',
@@ -218,34 +427,33 @@ class TwitterScraper:
         
         tweets = []
         base_time = datetime.utcnow()
+        # Events are scraped concurrently, ids must not repeat across events or calls
+        batch = uuid4().hex
         
         for i in range(count):
             keyword = keywords[i % len(keywords)]
             template = templates[i % len(templates)]
             content = template.replace('{term}', keyword)
             
-            tweet_data = {
-                'tweetId': f'event_{int(time.time())}_{i}',
-                'content': content,
-                'createdAt': base_time - timedelta(minutes=i*10),
-                'authorUsername': f'user_{random.randint(1, 1000)}',
-                'authorFollowers': random.randint(100, 100000),
-                'metrics': {
-                    'likes': random.randint(10, 5000),
-                    'retweets': random.randint(5, 2000),
-                    'replies': random.randint(1, 500),
-                    'views': random.randint(100, 50000)
-                },
-                'keywords': keywords,
-                'hashtags': [k.replace(' ', '') for k in keywords[:2]],
-                'mentions': [],
-                'scrapedAt': datetime.utcnow()
-            }
-            tweets.append(tweet_data)
+            tweet = TweetRecord(
+                f'event_{batch}_{i}',
+                content=content,
+                created_at=base_time - timedelta(minutes=i*10),
+                author=f'user_{random.randint(1, 1000)}',
+                followers=random.randint(100, 100000),
+                likes=random.randint(10, 5000),
+                retweets=random.randint(5, 2000),
+                replies=random.randint(1, 500),
+                views=random.randint(100, 50000),
+                keywords=keywords,
+                hashtags=[k.replace(' ', '') for k in keywords[:2]],
+                scraped_at=datetime.utcnow()
+            )
+            tweets.append(tweet)
         
         return tweets
     
-    def generate_mock_tweets(self, username: str, count: int) -> List[Dict]:
+    def generate_mock_tweets(self, username: str, count: int) -> List[TweetRecord]:
         """Generate mock tweets for testing when API is unavailable"""
         mock_contents = [
             "Just launched an exciting new feature! The future of AI is here 🚀",
@@ -262,26 +470,24 @@ class TwitterScraper:
         
         tweets = []
         base_time = datetime.utcnow()
+        batch = uuid4().hex
         
         for i in range(count):
-            tweet_data = {
-                'tweetId': f'mock_{username}_{int(time.time())}_{i}',
-                'content': random.choice(mock_contents),
-                'createdAt': base_time - timedelta(hours=i*2),
-                'authorUsername': username,
-                'metrics': {
-                    'likes': random.randint(100, 10000),
-                    'retweets': random.randint(50, 5000),
-                    'replies': random.randint(10, 1000),
-                    'views': random.randint(1000, 100000)
-                },
-                'isReply': False,
-                'isRetweet': False,
-                'hashtags': random.sample(['AI', 'Innovation', 'Tech', 'Future', 'Success'], k=2),
-                'mentions': [],
-                'scrapedAt': datetime.utcnow()
-            }
-            tweets.append(tweet_data)
+            tweet = TweetRecord(
+                f'mock_{username}_{batch}_{i}',
+                content=random.choice(mock_contents),
+                created_at=base_time - timedelta(hours=i*2),
+                author=username,
+                likes=random.randint(100, 10000),
+                retweets=random.randint(50, 5000),
+                replies=random.randint(10, 1000),
+                views=random.randint(1000, 100000),
+                is_reply=False,
+                is_retweet=False,
+                hashtags=random.sample(['AI', 'Innovation', 'Tech', 'Future', 'Success'], k=2),
+                scraped_at=datetime.utcnow()
+            )
+            tweets.append(tweet)
         
         return tweets
     
@@ -295,11 +501,13 @@ class TwitterScraper:
         for message in pubsub.listen():
             if message['type'] == 'message':
                 try:
-                    data = json.loads(message['data'])
+                    data = decode(message['data'])
                     username = data.get('username')
-                    if username:
+                    if username and not self.membership.owns(f'kol:{username}'):
+                        logger.debug(f"Skipping @{username}, owned by another replica")
+                    elif username:
                         logger.info(f"Received command to scrape @{username}")
-                        self.scrape_user_timeline(username, limit=20)
+                        self.scheduler.submit('timeline', username, self.scrape_user_timeline, username, 20)
                 except Exception as e:
                     logger.error(f"Error processing command: {e}")
     
@@ -311,16 +519,17 @@ class TwitterScraper:
         listener_thread.daemon = True
         listener_thread.start()
         
+        # Join the replica ring. The first ring runs the initial scrape and
+        # every later rebalance scrapes newly owned KOLs and events right away
+        self.membership.on_change(self.rebalance)
+        self.membership.start()
+        
         # Schedule KOL scraping every 10 minutes
         schedule.every(10).minutes.do(self.scrape_kols)
         
         # Schedule event scraping every minute
         schedule.every(1).minutes.do(self.scrape_events)
         
-        # Run initial scrape
-        self.scrape_kols()
-        self.scrape_events()
-        
         logger.info("Scheduler started")
         
         while True:
@@ -330,12 +539,18 @@ class TwitterScraper:
 def main():
     scraper = TwitterScraper()
     
+    # /metrics and on-demand profiling, SIGUSR2 toggles a profile written to PROFILE_DIR
+    start_metrics_server(int(os.getenv('METRICS_PORT', 9102)), os.getenv('METRICS_HOST', '0.0.0.0'))
+    install_signal_toggle('scraper')
+    
     try:
         scraper.run_scheduler()
     except KeyboardInterrupt:
         logger.info("Scraper stopped by user")
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
+    finally:
+        scraper.membership.leave()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+from loguru import logger
+import requests
+
+from rate_limit import RateLimited, TokenBucket
+
+# Errors worth retrying, anything else is a bug in the scrape itself
+RETRYABLE = (RateLimited, ConnectionError, TimeoutError, requests.RequestException)
+
+
+class ScrapeScheduler:
+    """Bounded worker pool running scrapes under per-source token buckets
+
+    Each target (a KOL or an event) runs at most once at a time: a pass that
+    reaches a target still running from the previous pass skips it. Failed
+    requests are retried with full-jitter exponential backoff, and a 429
+    drains the source's bucket so every worker slows down together.
+    """
+
+    def __init__(
+        self,
+        limiters: Dict[str, TokenBucket],
+        workers: int = 8,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0
+    ):
+        self.limiters = limiters
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scrape')
+        self.in_flight = set()
+        self.lock = threading.Lock()
+        self.stats = {'submitted': 0, 'skipped': 0, 'retries': 0, 'rate_limited': 0, 'failed': 0}
+
+    def submit(self, source: str, key: Hashable, fn: Callable, *args) -> Optional[Future]:
+        """Schedule one scrape unless the same target is still running"""
+        with self.lock:
+            if (source, key) in self.in_flight:
+                self.stats['skipped'] += 1
+                logger.debug(f"Skipping {source} {key}: previous scrape still running")
+                return None
+            self.in_flight.add((source, key))
+            self.stats['submitted'] += 1
+
+        return self.executor.submit(self.run, source, key, fn, *args)
+
+    def run_pass(self, source: str, items: Iterable, fn: Callable, key: Callable = lambda item: item) -> List[Future]:
+        """Schedule fn(item) for every item, returning without waiting"""
+        futures = []
+        for item in items:
+            future = self.submit(source, key(item), fn, item)
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    def run(self, source: str, key: Hashable, fn: Callable, *args):
+        """Execute a scrape with rate limiting and retries"""
+        limiter = self.limiters.get(source)
+        try:
+            for attempt in range(self.max_retries + 1):
+                if limiter is not None:
+                    limiter.acquire()
+                try:
+                    return fn(*args)
+                except RETRYABLE as e:
+                    if attempt == self.max_retries:
+                        with self.lock:
+                            self.stats['failed'] += 1
+                        logger.error(f"Giving up on {source} {key} after {attempt + 1} attempts: {e}")
+                        return None
+
+                    delay = self.backoff(attempt)
+                    rate_limited = isinstance(e, RateLimited)
+                    if rate_limited and e.retry_after is not None:
+                        delay = max(delay, e.retry_after)
+
+                    # Pool threads share the counters with submit()
+                    with self.lock:
+                        self.stats['retries'] += 1
+                        if rate_limited:
+                            self.stats['rate_limited'] += 1
+                    logger.warning(f"Retrying {source} {key} in {delay:.1f}s: {e}")
+
+                    if rate_limited:
+                        if limiter is not None:
+                            # The drained bucket makes the next acquire wait
+                            limiter.penalize(delay)
+                            continue
+
+                    time.sleep(delay)
+                except Exception as e:
+                    with self.lock:
+                        self.stats['failed'] += 1
+                    logger.error(f"Error scraping {source} {key}: {e}")
+                    return None
+        finally:
+            with self.lock:
+                self.in_flight.discard((source, key))
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting work and optionally wait for running scrapes"""
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,87 @@
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from common.records import TweetRecord
+
+
+class Watermarks:
+    """Per-KOL and per-event high-water marks (newest tweet seen) in a Redis hash"""
+
+    def __init__(self, redis_client, key: str = 'scrape:watermarks'):
+        self.redis_client = redis_client
+        self.key = key
+
+    def get(self, scope: str, target: str) -> Optional[Dict]:
+        """Newest tweet id and timestamp stored for a target, if any"""
+        value = self.redis_client.hget(self.key, f'{scope}:{target}')
+        if not value:
+            return None
+        mark = json.loads(value)
+        mark['createdAt'] = datetime.fromisoformat(mark['createdAt'])
+        return mark
+
+    def newer(self, mark: Optional[Dict], tweets: List[TweetRecord]) -> List[TweetRecord]:
+        """Drop tweets at or below the watermark, for sources that ignore since filters"""
+        if mark is None:
+            return tweets
+        return [tweet for tweet in tweets if tweet.created_at > mark['createdAt']]
+
+    def advance(self, scope: str, target: str, mark: Optional[Dict], tweets: List[TweetRecord], pipe=None):
+        """Move the watermark to the newest of the given tweets, on `pipe` when given"""
+        if not tweets:
+            return
+        newest = max(tweets, key=lambda tweet: tweet.created_at)
+        if mark is not None and newest.created_at <= mark['createdAt']:
+            return
+        (pipe or self.redis_client).hset(self.key, f'{scope}:{target}', json.dumps({
+            'tweetId': newest.tweet_id,
+            'createdAt': newest.created_at.isoformat()
+        }))
+
+
+class SeenTweets:
+    """Ids of recently stored tweets in day-sharded Redis sets
+
+    Lookups check every shard still inside the retention window with
+    SMISMEMBER in one pipelined round-trip. Shards expire on their own, so
+    memory stays bounded by the tweets stored over `days` days.
+    """
+
+    def __init__(self, redis_client, prefix: str = 'scrape:seen', days: int = 7):
+        self.redis_client = redis_client
+        self.prefix = prefix
+        self.days = max(days, 1)
+
+    def shard(self, day: datetime) -> str:
+        return f"{self.prefix}:{day.strftime('%Y%m%d')}"
+
+    def unseen(self, tweets: List[TweetRecord]) -> List[TweetRecord]:
+        """Tweets whose ids are not in any live shard"""
+        if not tweets:
+            return []
+        ids = [tweet.tweet_id for tweet in tweets]
+        today = datetime.utcnow()
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for offset in range(self.days):
+            pipe.smismember(self.shard(today - timedelta(days=offset)), ids)
+        shards = pipe.execute()
+
+        return [
+            tweet for i, tweet in enumerate(tweets)
+            if not any(members[i] for members in shards)
+        ]
+
+    def add(self, tweets: List[TweetRecord], pipe=None):
+        """Record stored tweets in today's shard, queued on `pipe` when given"""
+        if not tweets:
+            return
+        key = self.shard(datetime.utcnow())
+        own = pipe is None
+        if own:
+            pipe = self.redis_client.pipeline(transaction=False)
+        pipe.sadd(key, *[tweet.tweet_id for tweet in tweets])
+        pipe.expire(key, (self.days + 1) * 86400)
+        if own:
+            pipe.execute()
@@ -0,0 +1,151 @@
+"""Parquet archive export and historical trend reads
+
+Fills a tweets collection (mongomock, or a real server with --mongo-uri)
+with analyzed tweets spread over --days days, then archives everything
+older than --retention-days. Reports:
+
+- export throughput, and archive size against the BSON size of the same documents
+- what is left in the hot collection
+- an idempotent rerun after archived tweets are restored, as if the delete had failed
+- trend reads for one author over a week with pushdown, against reading
+  the whole archive and filtering in Python
+
+Archived counts are checked against the generated tweets.
+
+    python test/benchmarks/bench_archive.py --tweets 200000 --days 90
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'emotion-analyzer'))
+
+import bson
+from archive import TweetArchiver, TweetArchive, PROJECTION
+
+EMOTIONS = ['joy', 'sadness', 'anger', 'fear', 'surprise', 'disgust', 'neutral']
+WORDS = 'market launch crypto ai model policy rally crash vote update release growth risk data'.split()
+
+
+def make_tweets(count: int, days: int, authors: int, rng) -> list:
+    now = datetime.utcnow().replace(microsecond=0)
+    tweets = []
+    for i in range(count):
+        emotion = rng.choice(EMOTIONS)
+        tweets.append({
+            'tweetId': f'tweet_{i}',
+            'content': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))),
+            'createdAt': now - timedelta(seconds=rng.randrange(days * 86400)),
+            'analyzedAt': now,
+            'authorUsername': f'kol_{rng.randrange(authors)}',
+            'authorFollowers': rng.randint(100, 10000000),
+            'metrics': {
+                'likes': rng.randint(0, 5000),
+                'retweets': rng.randint(0, 2000),
+                'replies': rng.randint(0, 500),
+                'views': rng.randint(0, 100000)
+            },
+            'hashtags': [rng.choice(WORDS)] if rng.random() < 0.3 else [],
+            'eventIds': [str(rng.randrange(20))] if rng.random() < 0.2 else [],
+            'emotion': {'emotion': emotion, 'score': rng.random(), 'propagation_score': rng.random() * 100},
+            'engagementRate': rng.random() / 10
+        })
+    return tweets
+
+
+def connect(args):
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        collection = MongoClient(args.mongo_uri).bench_archive.tweets
+        collection.drop()
+        return collection
+    import mongomock
+    return mongomock.MongoClient().bench_archive.tweets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--retention-days', type=float, default=30)
+    parser.add_argument('--authors', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--mongo-uri')
+    parser.add_argument('--root', help='archive directory, a temporary one by default')
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    tweets = make_tweets(args.tweets, args.days, args.authors, rng)
+    collection = connect(args)
+    collection.insert_many([dict(tweet) for tweet in tweets])
+    collection.create_index('createdAt')
+
+    cutoff = datetime.utcnow() - timedelta(days=args.retention_days)
+    old = [tweet for tweet in tweets if tweet['createdAt'] < cutoff]
+    bson_bytes = sum(len(bson.encode({key: tweet[key] for key in PROJECTION})) for tweet in old)
+
+    root = args.root or tempfile.mkdtemp(prefix='tweet-archive-')
+    try:
+        archiver = TweetArchiver(collection, root, batch_size=args.batch_size)
+        started = time.perf_counter()
+        stats = archiver.export(cutoff)
+        elapsed = time.perf_counter() - started
+
+        assert stats['archived'] == len(old), f"archived {stats['archived']} of {len(old)}"
+        remaining = collection.count_documents({})
+        assert remaining == len(tweets) - len(old)
+        print(f"export: {stats['archived']} tweets in {stats['files']} files, {elapsed:.2f}s, "
+              f"{stats['archived'] / elapsed:,.0f} tweets/s")
+        print(f"size: {stats['bytes'] / 1e6:.1f} MB parquet vs {bson_bytes / 1e6:.1f} MB bson "
+              f"({bson_bytes / max(stats['bytes'], 1):.1f}x smaller, {stats['bytes'] / len(old):.0f} B/tweet)")
+        print(f"hot collection: {len(tweets)} -> {remaining} tweets")
+
+        # A run that died before its delete leaves archived tweets behind
+        restored = old[:1000]
+        collection.insert_many([dict(tweet) for tweet in restored])
+        rerun = TweetArchiver(collection, root, batch_size=args.batch_size).export(cutoff)
+        assert rerun['archived'] == 0 and rerun['skipped'] == len(restored), rerun
+        print(f"rerun: {rerun['skipped']} already archived tweets deleted without rewriting")
+
+        archive = TweetArchive(root)
+        author = old[0]['authorUsername']
+        end = cutoff - timedelta(days=1)
+        start = end - timedelta(days=7)
+        expected = Counter(
+            tweet['emotion']['emotion'] for tweet in old
+            if tweet['authorUsername'] == author and start <= tweet['createdAt'] < end
+        )
+
+        started = time.perf_counter()
+        buckets = archive.trend(start, end, resolution='day', author=author)
+        pushdown = time.perf_counter() - started
+        found = Counter()
+        for bucket in buckets:
+            found.update(bucket['emotionCounts'])
+        assert found == expected, (found, expected)
+
+        started = time.perf_counter()
+        table = archive.dataset().to_table(columns=['authorUsername', 'createdAt', 'emotion'])
+        full = Counter(
+            row['emotion'] for row in table.to_pylist()
+            if row['authorUsername'] == author and start <= row['createdAt'] < end
+        )
+        full_scan = time.perf_counter() - started
+        assert full == expected
+
+        print(f"trend for {author} over 7 days: {sum(expected.values())} tweets in {len(buckets)} buckets, "
+              f"pushdown {pushdown * 1000:.1f}ms vs full scan {full_scan * 1000:.1f}ms "
+              f"({full_scan / pushdown:.1f}x)")
+    finally:
+        if not args.root:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
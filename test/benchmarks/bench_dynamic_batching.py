@@ -0,0 +1,132 @@
+"""Padding efficiency and throughput of length-bucketed dynamic batching
+
+Callers submit pages of texts with a long-tailed token-length distribution,
+like tweets mixed with threads. A stand-in model sleeps in proportion to the
+padded tokens of each batch, which is how a CPU forward pass scales. Fixed
+batches in arrival order are compared with DynamicBatcher at several token
+budgets.
+
+    python test/benchmarks/bench_dynamic_batching.py --texts 20000 --callers 4
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'emotion-analyzer'))
+
+from batching import DynamicBatcher
+
+
+class PaddedModel:
+    """Costs a fixed overhead per batch plus a constant per padded token
+
+    Batches run one at a time, like a single model saturating the CPU.
+    """
+
+    def __init__(self, lengths, per_batch: float, per_token: float):
+        self.lengths = lengths
+        self.per_batch = per_batch
+        self.per_token = per_token
+        self.real = 0
+        self.padded = 0
+        self.lock = threading.Lock()
+
+    def run_batches(self, batches):
+        outputs = []
+        for batch in batches:
+            sizes = [self.lengths[text] for text in batch]
+            with self.lock:
+                self.real += sum(sizes)
+                self.padded += len(batch) * max(sizes)
+                time.sleep(self.per_batch + len(batch) * max(sizes) * self.per_token)
+            outputs.append([[{'label': 'neutral', 'score': 1.0}] for _ in batch])
+        return outputs
+
+
+def make_lengths(count: int, rng) -> dict:
+    """Mostly short tweets, a tail of long threads capped at 512 tokens"""
+    short = rng.integers(8, 64, size=count)
+    long = rng.integers(128, 513, size=count)
+    sizes = np.where(rng.random(count) < 0.1, long, short)
+    return {f'text-{i}': int(size) for i, size in enumerate(sizes)}
+
+
+def run_fixed(lengths, pages, batch_size, args):
+    model = PaddedModel(lengths, args.per_batch, args.per_token)
+
+    def caller(caller_pages):
+        for page in caller_pages:
+            batches = [page[i:i + batch_size] for i in range(0, len(page), batch_size)]
+            model.run_batches(batches)
+
+    elapsed = run_callers(caller, pages, args.callers)
+    return model, elapsed, None
+
+
+def run_dynamic(lengths, pages, batch_size, max_tokens, args):
+    model = PaddedModel(lengths, args.per_batch, args.per_token)
+    batcher = DynamicBatcher(
+        model.run_batches,
+        max_tokens=max_tokens,
+        max_batch_size=batch_size,
+        max_wait=args.max_wait_ms / 1000,
+        bounds=[16, 32, 64, 128, 256, 512],
+        callers=args.callers,
+        log_every=0
+    )
+
+    def caller(caller_pages):
+        for page in caller_pages:
+            batcher.infer(page, [lengths[text] for text in page])
+
+    elapsed = run_callers(caller, pages, args.callers)
+    metrics = batcher.metrics()
+    batcher.close()
+    return model, elapsed, metrics
+
+
+def run_callers(caller, pages, callers):
+    threads = [threading.Thread(target=caller, args=(pages[i::callers],)) for i in range(callers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--texts', type=int, default=20000)
+    parser.add_argument('--page', type=int, default=50)
+    parser.add_argument('--callers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--budgets', type=int, nargs='+', default=[2048, 4096, 8192])
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--per-batch', type=float, default=0.002)
+    parser.add_argument('--per-token', type=float, default=2e-6)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    lengths = make_lengths(args.texts, rng)
+    texts = list(lengths)
+    pages = [texts[i:i + args.page] for i in range(0, len(texts), args.page)]
+
+    print(f"{'mode':18} {'texts/s':>9} {'padding eff':>12} {'wait p50':>9} {'wait p95':>9}")
+
+    model, elapsed, _ = run_fixed(lengths, pages, args.batch_size, args)
+    print(f"{'fixed':18} {args.texts / elapsed:9.0f} {model.real / model.padded:12.1%} {'-':>9} {'-':>9}")
+
+    for budget in args.budgets:
+        model, elapsed, metrics = run_dynamic(lengths, pages, args.batch_size, budget, args)
+        print(
+            f"{f'dynamic {budget}':18} {args.texts / elapsed:9.0f} {model.real / model.padded:12.1%} "
+            f"{metrics['queue_wait_p50'] * 1000:8.1f}ms {metrics['queue_wait_p95'] * 1000:8.1f}ms"
+        )
+
+
+if __name__ == '__main__':
+    main()
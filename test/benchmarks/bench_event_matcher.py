@@ -0,0 +1,129 @@
+"""Event tagging with the Aho-Corasick matcher versus per-keyword scanning
+
+Generates active events with English, multi-word and CJK keywords, and
+tweets mixing random words, keyword mentions, hashtags and Chinese text.
+Reports automaton build and incremental update times, tagging throughput
+over every tweet, and the per-keyword baseline (every event keyword
+searched in every tweet) on a sample, extrapolated to the full set. The
+two are checked for identical tags on the sample.
+
+    python test/benchmarks/bench_event_matcher.py --events 1000 --tweets 100000
+"""
+import os
+import sys
+import time
+import random
+import string
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'scraper'))
+
+from event_matcher import EventMatcher, normalize, is_word
+
+CJK = '人工智能比特币以太坊市场经济科技新闻政策金融数据安全网络区块链加密货币监管创新发展'
+
+
+def make_word(rng) -> str:
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+
+
+def make_events(count: int, rng, vocabulary) -> list:
+    events = []
+    for event_id in range(count):
+        keywords = []
+        for _ in range(3):
+            kind = rng.random()
+            if kind < 0.6:
+                keywords.append(rng.choice(vocabulary).capitalize())
+            elif kind < 0.8:
+                keywords.append(f'{rng.choice(vocabulary)} {rng.choice(vocabulary)}')
+            else:
+                keywords.append(''.join(rng.choice(CJK) for _ in range(rng.randint(2, 4))))
+        events.append({'id': str(event_id), 'keywords': keywords})
+    return events
+
+
+def make_tweets(count: int, rng, filler, events) -> list:
+    keywords = [keyword for event in events for keyword in event['keywords']]
+    tweets = []
+    for _ in range(count):
+        words = [rng.choice(filler) for _ in range(rng.randint(8, 24))]
+        if rng.random() < 0.3:
+            words.insert(rng.randrange(len(words)), rng.choice(keywords))
+        if rng.random() < 0.2:
+            words.append(''.join(rng.choice(CJK) for _ in range(rng.randint(4, 12))))
+        hashtags = [rng.choice(keywords).replace(' ', '')] if rng.random() < 0.1 else []
+        tweets.append({'content': ' '.join(words), 'hashtags': hashtags})
+    return tweets
+
+
+def naive_match(matcher: EventMatcher, text: str, hashtags) -> set:
+    """Search every keyword separately, with the same normalization and boundaries"""
+    if hashtags:
+        text = f"{text} {' '.join('#' + tag for tag in hashtags)}"
+    text = normalize(text)
+    matched = set()
+    for keyword, event_ids in matcher.keyword_events.items():
+        left, right = is_word(keyword[0]), is_word(keyword[-1])
+        start = text.find(keyword)
+        while start != -1:
+            end = start + len(keyword)
+            if not (left and start > 0 and is_word(text[start - 1])) and \
+                    not (right and end < len(text) and is_word(text[end])):
+                matched.update(event_ids)
+                break
+            start = text.find(keyword, start + 1)
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--tweets', type=int, default=100000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--naive-sample', type=int, default=2000,
+                        help='tweets scanned per keyword, extrapolated to --tweets')
+    parser.add_argument('--changed', type=float, default=0.01, help='share of events replaced in the update test')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    words = [make_word(rng) for _ in range(args.vocabulary)]
+    # Keywords and filler words never overlap, only real mentions tag a tweet
+    vocabulary, filler = words[:len(words) // 2], words[len(words) // 2:]
+    events = make_events(args.events, rng, vocabulary)
+    tweets = make_tweets(args.tweets, rng, filler, events)
+
+    started = time.perf_counter()
+    matcher = EventMatcher(events)
+    build = time.perf_counter() - started
+
+    changed = list(events)
+    for i in rng.sample(range(len(changed)), max(int(len(changed) * args.changed), 1)):
+        changed[i] = {'id': f'new-{i}', 'keywords': make_events(1, rng, vocabulary)[0]['keywords']}
+    started = time.perf_counter()
+    matcher.update(changed)
+    update = time.perf_counter() - started
+    matcher.update(events)
+
+    started = time.perf_counter()
+    tags = [matcher.match(tweet['content'], tweet['hashtags']) for tweet in tweets]
+    elapsed = time.perf_counter() - started
+
+    sample = tweets[:args.naive_sample]
+    started = time.perf_counter()
+    naive = [naive_match(matcher, tweet['content'], tweet['hashtags']) for tweet in sample]
+    naive_elapsed = (time.perf_counter() - started) * len(tweets) / max(len(sample), 1)
+
+    mismatches = sum(1 for a, b in zip(tags, naive) if a != b)
+    tagged = sum(1 for tag in tags if tag)
+    states = len(matcher.goto)
+
+    print(f"{args.events} events, {len(matcher.keyword_events)} patterns, {states} states")
+    print(f"build {build * 1000:.1f}ms, update of {args.changed:.0%} events {update * 1000:.1f}ms")
+    print(f"automaton: {len(tweets)} tweets in {elapsed:.2f}s, {len(tweets) / elapsed:,.0f} tweets/s, {tagged} tagged")
+    print(f"per-keyword (extrapolated from {len(sample)}): {naive_elapsed:.2f}s, {len(tweets) / naive_elapsed:,.0f} tweets/s")
+    print(f"speedup {naive_elapsed / elapsed:.1f}x, {mismatches} mismatched tags in the sample")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Consistent-hash partitioning with several in-process replicas
+
+Runs replicas of the membership layer against fakeredis (or a real Redis
+with --redis-host) and checks that:
+
+- every KOL has exactly one owner and all replicas agree on it
+- a joining or leaving replica moves close to the ideal 1/N of the keys
+- a replica that stops heartbeating is dropped after the ttl
+- sharded analyzer work queues deliver each KOL's notifications to one replica
+
+It also prints load balance and key movement for several vnode counts and
+the owner lookup rate.
+
+    python test/benchmarks/bench_partitioning.py --replicas 4 --keys 100000
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from collections import Counter
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'emotion-analyzer'))
+
+from common.partitioning import HashRing, Membership, shard_stream
+from work_queue import TweetWorkQueue
+
+
+def connect(args):
+    if args.redis_host:
+        import redis
+        client = redis.Redis(host=args.redis_host, port=args.redis_port, decode_responses=True)
+        client.flushdb()
+        return client
+    import fakeredis
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def owners(ring: HashRing, keys) -> dict:
+    return {key: ring.owner(key) for key in keys}
+
+
+def moved(before: dict, after: dict) -> float:
+    return sum(1 for key in before if before[key] != after[key]) / len(before)
+
+
+def ring_table(args, keys):
+    """Load balance and movement of the bare ring per vnode count"""
+    members = [f'replica-{i}' for i in range(args.replicas)]
+    print(f"{'vnodes':>7} {'max/mean load':>14} {'stdev %':>8} {'join moved':>11} {'leave moved':>12}")
+    for vnodes in args.vnodes:
+        ring = HashRing(members, vnodes)
+        before = owners(ring, keys)
+        load = Counter(before.values())
+        mean = len(keys) / len(members)
+
+        joined = owners(HashRing(members + ['replica-new'], vnodes), keys)
+        left = owners(HashRing(members[1:], vnodes), keys)
+        print(
+            f"{vnodes:>7} {max(load.values()) / mean:>14.2f} "
+            f"{statistics.pstdev(load.values()) / mean:>8.1%} "
+            f"{moved(before, joined):>11.1%} {moved(before, left):>12.1%}"
+        )
+    print(f"ideal: join moves {1 / (args.replicas + 1):.1%}, leave moves {1 / args.replicas:.1%}")
+
+
+def check_agreement(replicas, keys) -> dict:
+    views = [owners(replica.ring, keys) for replica in replicas]
+    assert all(view == views[0] for view in views), "replicas disagree on ownership"
+    live = {replica.member_id for replica in replicas}
+    assert set(views[0].values()) <= live, "a key is owned by a replica that is gone"
+    for key in keys:
+        assert sum(replica.owns(key) for replica in replicas) == 1, f"{key} has no single owner"
+    return views[0]
+
+
+def settle(replicas):
+    """Two heartbeat rounds, so members that beat before a change also see it"""
+    for _ in range(2):
+        for member in replicas:
+            member.heartbeat()
+
+
+def membership_run(args, client, keys):
+    """Join, leave and expiry with heartbeating Membership instances"""
+    def replica(name):
+        return Membership(client, 'bench', member_id=name, ttl=args.ttl, interval=args.ttl / 3, vnodes=args.vnode_default)
+
+    replicas = [replica(f'replica-{i}') for i in range(args.replicas)]
+    settle(replicas)
+    before = check_agreement(replicas, keys)
+    print(f"{len(replicas)} replicas agree, loads {sorted(Counter(before.values()).values())}")
+
+    replicas.append(replica('replica-new'))
+    settle(replicas)
+    after = check_agreement(replicas, keys)
+    print(f"join: {moved(before, after):.1%} of keys moved, all to the new replica: "
+          f"{all(after[k] == 'replica-new' for k in keys if before[k] != after[k])}")
+
+    # One replica dies without leaving, the others drop it after the ttl
+    dead = replicas.pop(0)
+    time.sleep(args.ttl * 1.2)
+    settle(replicas)
+    expired = check_agreement(replicas, keys)
+    print(f"expiry of {dead.member_id}: {moved(after, expired):.1%} of keys moved, "
+          f"only its own: {all(after[k] == dead.member_id for k in keys if after[k] != expired[k])}")
+
+    gone = replicas.pop()
+    gone.leave()
+    settle(replicas)
+    left = check_agreement(replicas, keys)
+    print(f"leave of {gone.member_id}: {moved(expired, left):.1%} of keys moved")
+    for member in replicas:
+        member.leave()
+
+
+def work_queue_run(args, client):
+    """Scraper notifications on sharded streams, read by two analyzer replicas"""
+    stream = 'bench_new_tweets'
+    members = [
+        Membership(client, 'bench-analyzer', member_id=f'analyzer-{i}', vnodes=args.vnode_default)
+        for i in range(2)
+    ]
+    queues = [
+        TweetWorkQueue(client, stream=stream, group='bench', consumer=member.member_id, shards=args.shards)
+        for member in members
+    ]
+    for member, queue in zip(members, queues):
+        member.on_change(queue.assign)
+    settle(members)
+
+    kols = [f'kol_{i}' for i in range(args.kols)]
+    pipe = client.pipeline(transaction=False)
+    for _ in range(3):
+        for kol in kols:
+            pipe.xadd(shard_stream(stream, kol, args.shards), {'username': kol, 'count': 1})
+    pipe.execute()
+
+    seen = [set(), set()]
+    for _ in range(20):
+        for i, queue in enumerate(queues):
+            by_user = queue.read(count=500, block_ms=1)
+            seen[i].update(by_user)
+            for entries in by_user.values():
+                queue.ack_entries(entries)
+
+    overlap = seen[0] & seen[1]
+    print(
+        f"work queues: {len(seen[0])} + {len(seen[1])} KOLs over {args.shards} shards, "
+        f"{len(overlap)} read by both, {len(set(kols) - seen[0] - seen[1])} never read"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replicas', type=int, default=4)
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--vnodes', type=int, nargs='+', default=[1, 16, 64, 256])
+    parser.add_argument('--vnode-default', type=int, default=64)
+    parser.add_argument('--ttl', type=float, default=0.5, help='heartbeat ttl in seconds for the expiry check')
+    parser.add_argument('--shards', type=int, default=32)
+    parser.add_argument('--kols', type=int, default=500)
+    parser.add_argument('--redis-host')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    args = parser.parse_args()
+
+    keys = [f'kol:user_{i}' for i in range(args.keys)]
+    ring_table(args, keys)
+
+    ring = HashRing([f'replica-{i}' for i in range(args.replicas)], args.vnode_default)
+    started = time.perf_counter()
+    for key in keys:
+        ring.owner(key)
+    print(f"owner lookups: {len(keys) / (time.perf_counter() - started):,.0f}/s")
+
+    client = connect(args)
+    membership_run(args, client, keys[:10000])
+    work_queue_run(args, client)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""End-to-end benchmark of the scraper -> analyzer pipeline
+
+Runs TwitterScraper and EmotionAnalyzer in one process against fakeredis and
+mongomock with a stand-in model whose cost grows with padded tokens, so no
+services, network or torch are needed. --redis-host and --mongo-uri point it
+at local servers instead, which takes the in-memory stand-ins' own overhead
+out of the numbers (use throwaway instances, tweets are written to
+emotion_tweets.tweets). Mock KOL timelines and event searches
+are produced at a fixed rate. Their tweets go through the scraper's dedup,
+bulk upsert and stream notification, then through the analyzer service's
+ingest, inference and persist stages.
+
+Reports throughput, end-to-end latency percentiles (generation to persisted
+result) and per-stage call timings, and writes them as JSON for comparing
+commits:
+
+    pip install fakeredis mongomock
+    python test/benchmarks/bench_pipeline.py --rate 500 --duration 20 --output bench_pipeline.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(ROOT, 'emotion-analyzer'))
+sys.path.insert(0, os.path.join(ROOT, 'scraper'))
+
+try:
+    import fakeredis
+    import mongomock
+except ImportError:
+    fakeredis = mongomock = None
+
+
+class StandInTokenizer:
+    """Word and CJK-character tokenizer with the calls TextChunker makes"""
+
+    is_fast = True
+    model_max_length = 512
+    pattern = re.compile(r'[一-鿿]|\w+|[^\w\s]')
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 2
+
+    def __call__(self, texts, add_special_tokens=True, truncation=False, return_offsets_mapping=False, **kwargs):
+        spans = [[m.span() for m in self.pattern.finditer(text)] for text in texts]
+        encoded = {'input_ids': [list(range(len(s))) for s in spans]}
+        if return_offsets_mapping:
+            encoded['offset_mapping'] = spans
+        return encoded
+
+
+class StandInModel:
+    """Pipeline-shaped model costing a fixed overhead per batch plus a constant per padded token"""
+
+    labels = ('positive', 'negative', 'neutral')
+
+    def __init__(self, per_batch: float, per_token: float):
+        self.tokenizer = StandInTokenizer()
+        self.model = None
+        self.per_batch = per_batch
+        self.per_token = per_token
+        self.lock = threading.Lock()
+
+    def __call__(self, texts, batch_size=None, top_k=None, truncation=True, **kwargs):
+        lengths = [min(len(ids), 510) + 2 for ids in self.tokenizer(texts)['input_ids']]
+        # One model, one batch at a time, like a forward pass saturating the CPU
+        with self.lock:
+            time.sleep(self.per_batch + len(texts) * max(lengths) * self.per_token)
+
+        outputs = []
+        for text in texts:
+            top = hash(text) % 3
+            score = 0.5 + (hash(text) % 50) / 100
+            rest = (1 - score) / 2
+            outputs.append(
+                [{'label': self.labels[top], 'score': score}] +
+                [{'label': label, 'score': rest} for i, label in enumerate(self.labels) if i != top]
+            )
+        return outputs
+
+
+class StageTimer:
+    """Per-call durations of wrapped methods"""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def wrap(self, obj, method: str, stage: str, after=None):
+        original = getattr(obj, method)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            result = original(*args, **kwargs)
+            finished = time.perf_counter()
+            with self.lock:
+                self.durations[stage].append(finished - started)
+            if after is not None:
+                after(args, result, finished)
+            return result
+
+        setattr(obj, method, timed)
+
+    def report(self):
+        report = {}
+        for stage, durations in self.durations.items():
+            values = np.array(durations) * 1000
+            report[stage] = {
+                'calls': len(values),
+                'total_s': round(float(values.sum() / 1000), 3),
+                'p50_ms': round(float(np.percentile(values, 50)), 3),
+                'p95_ms': round(float(np.percentile(values, 95)), 3)
+            }
+        return report
+
+
+def percentiles(values):
+    if not values:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    values = np.array(values) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_services(args):
+    """Scraper and analyzer wired to shared Redis and MongoDB, in memory unless servers are given"""
+    if (not args.redis_host or not args.mongo_uri) and fakeredis is None:
+        sys.exit("bench_pipeline.py needs the local stand-ins: pip install fakeredis mongomock")
+
+    if args.redis_host:
+        host, _, port = args.redis_host.partition(':')
+        os.environ['REDIS_HOST'] = host
+        os.environ['REDIS_PORT'] = port or '6379'
+    else:
+        import redis
+        server = fakeredis.FakeServer()
+
+        class LocalRedis(fakeredis.FakeRedis):
+            def __init__(self, *a, **kwargs):
+                kwargs.pop('host', None)
+                kwargs.pop('port', None)
+                super().__init__(*a, server=server, **kwargs)
+
+        redis.Redis = LocalRedis
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        mongo = MongoClient(args.mongo_uri)
+    else:
+        mongo = mongomock.MongoClient()
+
+    from loguru import logger
+    import main as scraper_main
+    import analyzer as analyzer_main
+
+    # Keep the service log files out of the way and the console readable
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    scraper_main.MongoClient = lambda *a, **kwargs: mongo
+    analyzer_main.MongoClient = lambda *a, **kwargs: mongo
+    analyzer_main.load_backend = lambda *a, **kwargs: StandInModel(args.batch_overhead_ms / 1000, args.token_us / 1e6)
+
+    return scraper_main.TwitterScraper(), analyzer_main.EmotionAnalyzer()
+
+
+def run(args):
+    os.environ.setdefault('NEW_TWEETS_BLOCK_MS', '50')
+    os.environ.setdefault('TREND_INTERVAL', '3600')
+    os.environ.setdefault('EMOTION_READY_FILE', '')
+    os.environ.setdefault('EMOTION_MODEL_CACHE', '')
+
+    scraper, analyzer = build_services(args)
+    from service import AnalyzerService
+
+    timer = StageTimer()
+    generated_at = {}
+    stored_at = {}
+    analyzed_at = {}
+
+    def record_stored(call_args, stored, finished):
+        for tweet in stored:
+            stored_at[tweet.tweet_id] = finished
+
+    def record_analyzed(call_args, results, finished):
+        for result in results:
+            analyzed_at.setdefault(result['tweetId'], finished)
+
+    timer.wrap(scraper, 'ingest_tweets', 'scrape_store', after=record_stored)
+    timer.wrap(analyzer, 'fetch_unanalyzed', 'fetch')
+    timer.wrap(analyzer, 'infer_tweets', 'infer')
+    timer.wrap(analyzer, 'persist_tweet_batch', 'persist', after=record_analyzed)
+    timer.wrap(analyzer, 'update_kol_aggregate', 'kol_aggregate')
+    # Runs on the rollup flush thread, off the tweet write path
+    timer.wrap(analyzer.rollups, 'write', 'rollup_flush')
+
+    # Analyzer service on its own event loop, like the real process
+    loop = asyncio.new_event_loop()
+    service = AnalyzerService(analyzer)
+    task = loop.create_task(service.run())
+
+    def serve():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    service_thread = threading.Thread(target=serve, daemon=True)
+    service_thread.start()
+
+    kols = [f'kol_{i}' for i in range(args.kols)]
+    events = [{'id': str(i), 'keywords': [f'topic{i}', f'#tag{i}']} for i in range(args.events)]
+    sequence = 0
+    produced = 0
+    started = time.perf_counter()
+    deadline = started + args.duration
+    next_batch = started
+
+    # Alternate KOL timelines and event searches at the configured tweet rate
+    while time.perf_counter() < deadline:
+        if sequence % (args.event_every + 1) == args.event_every and events:
+            event = events[sequence % len(events)]
+            generate = time.perf_counter()
+            tweets = scraper.generate_event_tweets_with_keywords(event['keywords'], args.event_batch)
+            scope, target = 'event', event['id']
+        else:
+            username = kols[sequence % len(kols)]
+            generate = time.perf_counter()
+            tweets = scraper.generate_mock_tweets(username, args.timeline_batch)
+            scope, target = 'kol', username
+
+        for i, tweet in enumerate(tweets):
+            if not args.repeat_text:
+                # Mock texts come from a few templates, keep the inference cache from serving them all
+                tweet.content = f"{tweet.content} ({sequence}.{i})"
+            generated_at[tweet.tweet_id] = generate
+        # Every batch counts as new so the watermark does not drop mock history
+        scraper.watermarks.redis_client.hdel(scraper.watermarks.key, f'{scope}:{target}')
+
+        scraper.ingest_tweets(scope, target, tweets)
+        produced += len(tweets)
+        sequence += 1
+
+        next_batch += len(tweets) / args.rate
+        pause = next_batch - time.perf_counter()
+        if pause > 0:
+            time.sleep(pause)
+
+    produced_for = time.perf_counter() - started
+
+    # Let the analyzer drain what was produced
+    drain_deadline = time.perf_counter() + args.drain_timeout
+    while len(analyzed_at) < len(stored_at) and time.perf_counter() < drain_deadline:
+        time.sleep(0.05)
+    finished = time.perf_counter()
+
+    loop.call_soon_threadsafe(task.cancel)
+    service_thread.join(timeout=5)
+    scraper.scheduler.shutdown(wait=False)
+
+    latencies = [analyzed_at[i] - generated_at[i] for i in analyzed_at if i in generated_at]
+    queue_lags = [analyzed_at[i] - stored_at[i] for i in analyzed_at if i in stored_at]
+    last_result = max(analyzed_at.values()) if analyzed_at else finished
+
+    report = {
+        'commit': git_commit(),
+        'config': vars(args),
+        'produced': produced,
+        'stored': len(stored_at),
+        'analyzed': len(analyzed_at),
+        'produce_rate': round(produced / produced_for, 1),
+        'throughput': round(len(analyzed_at) / max(last_result - started, 1e-9), 1),
+        'drained': len(analyzed_at) >= len(stored_at),
+        'end_to_end': percentiles(latencies),
+        'store_to_result': percentiles(queue_lags),
+        'stages': timer.report(),
+        'inference_cache': dict(analyzer.inference_cache.stats),
+        'mongo_writes_per_round_trip': round(analyzer.writes_per_round_trip(), 1)
+    }
+    if analyzer.batcher is not None:
+        report['batching'] = {k: round(v, 4) for k, v in analyzer.batcher.metrics().items()}
+        analyzer.batcher.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=float, default=500, help='tweets produced per second')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of production')
+    parser.add_argument('--kols', type=int, default=200)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--timeline-batch', type=int, default=20)
+    parser.add_argument('--event-batch', type=int, default=50)
+    parser.add_argument('--event-every', type=int, default=4, help='KOL timelines between event searches')
+    parser.add_argument('--batch-overhead-ms', type=float, default=2.0, help='stand-in model cost per batch')
+    parser.add_argument('--token-us', type=float, default=20.0, help='stand-in model cost per padded token')
+    parser.add_argument('--repeat-text', action='store_true', help='keep the mock templates as is, mostly cache hits')
+    parser.add_argument('--redis-host', help='host[:port] of a local Redis instead of fakeredis')
+    parser.add_argument('--mongo-uri', help='URI of a local MongoDB instead of mongomock')
+    parser.add_argument('--drain-timeout', type=float, default=60)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    # The services open their log files in the working directory
+    os.chdir(tempfile.mkdtemp(prefix='bench_pipeline_'))
+    report = run(args)
+
+    print(f"produced {report['produced']} tweets at {report['produce_rate']}/s, analyzed {report['analyzed']}")
+    print(f"throughput {report['throughput']} tweets/s, drained: {report['drained']}")
+    e2e = report['end_to_end']
+    print(f"end-to-end latency p50 {e2e['p50_ms']}ms p95 {e2e['p95_ms']}ms p99 {e2e['p99_ms']}ms")
+    print(f"{'stage':14} {'calls':>7} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for stage, stats in report['stages'].items():
+        print(f"{stage:14} {stats['calls']:7} {stats['total_s']:9.3f} {stats['p50_ms']:9.3f} {stats['p95_ms']:9.3f}")
+
+    if args.output:
+        with open(os.path.join(ROOT, args.output) if not os.path.isabs(args.output) else args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Tweet records and message encoding against document dicts and JSON
+
+Builds the same tweets as MongoDB-shaped dicts (nested metrics, datetimes)
+and as TweetRecords and reports the memory each takes per 100k tweets,
+measured with tracemalloc including the strings they hold. Then it times
+encode and decode of:
+
+- batches of tweets: JSON of the dicts, against the msgpack frame of records
+- kol_emotion_updates messages: JSON against the msgpack frame of the same dict
+
+Every decoded msgpack payload is checked against its input.
+
+    python test/benchmarks/bench_records.py --tweets 100000 --batch 200
+"""
+import os
+import sys
+import gc
+import time
+import random
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from common.records import TweetRecord, encode, decode, MSGPACK_AVAILABLE
+
+WORDS = 'market launch crypto ai model policy rally crash vote update release growth risk data'.split()
+
+
+def make_doc(i: int, rng, now: datetime) -> dict:
+    """A tweet as the scraper stores it, with fresh strings every call"""
+    return {
+        'tweetId': f'tweet_{i}',
+        'content': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))),
+        'createdAt': now - timedelta(seconds=rng.randrange(86400)),
+        'authorUsername': f'kol_{rng.randrange(500)}',
+        'authorFollowers': rng.randint(100, 10000000),
+        'metrics': {
+            'likes': rng.randint(0, 5000),
+            'retweets': rng.randint(0, 2000),
+            'replies': rng.randint(0, 500),
+            'views': rng.randint(0, 100000)
+        },
+        'isReply': False,
+        'isRetweet': False,
+        'hashtags': [rng.choice(WORDS)] if rng.random() < 0.3 else [],
+        'mentions': [],
+        'eventIds': [str(rng.randrange(20))] if rng.random() < 0.2 else [],
+        'scrapedAt': now
+    }
+
+
+def measure(build) -> tuple:
+    """Objects returned by build and the bytes they hold"""
+    gc.collect()
+    tracemalloc.start()
+    objects = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return objects, size
+
+
+def rate(function, items, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            function(item)
+    return len(items) * repeat / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=200, help='tweets or KOL updates per message')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    if not MSGPACK_AVAILABLE:
+        sys.exit("msgpack is not installed")
+
+    now = datetime.utcnow().replace(microsecond=0)
+    rng = random.Random(5)
+    docs, doc_bytes = measure(lambda: [make_doc(i, rng, now) for i in range(args.tweets)])
+    rng = random.Random(5)
+    records, record_bytes = measure(
+        lambda: [TweetRecord.from_doc(make_doc(i, rng, now)) for i in range(args.tweets)]
+    )
+    per = 100000 / args.tweets
+    print(f"memory per 100k tweets: dicts {doc_bytes * per / 1e6:.1f} MB, "
+          f"records {record_bytes * per / 1e6:.1f} MB ({doc_bytes / record_bytes:.1f}x smaller)")
+
+    # Tweet batches, as JSON text of the documents and as msgpack frames of records
+    doc_batches = [docs[i:i + args.batch] for i in range(0, len(docs), args.batch)]
+    record_batches = [records[i:i + args.batch] for i in range(0, len(records), args.batch)]
+    json_payloads = [encode(batch) for batch in doc_batches]
+    binary_payloads = [encode(batch, 'msgpack') for batch in record_batches]
+    assert all(decode(payload) == batch for payload, batch in zip(binary_payloads, record_batches))
+
+    rows = [
+        ('tweets json', rate(encode, doc_batches, args.repeat), rate(decode, json_payloads, args.repeat),
+         sum(len(p.encode('utf-8')) for p in json_payloads)),
+        ('tweets msgpack', rate(lambda b: encode(b, 'msgpack'), record_batches, args.repeat),
+         rate(decode, binary_payloads, args.repeat), sum(len(p) for p in binary_payloads)),
+    ]
+
+    # kol_emotion_updates messages as published by the analyzer
+    updates = [
+        {
+            'type': 'kol_emotion_updates',
+            'data': [
+                {
+                    'username': f'kol_{i * args.batch + j}',
+                    'emotionScore': rng.random(),
+                    'propagationScore': rng.random() * 100,
+                    'dominantEmotion': rng.choice(['joy', 'anger', 'fear', 'neutral']),
+                    'tweetCount': rng.randint(1, 50),
+                    'lastUpdated': now.isoformat()
+                }
+                for j in range(args.batch)
+            ],
+            'timestamp': now.isoformat()
+        }
+        for i in range(max(args.tweets // (args.batch * 10), 10))
+    ]
+    json_updates = [encode(message) for message in updates]
+    binary_updates = [encode(message, 'msgpack') for message in updates]
+    assert all(decode(payload) == message for payload, message in zip(binary_updates, updates))
+    rows += [
+        ('updates json', rate(encode, updates, args.repeat), rate(decode, json_updates, args.repeat),
+         sum(len(p.encode('utf-8')) for p in json_updates)),
+        ('updates msgpack', rate(lambda m: encode(m, 'msgpack'), updates, args.repeat),
+         rate(decode, binary_updates, args.repeat), sum(len(p) for p in binary_updates)),
+    ]
+
+    print(f"{'payload':<16} {'encode msg/s':>13} {'decode msg/s':>13} {'bytes/msg':>10}")
+    for name, encoded, decoded, size in rows:
+        count = len(doc_batches) if name.startswith('tweets') else len(updates)
+        print(f"{name:<16} {encoded:>13,.0f} {decoded:>13,.0f} {size / count:>10,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Micro-benchmark for columnar engagement and propagation scoring
+
+Checks that the vectorized path in scoring.score_columns returns exactly the
+same engagement rates and propagation scores as the per-tweet path, on fixed
+edge cases, seeded rows and a batch with malformed rows, then times both at
+increasing batch sizes. The speedup column counts building the columns from
+the records, which is what the analyzer pays per batch. The kernel column
+leaves it out. --check-only runs only the bit-identity check and exits
+non-zero on any difference.
+
+    python test/benchmarks/bench_scoring.py --rows 10000 100000 1000000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from types import SimpleNamespace
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'emotion-analyzer'))
+
+from common.records import TweetRecord
+from scoring import EMOTION_WEIGHTS, engagement_rate, propagation_score, to_columns, score_columns
+
+
+def make_batch(rows: int, rng):
+    """Synthetic tweets and emotion results, including unscored and unknown labels"""
+    emotions = list(EMOTION_WEIGHTS) + ['disgust']
+    tweets = []
+    results = []
+
+    for i in range(rows):
+        tweet = {
+            'tweetId': str(i),
+            'metrics': {
+                'likes': int(rng.integers(0, 10000)),
+                'retweets': int(rng.integers(0, 5000)),
+                'replies': int(rng.integers(0, 1000))
+            }
+        }
+        if i % 7:
+            tweet['authorFollowers'] = int(rng.integers(0, 1000000))
+        tweets.append(TweetRecord.from_doc(tweet))
+
+        if i % 50 == 0:
+            # Empty text or failed inference
+            results.append({'emotion': 'neutral', 'score': 0.5, 'propagation_score': 0, 'raw_scores': {}})
+        else:
+            emotion = emotions[i % len(emotions)]
+            score = float(rng.random())
+            results.append({
+                'emotion': emotion,
+                'score': score,
+                'propagation_score': propagation_score(emotion, score),
+                'raw_scores': {emotion: score}
+            })
+
+    return tweets, results
+
+
+def scalar_path(tweets, results):
+    """Per-tweet scoring as done before the columnar path"""
+    engagement = []
+    propagation = []
+    for tweet, result in zip(tweets, results):
+        metrics = {'likes': tweet.likes, 'retweets': tweet.retweets, 'replies': tweet.replies}
+        rate = engagement_rate(metrics, 1 if tweet.followers is None else tweet.followers)
+        engagement.append(rate)
+        propagation.append(result['propagation_score'] * (1 + rate))
+    return engagement, propagation
+
+
+def check_identity(rows: int = 1000, seed: int = 7) -> list:
+    """Rows where score_columns differs from the per-tweet path, on edge cases and seeded rows
+
+    Rows that are malformed on purpose must be masked out, every other row
+    of their batch must still match.
+    """
+    cases = [
+        # likes, retweets, replies, followers, emotion, score, scored
+        (0, 0, 0, None, 'joy', 0.0, True),
+        (1, 1, 1, 0, 'anger', 1.0, True),
+        (7, 3, 5, 1, 'fear', 1 / 3, True),
+        (2 ** 40, 2 ** 39, 2 ** 38, 3, 'sadness', 0.1, True),
+        (10, 0, 3, 2 ** 40, 'surprise', 0.999999, True),
+        (5, 2, 1, 7, 'neutral', 0.5, True),
+        (5, 2, 1, 7, 'disgust', 0.75, True),
+        (5, 2, 1, 7, 'neutral', 0.5, False)
+    ]
+    rng = random.Random(seed)
+    emotions = list(EMOTION_WEIGHTS) + ['disgust']
+    for _ in range(rows):
+        cases.append((
+            rng.randrange(10000), rng.randrange(5000), rng.randrange(1000),
+            None if rng.random() < 0.1 else rng.randrange(1000000),
+            rng.choice(emotions), rng.random(), rng.random() > 0.02
+        ))
+
+    tweets = []
+    results = []
+    for likes, retweets, replies, followers, emotion, score, scored in cases:
+        tweets.append(SimpleNamespace(likes=likes, retweets=retweets, replies=replies, followers=followers))
+        results.append({
+            'emotion': emotion,
+            'score': score,
+            'propagation_score': propagation_score(emotion, score) if scored else 0,
+            'raw_scores': {emotion: score} if scored else {}
+        })
+
+    # Unreadable metrics, a missing score and a count too large for int64
+    malformed = {3: ('likes', None), len(cases) // 2: ('score', None), len(cases) - 1: ('replies', 2 ** 70)}
+    bad_tweets = list(tweets)
+    bad_results = list(results)
+    for i, (field, value) in malformed.items():
+        if field == 'score':
+            bad_results[i] = {key: item for key, item in results[i].items() if key != 'score'}
+        else:
+            bad_tweets[i] = SimpleNamespace(**dict(vars(tweets[i]), **{field: value}))
+
+    scalar_engagement, scalar_propagation = scalar_path(tweets, results)
+    mismatches = set()
+    for batch_tweets, batch_results, expected_invalid in (
+        (tweets, results, set()),
+        (bad_tweets, bad_results, set(malformed))
+    ):
+        columns, valid = to_columns(batch_tweets, batch_results)
+        engagement, propagation = score_columns(**columns)
+        for i in range(len(cases)):
+            if i in expected_invalid:
+                if valid[i]:
+                    mismatches.add(i)
+                continue
+            if not (valid[i]
+                    and np.array_equal(engagement[i], scalar_engagement[i])
+                    and np.array_equal(propagation[i], scalar_propagation[i])):
+                mismatches.add(i)
+    return sorted(mismatches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--check-only', action='store_true', help='run the bit-identity check and exit')
+    args = parser.parse_args()
+
+    mismatches = check_identity()
+    if mismatches:
+        print(f"score_columns differs from the per-tweet path at rows {mismatches[:20]}")
+        sys.exit(1)
+    print("score_columns is bit-identical to the per-tweet path")
+    if args.check_only:
+        return
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'rows':>10} {'scalar':>10} {'columnar':>10} {'(+build)':>10} {'speedup':>8} {'kernel':>8}")
+
+    for rows in args.rows:
+        tweets, results = make_batch(rows, rng)
+
+        start = time.perf_counter()
+        scalar_engagement, scalar_propagation = scalar_path(tweets, results)
+        scalar_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        columns, valid = to_columns(tweets, results)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        engagement, propagation = score_columns(**columns)
+        columnar_time = time.perf_counter() - start
+
+        # The columnar path must be bit-identical to the scalar one
+        if not (valid.all()
+                and np.array_equal(engagement, np.array(scalar_engagement))
+                and np.array_equal(propagation, np.array(scalar_propagation))):
+            print(f"MISMATCH at {rows} rows")
+            sys.exit(1)
+
+        print(
+            f"{rows:>10} {scalar_time * 1000:>8.1f}ms {columnar_time * 1000:>8.1f}ms "
+            f"{(columnar_time + build_time) * 1000:>8.1f}ms "
+            f"{scalar_time / (columnar_time + build_time):>7.1f}x {scalar_time / columnar_time:>7.0f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()